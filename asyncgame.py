@@ -0,0 +1,196 @@
+"""
+Игровой цикл GameManager на asyncio.
+
+Тики, ввод и отрисовка - отдельные корутины одной игры:
+
+    tick   - ходит змейкой по расписанию TickScheduler и
+             помечает, что есть новый кадр
+    input  - перекладывает направления из асинхронного
+             источника в очередь нажатий игры
+    render - рисует последнее состояние поля, когда дойдёт
+             очередь; если отстал, промежуточные кадры
+             пропускаются, а тики идут по своему расписанию
+
+Игры не блокируют цикл событий, поэтому в одном процессе
+их можно запустить сколько угодно через play_many.
+"""
+import asyncio
+from time import perf_counter
+from typing import AsyncIterable, Iterable, Optional
+
+from instrument import Counters
+from timing import TickScheduler, TickStats
+
+
+async def play_async(
+        game,
+        renderer=None,
+        inputs: Optional[AsyncIterable[str]] = None,
+        save_logs: bool = False,
+        max_fps: Optional[float] = None,
+        render_thread: bool = False,
+        max_ticks: Optional[int] = None,
+) -> dict:
+    """
+    Играет одну игру GameManager до победы или проигрыша.
+    renderer - куда рисовать, None - без вывода.
+    inputs - асинхронный источник направлений; если не
+    задан, регистрируются кнопки клавиатуры, как в play.
+    max_fps - не рисовать чаще, чем столько кадров в секунду.
+    render_thread - выводить кадр в отдельном потоке, чтобы
+    медленный терминал не задерживал тики. Снимок кадра всё
+    равно берётся в цикле событий, между тиками.
+    max_ticks - оборвать игру через столько тиков.
+    Хуки game.hooks и счётчики game.counters работают как
+    в play, только кадр рисует своя корутина: before_render
+    и after_render вызываются на каждый нарисованный кадр,
+    а не на каждый тик, пропущенные кадры их не вызывают.
+    Время отрисовки идёт в счётчики тика, во время которого
+    кадр рисовался, и вычитается из его ожидания.
+    Возвращает итог игры и сколько кадров нарисовано
+    и пропущено.
+    """
+    writer = None
+    if save_logs and not game.field.field.sparse:
+        from replay import ReplayWriter
+
+        writer = ReplayWriter(game.log_path(), game.field, game.delay)
+
+    if inputs is None:
+        game.set_keys()
+
+    # без хуков цикл не тратит на них ни одного вызова
+    hooks = game.hooks if game.hooks else None
+    counters = game.counters = Counters(game.field, renderer)
+    scheduler = TickScheduler(game.delay)
+    game.tick_stats = TickStats()
+    game.inputs.clear()
+    game.start_session()
+
+    # есть ли кадр, который ещё не нарисован
+    dirty = asyncio.Event()
+    # тики кончились
+    finished = asyncio.Event()
+    result = {'ticks': 0, 'frames': 0, 'skipped_frames': 0}
+    # время отрисовки, ещё не отнесённое ни к одному тику
+    render_time = [0.0]
+
+    async def tick() -> None:
+        scheduler.start()
+        while game.field.game_status() == 'game':
+            if max_ticks is not None and result['ticks'] >= max_ticks:
+                break
+            started = perf_counter()
+            if hooks is not None:
+                hooks.fire('before_tick', game)
+                hooks.fire('before_move', game)
+            direction = game.inputs.next_direction(game.direction)
+            game.direction = direction
+            game.field.move_snake(direction)
+            game.add_move(direction)
+            if writer is not None:
+                writer.record(direction, game.field)
+            if hooks is not None:
+                hooks.fire('after_move', game)
+            moved = perf_counter()
+
+            result['ticks'] += 1
+            if dirty.is_set():
+                # прошлый кадр так и не нарисовали
+                result['skipped_frames'] += 1
+            dirty.set()
+
+            if hooks is not None:
+                hooks.fire('after_tick', game)
+            ticked = perf_counter()
+            overshoot = await scheduler.wait_async()
+            waited = perf_counter()
+            rendered, render_time[0] = render_time[0], 0.0
+            game.tick_stats.add(moved - started, 0.0, overshoot)
+            counters.add(
+                moved - started,
+                rendered,
+                max(waited - ticked - rendered, 0.0),
+            )
+        finished.set()
+        # будим отрисовку, чтобы она закончилась
+        dirty.set()
+
+    async def read_input() -> None:
+        async for direction in inputs:
+            game.inputs.push(direction)
+
+    async def render() -> None:
+        period = 1 / max_fps if max_fps else 0.0
+        # тик, чей кадр нарисован последним
+        drawn = None
+        while True:
+            await dirty.wait()
+            dirty.clear()
+            if drawn != result['ticks']:
+                started = perf_counter()
+                drawn = result['ticks']
+                if hooks is not None:
+                    hooks.fire('before_render', game)
+                frame = renderer.capture(game.field)
+                if render_thread:
+                    await asyncio.to_thread(renderer.draw, *frame)
+                else:
+                    renderer.draw(*frame)
+                if hooks is not None:
+                    hooks.fire('after_render', game)
+                render_time[0] += perf_counter() - started
+                result['frames'] += 1
+            # последний кадр игры рисуется всегда
+            if finished.is_set() and drawn == result['ticks']:
+                return None
+            if period:
+                await asyncio.sleep(period - (perf_counter() - started))
+
+    input_task = None
+    if inputs is not None:
+        input_task = asyncio.create_task(read_input())
+    render_task = None
+    if renderer is not None:
+        render_task = asyncio.create_task(render())
+
+    try:
+        await tick()
+        if render_task is not None:
+            await render_task
+    finally:
+        for task in (input_task, render_task):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if writer is not None:
+            writer.close(game.field)
+        game.finish_session()
+        # последний кадр рисуется уже после последнего тика
+        counters.render += render_time[0]
+        counters.finish()
+
+    if renderer is not None:
+        game.render_stats = renderer.stats()
+    game.input_stats = game.inputs.summary()
+
+    status = game.field.game_status()
+    result['outcome'] = 'timeout' if status == 'game' else status
+    result['late_ticks'] = scheduler.skipped
+    return result
+
+
+async def play_many(games: Iterable, **kwargs) -> list:
+    """
+    Играет несколько игр на одном цикле событий.
+    kwargs передаются в play_async каждой игры, кроме
+    inputs и renderer: их можно задать списками по играм
+    через inputs_list и renderers.
+    """
+    games = list(games)
+    inputs_list = kwargs.pop('inputs_list', [None] * len(games))
+    renderers = kwargs.pop('renderers', [None] * len(games))
+    return await asyncio.gather(*(
+        play_async(game, renderer=renderer, inputs=inputs, **kwargs)
+        for game, renderer, inputs in zip(games, renderers, inputs_list)
+    ))
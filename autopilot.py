@@ -0,0 +1,238 @@
+"""
+Автопилот: контроллер, который ведёт змейку к яблоку.
+
+Для каждого яблока один раз считается карта расстояний до него
+поиском в ширину по стенам поля с переносом через края, как ходит
+сама змейка. Тело змейки в карту не входит: оно проверяется на
+каждом ходу отдельно. Карты лежат в кэше по раскладке стен и
+клетке яблока, поэтому игры на одном уровне пользуются общими
+картами, а новая карта считается только когда яблоко переехало.
+
+Работает с плотным полем Grid, на разреженном - ValueError.
+
+Запуск: python autopilot.py --seeds 20 - турнир автопилота на
+уровнях кампании и скорость принятия решений.
+"""
+import argparse
+from array import array
+from collections import OrderedDict, deque
+from time import perf_counter
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from inputs import is_turn
+from objects import Grid, Field
+
+
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+# недостижимая клетка в карте расстояний
+UNREACHABLE = -1
+
+
+def neighbours(index: int, x_len: int, y_len: int) -> tuple:
+    """Соседние клетки в порядке DIRECTIONS с переносом через края"""
+    row, col = divmod(index, y_len)
+    return (
+        (row - 1) % x_len * y_len + col,
+        (row + 1) % x_len * y_len + col,
+        row * y_len + (col - 1) % y_len,
+        row * y_len + (col + 1) % y_len,
+    )
+
+
+def distance_map(walls: bytes, x_len: int, y_len: int, target: int) -> array:
+    """
+    Расстояние от каждой клетки до target в ходах, только
+    по клеткам без стен. UNREACHABLE - до target не дойти.
+    """
+    distance = array('i', [UNREACHABLE]) * (x_len * y_len)
+    distance[target] = 0
+    queue = deque([target])
+    while queue:
+        index = queue.popleft()
+        step = distance[index] + 1
+        for neighbour in neighbours(index, x_len, y_len):
+            if distance[neighbour] == UNREACHABLE \
+               and walls[neighbour] != Grid.LET:
+                distance[neighbour] = step
+                queue.append(neighbour)
+    return distance
+
+
+class Autopilot:
+    """
+    Контроллер controller(field, direction) -> direction
+    для GameManager.play(controller=...), run_headless и турнира.
+
+    Ход выбирается к соседней клетке с наименьшим расстоянием
+    до яблока среди клеток без стен и тела. Ход безопасный,
+    если после него змейке хватает места на всю длину или
+    можно доползти до своего хвоста. Из опасных ходов, когда
+    других нет, берётся тот, где места больше.
+    """
+    # сколько карт расстояний держать в кэше
+    CACHE_SIZE = 256
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache_size = cache_size
+        # (раскладка стен, клетка яблока) -> карта расстояний
+        self.maps = OrderedDict()
+        # поле Grid -> (версия стен, ключ раскладки); поля
+        # держатся слабо и уходят из кэша вместе со своей игрой
+        self.layouts = WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.decisions = 0
+
+    def layout(self, grid: Grid) -> tuple:
+        """
+        Ключ раскладки стен поля. Обычно стены за игру не
+        меняются, поэтому ключ считается один раз на поле и
+        заново, только если поменялась grid.walls_version.
+        """
+        if grid.sparse:
+            raise ValueError('Автопилот работает только с плотным полем Grid')
+        cached = self.layouts.get(grid)
+        if cached is not None and cached[0] == grid.walls_version:
+            return cached[1]
+        walls = bytes(
+            Grid.LET if code == Grid.LET else Grid.DEFAULT
+            for code in grid.cells
+        )
+        key = (grid.x_len, grid.y_len, walls)
+        self.layouts[grid] = (grid.walls_version, key)
+        return key
+
+    def distances(self, grid: Grid, apple: int) -> array:
+        """Карта расстояний до яблока из кэша или новая"""
+        layout = self.layout(grid)
+        key = (layout, apple)
+        distance = self.maps.get(key)
+        if distance is not None:
+            self.hits += 1
+            self.maps.move_to_end(key)
+            return distance
+        self.misses += 1
+        x_len, y_len, walls = layout
+        distance = distance_map(walls, x_len, y_len, apple)
+        self.maps[key] = distance
+        if len(self.maps) > self.cache_size:
+            self.maps.popitem(last=False)
+        return distance
+
+    @staticmethod
+    def find_apple(grid: Grid) -> Optional[int]:
+        index = grid.cells.find(Grid.APPLE)
+        return None if index == -1 else index
+
+    @staticmethod
+    def room(grid: Grid, start: int, limit: int, tail: int) -> tuple:
+        """
+        Сколько свободных клеток доступно из start (не больше
+        limit) и можно ли оттуда дойти до хвоста: за хвостом
+        место освобождается, пока змейка ползёт
+        """
+        cells = grid.cells
+        seen = {start}
+        queue = deque([start])
+        while queue and len(seen) < limit:
+            index = queue.popleft()
+            for neighbour in neighbours(index, grid.x_len, grid.y_len):
+                if neighbour == tail and index != start:
+                    return limit, True
+                if neighbour not in seen \
+                   and cells[neighbour] in (Grid.DEFAULT, Grid.APPLE):
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        return len(seen), False
+
+    def __call__(self, field: Field, direction: str) -> str:
+        self.decisions += 1
+        grid = field.field
+        cells = grid.cells
+        head = field.row_head * field.y_len + field.col_head
+        apple = self.find_apple(grid)
+        distance = None if apple is None else self.distances(grid, apple)
+
+        candidates = []
+        for move, neighbour in zip(
+                DIRECTIONS, neighbours(head, field.x_len, field.y_len)
+        ):
+            if move != direction and not is_turn(direction, move):
+                continue
+            if cells[neighbour] not in (Grid.DEFAULT, Grid.APPLE):
+                continue
+            steps = UNREACHABLE if distance is None else distance[neighbour]
+            if steps == UNREACHABLE:
+                steps = len(cells)
+            # при равных расстояниях не поворачиваем зря
+            candidates.append((steps, move != direction, move, neighbour))
+        if not candidates:
+            return direction
+
+        candidates.sort()
+        need = len(field.snake) + 1
+        row_tail, col_tail = field.snake.points[-1]
+        tail = row_tail * field.y_len + col_tail
+        best_room, best_move = -1, candidates[0][2]
+        for steps, _, move, neighbour in candidates:
+            room, reaches_tail = self.room(grid, neighbour, need, tail)
+            if reaches_tail or room >= need:
+                return move
+            # все ходы опасные - берём тот, где места больше
+            if room > best_room:
+                best_room, best_move = room, move
+        return best_move
+
+    def cache_info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maps': len(self.maps),
+            'decisions': self.decisions,
+        }
+
+
+# автопилот процесса, кэш карт общий для всех игр процесса
+_autopilot = Autopilot()
+
+
+def autopilot(field: Field, direction: str) -> str:
+    """Контроллер уровня модуля, его можно передать в турнир"""
+    return _autopilot(field, direction)
+
+
+if __name__ == '__main__':
+    import tournament
+    from objects import GameManager
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seeds', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-ticks', type=int, default=5000)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    results = tournament.run_tournament(
+        controller=autopilot,
+        seeds=range(args.seeds),
+        workers=args.workers,
+        max_ticks=args.max_ticks,
+    )
+    elapsed = perf_counter() - start
+    table = tournament.summarize(results)
+    for row in table:
+        row['win_rate'] = round(row['wins'] / row['games'], 2)
+    tournament.print_table(table)
+
+    # скорость решений без пула процессов
+    pilot = Autopilot()
+    decisions = 0
+    start = perf_counter()
+    for lvl in GameManager.ALL_LEVELS:
+        game = GameManager.get_game_by_lvl(lvl)
+        decisions += game.run_headless(pilot, args.max_ticks)['ticks']
+    decide = perf_counter() - start
+    print(f'{len(results)} игр за {elapsed:.2f} с')
+    print(f'{decisions / decide:.0f} решений/с вместе с ходом змейки, '
+          f'кэш карт: {pilot.cache_info()}')
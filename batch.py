@@ -0,0 +1,230 @@
+"""
+Пакетная симуляция: много игр Field за один шаг на NumPy.
+
+Все поля хранятся одним массивом (N, x_len, y_len) с кодами
+символов Cell, тела змеек - кольцевыми буферами индексов клеток.
+Правила хода те же, что в Field.move_snake: выход за край поля
+переносит голову на противоположную сторону, на обычной клетке
+хвост убирается, на яблоке змейка растёт, стена или тело - конец.
+
+Требует numpy.
+"""
+from typing import Optional
+
+import numpy as np
+
+from objects import Grid
+
+
+# порядок кодов направлений в массивах шагов
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+# сдвиг головы по строкам и столбцам для каждого кода
+DELTA_ROW = np.array([-1, 1, 0, 0], dtype=np.int64)
+DELTA_COL = np.array([0, 0, -1, 1], dtype=np.int64)
+
+
+class BatchField:
+    """
+    N игр на полях одного размера, которые ходят одновременно.
+
+    boards - поля (N, x_len, y_len) с кодами символов Cell
+    body - кольцевые буферы (N, cap) с индексами клеток змеек
+    head - позиция головы в кольцевом буфере
+    length - длина змеек
+    queue - очереди яблок (N, Q) с индексами клеток, -1 - пусто
+    """
+
+    def __init__(
+            self,
+            boards: np.ndarray,
+            snakes: list,
+            apples: np.ndarray,
+            queues: Optional[list] = None,
+            seed: Optional[int] = None,
+    ):
+        self.n, self.x_len, self.y_len = boards.shape
+        self.boards = np.ascontiguousarray(boards, dtype=np.uint8)
+        # плоский вид на те же данные, индекс клетки row * y_len + col
+        self.cells = self.boards.reshape(self.n, -1)
+        self.games = np.arange(self.n)
+
+        # +1, потому что на проигрышном ходу голова
+        # наезжает на уже занятую клетку
+        self.cap = self.x_len * self.y_len + 1
+        self.body = np.zeros((self.n, self.cap), dtype=np.int64)
+        self.length = np.zeros(self.n, dtype=np.int64)
+        self.head = np.zeros(self.n, dtype=np.int64)
+        for game, points in enumerate(snakes):
+            # в буфере змейка лежит от хвоста к голове
+            for position, (row, col) in enumerate(reversed(list(points))):
+                self.body[game, position] = row * self.y_len + col
+            self.length[game] = len(points)
+            self.head[game] = len(points) - 1
+
+        head_cells = self.body[self.games, self.head]
+        self.row_head, self.col_head = np.divmod(head_cells, self.y_len)
+
+        self.apples = np.asarray(apples, dtype=np.int64).copy()
+
+        queues = queues or [[] for _ in range(self.n)]
+        size = max((len(queue) for queue in queues), default=0)
+        self.queue = np.full((self.n, max(size, 1)), -1, dtype=np.int64)
+        for game, queue in enumerate(queues):
+            for position, (row, col) in enumerate(queue):
+                self.queue[game, position] = row * self.y_len + col
+        self.queue_pos = np.zeros(self.n, dtype=np.int64)
+
+        self.is_win = np.zeros(self.n, dtype=bool)
+        self.is_gameover = np.zeros(self.n, dtype=bool)
+
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_fields(
+            cls,
+            fields: list,
+            seed: Optional[int] = None,
+    ) -> 'BatchField':
+        """
+        Собирает пакет из готовых полей Field одного размера.
+        Очереди яблок берутся из field.apples_points.
+        """
+        x_len, y_len = fields[0].x_len, fields[0].y_len
+        boards = np.empty((len(fields), x_len, y_len), dtype=np.uint8)
+        for game, field in enumerate(fields):
+            if (field.x_len, field.y_len) != (x_len, y_len):
+                raise ValueError(
+                    'Все поля в пакете должны быть одного размера'
+                )
+            boards[game] = np.frombuffer(
+                field.field.cells, dtype=np.uint8
+            ).reshape(x_len, y_len)
+        batch = cls(
+            boards=boards,
+            snakes=[list(field.snake) for field in fields],
+            apples=[field.apples for field in fields],
+            queues=[list(field.apples_points) for field in fields],
+            seed=seed,
+        )
+        batch.is_win[:] = [field.is_win for field in fields]
+        batch.is_gameover[:] = [field.is_gameover for field in fields]
+        return batch
+
+    @property
+    def active(self) -> np.ndarray:
+        """Маска игр, которые ещё идут"""
+        return ~(self.is_win | self.is_gameover)
+
+    def game_status(self, game: int) -> str:
+        if self.is_win[game]:
+            return 'win'
+        elif self.is_gameover[game]:
+            return 'gameover'
+        else:
+            return 'game'
+
+    def snake_points(self, game: int) -> list:
+        """Точки змейки игры game от головы к хвосту, как в Snake"""
+        positions = (self.head[game] - np.arange(self.length[game])) % self.cap
+        return [
+            divmod(int(index), self.y_len)
+            for index in self.body[game, positions]
+        ]
+
+    def step(self, directions, gen_apple: bool = False) -> None:
+        """
+        Один ход во всех незаконченных играх.
+        directions - коды направлений (N,) из DIRECTIONS.
+        gen_apple - как в Field.move_snake: если False, следующее
+        яблоко берётся из очереди игры, если True - ставится
+        в случайную свободную клетку.
+        """
+        games = np.flatnonzero(self.active)
+        if not len(games):
+            return None
+        directions = np.asarray(directions, dtype=np.int64)[games]
+        cells = self.cells
+
+        # новая голова с переносом через края поля
+        row = (self.row_head[games] + DELTA_ROW[directions]) % self.x_len
+        col = (self.col_head[games] + DELTA_COL[directions]) % self.y_len
+        self.row_head[games] = row
+        self.col_head[games] = col
+        head_cell = row * self.y_len + col
+
+        # змейка растёт на голову
+        head = (self.head[games] + 1) % self.cap
+        self.head[games] = head
+        self.body[games, head] = head_cell
+        self.length[games] += 1
+
+        content = cells[games, head_cell]
+
+        # обычная клетка: убираем хвост
+        moved = content == Grid.DEFAULT
+        if moved.any():
+            g = games[moved]
+            tail = (self.head[g] - self.length[g] + 1) % self.cap
+            cells[g, self.body[g, tail]] = Grid.DEFAULT
+            self.length[g] -= 1
+
+        # яблоко: змейка выросла, ставим следующее яблоко
+        eaten = content == Grid.APPLE
+        if eaten.any():
+            g = games[eaten]
+            self.apples[g] -= 1
+            self.is_win[g] |= self.apples[g] <= 0
+            if gen_apple:
+                self.__insert_apples(g[self.apples[g] > 0])
+            else:
+                self.__pop_apples(g)
+
+        # стена или тело: проигрыш, голову не рисуем
+        dead = (content == Grid.LET) | (content == Grid.SNAKE)
+        self.is_gameover[games[dead]] = True
+
+        alive = ~dead
+        cells[games[alive], head_cell[alive]] = Grid.SNAKE
+
+    def __pop_apples(self, games: np.ndarray) -> None:
+        """Ставит следующее яблоко из очереди каждой игры"""
+        positions = self.queue_pos[games]
+        has_apple = positions < self.queue.shape[1]
+        games, positions = games[has_apple], positions[has_apple]
+        apple_cell = self.queue[games, positions]
+        has_apple = apple_cell >= 0
+        self.queue_pos[games[has_apple]] += 1
+        self.cells[games[has_apple], apple_cell[has_apple]] = Grid.APPLE
+
+    def __insert_apples(self, games: np.ndarray) -> None:
+        """
+        Ставит яблоко в случайную свободную клетку.
+        Если свободных клеток нет - змейка заняла всё поле,
+        это победа, как в Field.
+        """
+        if not len(games):
+            return None
+        free = self.cells[games] == Grid.DEFAULT
+        weights = np.where(free, self.rng.random(free.shape), -1.0)
+        apple_cell = weights.argmax(axis=1)
+        has_free = free.any(axis=1)
+        self.is_win[games[~has_free]] = True
+        self.cells[games[has_free], apple_cell[has_free]] = Grid.APPLE
+
+    def run(self, directions: np.ndarray, gen_apple: bool = False) -> None:
+        """
+        Прогоняет последовательность ходов (ticks, N).
+        Закончившиеся игры дальше не двигаются.
+        """
+        for tick_directions in directions:
+            self.step(tick_directions, gen_apple=gen_apple)
+            if not self.active.any():
+                break
+
+    def board_string(self, game: int) -> str:
+        """Поле игры game в виде строки, как str(Field)"""
+        return ''.join(
+            self.boards[game, row].tobytes().decode() + '\n'
+            for row in range(self.x_len)
+        )
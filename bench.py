@@ -0,0 +1,1303 @@
+"""
+Замеры производительности игровых объектов.
+
+Каждый замер - функция bench_*, которая возвращает строки
+таблицы: сначала подписи строки (размер поля, уровень и т.п.),
+потом величины. Суффикс имени величины говорит, куда лучше:
+_us, _ms, _kb, _mb - меньше, _per_s, _tps - больше.
+
+Запуск:
+    python bench.py                       все замеры таблицами
+    python bench.py --quick               только горячий путь тика
+    python bench.py field sample          выбранные замеры
+    python bench.py --quick --json out.json --baseline bench_baseline.json
+
+Каждый замер гоняется --rounds раз (по умолчанию 3), от каждой
+величины остаётся лучшее значение. С --baseline результаты
+сравниваются с сохранённым прогоном, и если какая-то величина
+стала хуже больше чем на --threshold (по умолчанию 50%, с --quick
+100%), выход с кодом 1. Для сравнения прогонов не меньше 3, а
+замеры с регрессиями перед выводом гоняются ещё раз (recheck).
+--save-baseline записывает прогон как новый эталон.
+"""
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+from time import perf_counter
+
+from objects import Cell, Snake, Field, GameManager
+from render import TerminalRenderer
+
+
+class NullStream:
+    """Поток, который выбрасывает всё записанное"""
+
+    def write(self, data: str) -> int:
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def bench_field(
+        sizes: tuple = (16, 64, 256, 1024),
+        cells: int = 2 ** 22,
+        ticks: int = 1000,
+) -> list:
+    """
+    Горячий путь поля Field на квадратных полях:
+    init - Field.__init__, move - тик без яблока,
+    eat - тик с поеданием яблока и постановкой нового,
+    str - str(field), show - Field.show в пустой поток.
+    Медленные операции повторяются cells / площадь раз.
+    """
+    results = []
+    for size in sizes:
+        repeat = max(3, cells // (size * size))
+
+        start = perf_counter()
+        for _ in range(repeat):
+            field = Field(
+                snake=Snake(start_points=[(1, 1), (1, 0)]),
+                x_len=size,
+                y_len=size,
+            )
+        init_time = (perf_counter() - start) / repeat
+
+        directions = ('RIGHT', 'DOWN', 'LEFT', 'UP')
+        start = perf_counter()
+        for tick in range(ticks):
+            field.move_snake(directions[tick // 3 % 4], gen_apple=False)
+        move_time = (perf_counter() - start) / ticks
+
+        # змейка растёт на каждом яблоке, поэтому едим
+        # вдоль строки, пока не упрёмся в собственный хвост
+        field = Field(
+            snake=Snake(start_points=[(1, 1), (1, 0)]),
+            x_len=size,
+            y_len=size,
+        )
+        field.apples = size * size
+        eats = min(ticks, size - 4)
+        eat_time = 0.0
+        for _ in range(eats):
+            field.field.set(1, (field.col_head + 1) % size, Cell.apple)
+            start = perf_counter()
+            field.move_snake('RIGHT')
+            eat_time += perf_counter() - start
+        eat_time /= eats
+
+        start = perf_counter()
+        for _ in range(repeat):
+            str(field)
+        str_time = (perf_counter() - start) / repeat
+
+        with redirect_stdout(NullStream()):
+            start = perf_counter()
+            for _ in range(repeat):
+                field.show()
+            show_time = (perf_counter() - start) / repeat
+
+        results.append({
+            'size': f'{size}x{size}',
+            'init_us': round(init_time * 1e6, 1),
+            'move_us': round(move_time * 1e6, 2),
+            'eat_us': round(eat_time * 1e6, 2),
+            'str_us': round(str_time * 1e6, 1),
+            'show_us': round(show_time * 1e6, 1),
+        })
+    return results
+
+
+def bench_logs(lengths: tuple = (1000, 10000), repeat: int = 5) -> list:
+    """
+    Сохранение сессии GameManager.session через logs
+    на поле 16x16 с поворотом каждые 5 тиков
+    """
+    import os
+    import shutil
+    import tempfile
+    from random import randrange, seed
+
+    results = []
+    for ticks in lengths:
+        seed(ticks)
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        game = GameManager(snake, Field(snake=snake), delay=0.1,
+                           direction='LEFT')
+        directions = ('LEFT', 'DOWN', 'RIGHT', 'UP')
+        for tick in range(ticks):
+            game.add_move(directions[tick // 5 % 4])
+        game.session['apples_points'].extend(
+            (randrange(16), randrange(16)) for _ in range(ticks // 40)
+        )
+        game.logs_dir = tempfile.mkdtemp()
+        try:
+            start = perf_counter()
+            for number in range(repeat):
+                game.logs(str(number))
+            logs_time = (perf_counter() - start) / repeat
+            size = os.path.getsize(game.log_path('0'))
+        finally:
+            shutil.rmtree(game.logs_dir)
+
+        results.append({
+            'ticks': ticks,
+            'bytes': size,
+            'logs_ms': round(logs_time * 1e3, 3),
+        })
+    return results
+
+
+def bench_hooks(apples: int = 40) -> list:
+    """
+    Во что обходятся хуки и профилировщик в play без задержки:
+    змейка идёт по гамильтонову циклу открытого поля 16x16 и
+    съедает apples яблок, кадры рисуются в пустой поток.
+    """
+    import random
+
+    from hamilton import Cycle, CycleController, find_cycle
+
+    def make_game() -> GameManager:
+        snake = Snake(start_points=[(1, 1), (1, 0)])
+        field = Field(snake=snake)
+        field.apples = apples
+        return GameManager(snake, field, delay=0, direction='RIGHT')
+
+    game = make_game()
+    cycle = Cycle(16, 16, find_cycle(game.field.field, tuple(game.snake)))
+    controller = CycleController(cycle)
+
+    def noop(game) -> None:
+        pass
+
+    results = []
+    for mode in ('none', 'hooks', 'profile'):
+        random.seed(0)
+        game = make_game()
+        if mode == 'hooks':
+            for event in ('before_tick', 'after_tick', 'before_move',
+                          'after_move', 'before_render', 'after_render'):
+                game.hooks.add(event, noop)
+        start = perf_counter()
+        with redirect_stdout(NullStream()):
+            game.play(
+                save_logs=False,
+                renderer=TerminalRenderer(stream=NullStream()),
+                controller=controller,
+                profile=mode == 'profile',
+            )
+        elapsed = perf_counter() - start
+        ticks = game.counters.ticks
+        results.append({
+            'mode': mode,
+            'ticks': ticks,
+            'tick_us': round(elapsed / ticks * 1e6, 2),
+            'move_us': round(game.counters.move / ticks * 1e6, 2),
+            'render_us': round(game.counters.render / ticks * 1e6, 2),
+        })
+    return results
+
+
+def bench_manager(
+        sizes: tuple = (16, 256, 1024),
+        cells: int = 2 ** 22,
+) -> list:
+    """
+    Создание GameManager на готовом поле: init - время
+    конструктора, session_kb - сколько памяти держит снимок
+    начального поля в session, build - сборка Field по
+    снимку. Повторы - cells / площадь раз, как в bench_field.
+    """
+    results = []
+    for size in sizes:
+        repeat = max(3, cells // (size * size))
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field(snake=snake, x_len=size, y_len=size)
+
+        start = perf_counter()
+        for _ in range(repeat):
+            game = GameManager(snake, field, direction='LEFT')
+        init_time = (perf_counter() - start) / repeat
+
+        tracemalloc.start()
+        game = GameManager(snake, field, direction='LEFT')
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        snapshot = game.session['field']
+        start = perf_counter()
+        for _ in range(repeat):
+            snapshot.build_field()
+        build_time = (perf_counter() - start) / repeat
+
+        results.append({
+            'size': f'{size}x{size}',
+            'init_us': round(init_time * 1e6, 2),
+            'session_kb': round(memory / 1024, 1),
+            'build_us': round(build_time * 1e6, 2),
+        })
+    return results
+
+
+def bench_grid(sizes: tuple = (16, 256, 2048), ticks: int = 1000) -> list:
+    """
+    Замеряет память под поле и среднее время одного
+    тика move_snake на квадратных полях разного размера.
+    """
+    results = []
+    for size in sizes:
+        tracemalloc.start()
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field(snake=snake, x_len=size, y_len=size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # гоняем змейку по кругу, чтобы не врезаться в себя
+        directions = ('RIGHT', 'DOWN', 'LEFT', 'UP')
+        start = perf_counter()
+        for tick in range(ticks):
+            field.move_snake(directions[tick // 3 % 4], gen_apple=False)
+        tick_time = (perf_counter() - start) / ticks
+
+        results.append({
+            'size': f'{size}x{size}',
+            'memory_kb': round(peak / 1024, 1),
+            'tick_us': round(tick_time * 1e6, 2),
+        })
+    return results
+
+
+def bench_snake_length(
+        lengths: tuple = (2, 64, 1024, 16384),
+        ticks: int = 1000,
+) -> list:
+    """
+    Замеряет время тика move_snake в зависимости
+    от длины змейки. Змейка лежит в строке-кольце,
+    которая длиннее её самой, и ходит по ней вправо.
+    """
+    results = []
+    for length in lengths:
+        y_len = length + 8
+        # голова - первая точка, поэтому идём справа налево
+        points = [(0, col) for col in range(length - 1, -1, -1)]
+        snake = Snake(start_points=points)
+        field = Field(snake=snake, x_len=4, y_len=y_len)
+
+        start = perf_counter()
+        for _ in range(ticks):
+            field.move_snake('RIGHT', gen_apple=False)
+        tick_time = (perf_counter() - start) / ticks
+
+        results.append({
+            'length': length,
+            'tick_us': round(tick_time * 1e6, 2),
+        })
+    return results
+
+
+def bench_apple_point(
+        fills: tuple = (0.1, 0.5, 0.75, 0.9, 0.95),
+        size: int = 32,
+        repeat: int = 200,
+) -> list:
+    """
+    Замеряет время выбора точки для яблока, когда
+    змейка занимает заданную долю поля.
+    """
+    results = []
+    for fill in fills:
+        cells = [(row, col) for row in range(size) for col in range(size)]
+        points = cells[:int(len(cells) * fill)]
+        snake = Snake(start_points=points)
+        field = Field(snake=snake, x_len=size, y_len=size)
+
+        start = perf_counter()
+        for _ in range(repeat):
+            field._Field__generate_apple_point()
+        point_time = (perf_counter() - start) / repeat
+
+        results.append({
+            'fill': f'{round(fill * 100)}%',
+            'apple_us': round(point_time * 1e6, 2),
+        })
+    return results
+
+
+def bench_regions(sizes: tuple = (16, 256, 1024), repeat: int = 200) -> list:
+    """
+    Индекс областей на поле, которое стены крест-накрест
+    делят на 4 области: index - заливка Regions.from_grid
+    (считается один раз на раскладку стен), apple - выбор
+    клетки для яблока в области головы.
+    """
+    from objects import Grid, Regions
+
+    results = []
+    for size in sizes:
+        grid = Grid(size, size)
+        middle = size // 2
+        for index in range(size):
+            grid.set(middle, index, Cell.let)
+            grid.set(index, middle, Cell.let)
+            grid.set(0, index, Cell.let)
+            grid.set(index, 0, Cell.let)
+
+        start = perf_counter()
+        regions = Regions.from_grid(grid)
+        index_time = perf_counter() - start
+
+        grid.set_regions(regions)
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field.from_grid(snake, grid, apples=10)
+        start = perf_counter()
+        for _ in range(repeat):
+            field._Field__generate_apple_point()
+        apple_time = (perf_counter() - start) / repeat
+
+        results.append({
+            'size': f'{size}x{size}',
+            'regions': len(regions),
+            'index_ms': round(index_time * 1e3, 2),
+            'apple_us': round(apple_time * 1e6, 2),
+        })
+    return results
+
+
+def bench_render(sizes: tuple = (16, 256, 1024), frames: int = 100) -> list:
+    """
+    Замеряет время вывода кадра и кол-во байт на кадр
+    при полной перерисовке и при выводе разницы.
+    """
+    results = []
+    for size in sizes:
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field(snake=snake, x_len=size, y_len=size)
+
+        for mode in ('full', 'diff'):
+            renderer = TerminalRenderer(stream=NullStream())
+            # первый кадр всегда полный, его не считаем
+            renderer.draw_field(field)
+            emit_time, bytes_written = renderer.emit_time, renderer.bytes_written
+            for _ in range(frames):
+                field.move_snake('DOWN', gen_apple=False)
+                renderer.draw_field(field, full=mode == 'full')
+            results.append({
+                'size': f'{size}x{size}',
+                'mode': mode,
+                'frame_us': round(
+                    (renderer.emit_time - emit_time) / frames * 1e6, 1
+                ),
+                'bytes': round(
+                    (renderer.bytes_written - bytes_written) / frames
+                ),
+            })
+    return results
+
+
+def bench_batch(games: int = 1000, ticks: int = 200) -> list:
+    """
+    Сравнивает пошаговую симуляцию Field с пакетной
+    BatchField в тиках (ходах одной игры) в секунду.
+    """
+    from batch import BatchField
+
+    def make_fields() -> list:
+        fields = []
+        for game in range(games):
+            # змейки на разных строках, ходят по кругу без столкновений
+            row = game % 16
+            snake = Snake(start_points=[(row, 1), (row, 0)])
+            fields.append(Field(snake=snake))
+        return fields
+
+    fields = make_fields()
+    start = perf_counter()
+    for _ in range(ticks):
+        for field in fields:
+            field.move_snake('RIGHT', gen_apple=False)
+    single = games * ticks / (perf_counter() - start)
+
+    batch = BatchField.from_fields(make_fields())
+    directions = [3] * games
+    start = perf_counter()
+    for _ in range(ticks):
+        batch.step(directions)
+    batched = games * ticks / (perf_counter() - start)
+
+    return [
+        {'engine': 'Field', 'ticks_per_s': round(single)},
+        {'engine': 'BatchField', 'ticks_per_s': round(batched)},
+    ]
+
+
+def bench_replay(ticks: int = 12000) -> list:
+    """
+    Сравнивает размер и время загрузки лога сессии
+    в старом формате pickle и в формате повтора .rpl.
+    """
+    import pickle
+    from copy import deepcopy
+    from replay import dumps, loads
+
+    from random import randrange
+
+    snake = Snake(start_points=[(1, 1), (1, 2)])
+    field = Field(snake=snake)
+    # поворот каждые 5 тиков, как у живого игрока,
+    # и яблоко примерно каждые 40 тиков
+    directions = ('LEFT', 'DOWN', 'RIGHT', 'UP')
+    session = {
+        'field': deepcopy(field),
+        'delay': 0.1,
+        'iter_key': [
+            (tick, directions[tick // 5 % 4]) for tick in range(ticks)
+        ],
+        'apples_points': [
+            (randrange(16), randrange(16)) for _ in range(ticks // 40)
+        ],
+    }
+
+    results = []
+    for name, dump, load in (
+        ('pickle', pickle.dumps, pickle.loads),
+        ('rpl', lambda data: dumps(
+            data['field'], data['delay'],
+            (direction for _, direction in data['iter_key']),
+            data['apples_points'],
+        ), loads),
+    ):
+        data = dump(session)
+        start = perf_counter()
+        load(data)
+        results.append({
+            'format': name,
+            'ticks': len(session['iter_key']),
+            'bytes': len(data),
+            'load_ms': round((perf_counter() - start) * 1000, 2),
+        })
+    return results
+
+
+def bench_recorder(ticks: int = 100000) -> list:
+    """
+    Замеряет, сколько добавляет к тику запись
+    лога ReplayWriter во время игры.
+    """
+    import os
+    import tempfile
+    from replay import ReplayWriter
+
+    snake = Snake(start_points=[(1, 1), (1, 2)])
+    field = Field(snake=snake)
+    directions = ('LEFT', 'DOWN', 'RIGHT', 'UP')
+    path = os.path.join(tempfile.mkdtemp(), 'bench.rpl')
+    writer = ReplayWriter(path, field, 0.1)
+
+    start = perf_counter()
+    for tick in range(ticks):
+        writer.record(directions[tick // 5 % 4], field)
+    record_time = (perf_counter() - start) / ticks
+    writer.close(field)
+
+    size = os.path.getsize(path)
+    os.remove(path)
+    return [{
+        'ticks': ticks,
+        'record_us': round(record_time * 1e6, 3),
+        'bytes': size,
+    }]
+
+
+def bench_seek(
+        lengths: tuple = (1000, 10000, 100000),
+        keyframe_ticks: int = 256,
+        seeks: int = 20,
+) -> list:
+    """
+    Замеряет время перемотки повтора на случайный тик
+    в зависимости от длины сессии.
+    """
+    import os
+    import tempfile
+    from random import randrange
+    from replay import ReplayPlayer, ReplayWriter, read_replay
+
+    results = []
+    for ticks in lengths:
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field(snake=snake, x_len=32, y_len=32)
+        path = os.path.join(tempfile.mkdtemp(), 'bench.rpl')
+        directions = ('LEFT', 'DOWN', 'RIGHT', 'DOWN')
+        with ReplayWriter(
+                path, field, 0.1, keyframe_ticks=keyframe_ticks
+        ) as writer:
+            for tick in range(ticks):
+                direction = directions[tick // 3 % 4]
+                field.move_snake(direction, gen_apple=False)
+                writer.record(direction, field)
+                if field.game_status() != 'game':
+                    break
+            writer.close(field)
+
+        player = ReplayPlayer(read_replay(path))
+        start = perf_counter()
+        for _ in range(seeks):
+            player.seek(randrange(player.ticks))
+        seek_time = (perf_counter() - start) / seeks
+        os.remove(path)
+
+        results.append({
+            'ticks': player.ticks,
+            'seek_ms': round(seek_time * 1000, 3),
+        })
+    return results
+
+
+def bench_levels(loads: int = 200) -> list:
+    """
+    Сравнивает размер и время загрузки уровней кампании
+    в формате .lvl и старым pickle GameManager.
+    """
+    import pickle
+
+    from levels import level_path, load_level, read_level
+
+    results = []
+    for lvl in GameManager.ALL_LEVELS:
+        path = level_path(lvl)
+        with open(path, 'rb') as file:
+            size = len(file.read())
+        pickled = pickle.dumps(load_level(lvl))
+
+        start = perf_counter()
+        for _ in range(loads):
+            load_level(lvl)
+        lvl_time = (perf_counter() - start) / loads
+
+        start = perf_counter()
+        for _ in range(loads):
+            read_level(path)
+        read_time = (perf_counter() - start) / loads
+
+        start = perf_counter()
+        for _ in range(loads):
+            pickle.loads(pickled)
+        pkl_time = (perf_counter() - start) / loads
+
+        results.append({
+            'lvl': lvl,
+            'lvl_bytes': size,
+            'pkl_bytes': len(pickled),
+            'read_us': round(read_time * 1e6, 1),
+            'game_us': round(lvl_time * 1e6, 1),
+            'pkl_us': round(pkl_time * 1e6, 1),
+        })
+    return results
+
+
+def bench_sample(size: int = 16, fields: int = 2000) -> list:
+    """
+    Время set_field_by_sample на одном и том же шаблоне:
+    первый разбор и повторные вызовы из кэша.
+    """
+    from objects import compile_sample
+
+    sample = '\n'.join(
+        '  '.join('#' if (row + col) % 7 == 0 else '.' for col in range(size))
+        for row in range(size)
+    )
+    compile_sample.cache_clear()
+
+    start = perf_counter()
+    compile_sample(sample)
+    compile_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(fields):
+        field = Field(snake=Snake(start_points=[(1, 1), (1, 2)]))
+        field.set_field_by_sample(sample=sample, apples=10)
+    field_time = (perf_counter() - start) / fields
+
+    info = compile_sample.cache_info()
+    return [{
+        'size': size,
+        'compile_us': round(compile_time * 1e6, 1),
+        'field_us': round(field_time * 1e6, 1),
+        'hits': info.hits,
+        'misses': info.misses,
+    }]
+
+
+def bench_huge(
+        sizes: tuple = (1000, 100000),
+        walls: int = 10000,
+        ticks: int = 2000,
+) -> list:
+    """
+    Память и время тика с отрисовкой окна 24x48
+    на огромных разреженных полях.
+    """
+    import random
+
+    from render import ViewportRenderer
+    from sparse import huge_field
+
+    results = []
+    for size in sizes:
+        random.seed(size)
+        points = [(size // 2, size // 2 - col) for col in range(50)]
+        tracemalloc.start()
+        field = huge_field(
+            Snake(start_points=points), size, size, apples=ticks,
+            walls=[
+                (random.randrange(size), random.randrange(size))
+                for _ in range(walls)
+            ],
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        renderer = ViewportRenderer(stream=NullStream())
+        directions = ('RIGHT', 'DOWN')
+        start = perf_counter()
+        for tick in range(ticks):
+            field.move_snake(directions[tick // 40 % 2])
+            renderer.draw_field(field)
+            if field.game_status() != 'game':
+                break
+        tick_time = (perf_counter() - start) / (tick + 1)
+
+        results.append({
+            'size': size,
+            'occupied': field.field.cells.occupied,
+            'memory_mb': round(peak / 2 ** 20, 2),
+            'tick_us': round(tick_time * 1e6, 1),
+            'frame_bytes': round(renderer.stats()['bytes_per_frame'], 1),
+        })
+    return results
+
+
+def bench_input(
+        delays: tuple = (0.1, 0.02),
+        bursts: int = 50,
+        gap: float = 0.004,
+) -> list:
+    """
+    Задержка от нажатия до хода при быстрых парах нажатий
+    (поворот и сразу второй поворот через gap секунд).
+    lost_overwrite - сколько нажатий потерялось бы, если бы
+    направление просто перезаписывалось до следующего тика.
+    """
+    import random
+    import threading
+    from bisect import bisect_left
+    from time import sleep
+
+    from inputs import InputQueue
+    from timing import TickScheduler
+
+    results = []
+    for delay in delays:
+        random.seed(1)
+        inputs = InputQueue(depth=3)
+        pressed = []
+        ticks = []
+        done = threading.Event()
+
+        def press():
+            direction = 'RIGHT'
+            for _ in range(bursts):
+                sleep(random.uniform(2, 4) * delay)
+                first = 'UP' if direction in ('LEFT', 'RIGHT') else 'LEFT'
+                second = 'LEFT' if first == 'UP' else 'UP'
+                pressed.append(perf_counter())
+                inputs.push(first)
+                sleep(gap)
+                pressed.append(perf_counter())
+                inputs.push(second)
+                direction = second
+            sleep(4 * delay)
+            done.set()
+
+        thread = threading.Thread(target=press)
+        thread.start()
+        scheduler = TickScheduler(delay)
+        scheduler.start()
+        direction = 'RIGHT'
+        while not done.is_set():
+            direction = inputs.next_direction(direction)
+            ticks.append(perf_counter())
+            scheduler.wait()
+        thread.join()
+
+        # при перезаписи до тика доживает только последнее
+        # нажатие между двумя тиками
+        last_press = {}
+        for moment in pressed:
+            last_press[bisect_left(ticks, moment)] = moment
+        summary = inputs.summary()
+        results.append({
+            'delay': delay,
+            'presses': len(pressed),
+            'applied': summary['applied'],
+            'lost_overwrite': len(pressed) - len(last_press),
+            'p50_ms': round(summary['p50'], 2),
+            'p99_ms': round(summary['p99'], 2),
+            'max_ms': round(summary['max'], 2),
+        })
+    return results
+
+
+def bench_async(
+        sessions: tuple = (100, 500, 1000, 1500, 2000),
+        delay: float = 0.1,
+        seconds: float = 3.0,
+) -> list:
+    """
+    Сколько игр 16x16 с 10 тиками в секунду тянет один цикл
+    событий asyncio. Каждая игра рисует кадры в пустой поток
+    и получает повороты из своего асинхронного источника.
+    Игра считается успевающей, если её тики опаздывают
+    меньше чем на полпериода (p99).
+    """
+    import asyncio
+    import random
+
+    from asyncgame import play_async
+    from objects import GameManager
+    from timing import percentile
+
+    async def turns():
+        # ходим квадратами, чтобы не врезаться в себя
+        for direction in ('UP', 'LEFT', 'DOWN', 'RIGHT') * 1000:
+            await asyncio.sleep(delay * 3)
+            yield direction
+
+    async def play(game, ticks):
+        # игры стартуют в разные моменты, как у живых игроков
+        await asyncio.sleep(random.uniform(0, delay))
+        return await play_async(
+            game,
+            renderer=TerminalRenderer(stream=NullStream()),
+            inputs=turns(),
+            max_ticks=ticks,
+        )
+
+    async def play_all(games, ticks):
+        return await asyncio.gather(*(play(game, ticks) for game in games))
+
+    results = []
+    for count in sessions:
+        random.seed(count)
+        games = []
+        for _ in range(count):
+            snake = Snake(start_points=[(8, 8), (8, 7)])
+            games.append(GameManager(
+                snake=snake,
+                field=Field(snake=snake),
+                delay=delay,
+                direction='RIGHT',
+            ))
+        ticks = int(seconds / delay)
+        start = perf_counter()
+        outcomes = asyncio.run(play_all(games, ticks))
+        elapsed = perf_counter() - start
+
+        overshoot = [
+            value for game in games for value in game.tick_stats.overshoot
+        ]
+        p99 = percentile(overshoot, 99)
+        results.append({
+            'sessions': count,
+            'ticks_per_s': round(
+                sum(outcome['ticks'] for outcome in outcomes) / elapsed
+            ),
+            'p99_late_ms': round(p99 * 1000, 1),
+            'late_ticks': sum(outcome['late_ticks'] for outcome in outcomes),
+            'skipped_frames': sum(
+                outcome['skipped_frames'] for outcome in outcomes
+            ),
+            'keeps_up': p99 < delay / 2,
+        })
+    return results
+
+
+def bench_server(
+        clients: tuple = (1, 100, 1000),
+        delay: float = 0.1,
+        ticks: int = 50,
+) -> list:
+    """
+    Сервер в отдельном процессе и clients клиентов на
+    localhost, каждый играет ticks тиков и поворачивает
+    каждые 3 тика. step - время тика сервера на все игры,
+    late - опоздание тиков сервера, turn - от отправки
+    поворота до строки S с ним у клиента.
+    """
+    import asyncio
+    import subprocess
+    import sys
+
+    from server import request_stats, run_client
+    from timing import percentile
+
+    async def play(port):
+        return await asyncio.gather(*(
+            run_client('127.0.0.1', port, ticks=ticks)
+            for _ in range(count)
+        ))
+
+    results = []
+    for count in clients:
+        process = subprocess.Popen(
+            [sys.executable, 'server.py', '--port', '0',
+             '--delay', str(delay)],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            port = int(process.stdout.readline().rsplit(':', 1)[1])
+            start = perf_counter()
+            outcomes = asyncio.run(play(port))
+            elapsed = perf_counter() - start
+            stats = asyncio.run(request_stats('127.0.0.1', port))
+        finally:
+            process.terminate()
+            process.wait()
+
+        latency = [
+            value for outcome in outcomes for value in outcome['latency']
+        ]
+        results.append({
+            'clients': count,
+            'ticks_per_s': round(
+                sum(outcome['ticks'] for outcome in outcomes) / elapsed
+            ),
+            'step_p50_ms': round(stats['tick']['simulate']['p50'], 2),
+            'step_p99_ms': round(stats['tick']['simulate']['p99'], 2),
+            'late_p99_ms': round(stats['tick']['overshoot']['p99'], 2),
+            'turn_p50_ms': round(percentile(latency, 50) * 1000, 1),
+            'turn_p99_ms': round(percentile(latency, 99) * 1000, 1),
+        })
+    return results
+
+
+def bench_hamilton(games: int = 20) -> list:
+    """
+    Поиск гамильтонова цикла для уровней кампании и
+    скорость игры по циклу без срезок и со срезками
+    """
+    import random
+
+    from hamilton import CycleController, NoCycle, find_cycle, level_cycle
+    from levels import level_path, read_level
+
+    results = []
+    for lvl in GameManager.ALL_LEVELS:
+        path = level_path(lvl)
+        level = read_level(path)
+        row = dict.fromkeys((
+            'lvl', 'cells', 'search_ms', 'cycle_wins', 'cycle_ticks',
+            'cycle_tps', 'short_wins', 'short_ticks', 'short_tps',
+        ), '-')
+        row['lvl'] = lvl
+        results.append(row)
+        start = perf_counter()
+        try:
+            find_cycle(level.grid, level.snake)
+        except NoCycle:
+            continue
+        row['search_ms'] = round((perf_counter() - start) * 1e3, 1)
+        cycle = level_cycle(path)
+        row['cells'] = len(cycle)
+
+        for name, shortcuts in (('cycle', False), ('short', True)):
+            ticks = wins = 0
+            start = perf_counter()
+            for seed in range(games):
+                random.seed(seed)
+                game = level.build_game()
+                result = game.run_headless(CycleController(cycle, shortcuts))
+                ticks += result['ticks']
+                wins += result['outcome'] == 'win'
+            elapsed = perf_counter() - start
+            row[f'{name}_wins'] = wins
+            row[f'{name}_ticks'] = ticks // games
+            row[f'{name}_tps'] = round(ticks / elapsed)
+    return results
+
+
+# модули, которые не должны грузиться без живой игры
+HEAVY_MODULES = ('keyboard', 'asyncio', 'json', 'pickle', 'datetime')
+
+# что делает процесс после import objects в bench_startup
+STARTUP_SCENARIOS = {
+    'import': '',
+    'game': (
+        'game = objects.GameManager.get_game_by_lvl(1)\n'
+        'game.run_headless(lambda field, direction: direction, 100)\n'
+    ),
+}
+
+
+def bench_startup(repeat: int = 5) -> list:
+    """
+    Запуск нового процесса python: python_ms - пустой
+    интерпретатор, wall_ms - весь процесс со сценарием,
+    import_ms - import objects внутри процесса, run_ms -
+    сценарий после импорта. heavy_count - сколько модулей
+    из HEAVY_MODULES оказалось загружено, без живой игры 0.
+    """
+    import os
+    import subprocess
+
+    def run(code: str) -> tuple:
+        start = perf_counter()
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return (perf_counter() - start) * 1000, output
+
+    python_ms = min(run('pass')[0] for _ in range(repeat))
+    results = []
+    for name, scenario in STARTUP_SCENARIOS.items():
+        code = (
+            'from time import perf_counter\n'
+            'start = perf_counter()\n'
+            'import objects\n'
+            'imported = perf_counter()\n'
+            f'{scenario}'
+            'done = perf_counter()\n'
+            'import sys\n'
+            f'heavy = sum(name in sys.modules for name in {HEAVY_MODULES!r})\n'
+            'print(imported - start, done - imported, heavy)\n'
+        )
+        best = None
+        for _ in range(repeat):
+            wall, output = run(code)
+            imported, ran, heavy = output.split()
+            measured = (wall, float(imported) * 1000, float(ran) * 1000)
+            best = measured if best is None else tuple(map(min, best, measured))
+        results.append({
+            'scenario': name,
+            'python_ms': round(python_ms, 1),
+            'wall_ms': round(best[0], 1),
+            'import_ms': round(best[1], 1),
+            'run_ms': round(best[2], 1),
+            'heavy_count': int(heavy),
+        })
+    return results
+
+
+# все замеры в порядке вывода
+BENCHMARKS = {
+    'field': bench_field,
+    'grid': bench_grid,
+    'manager': bench_manager,
+    'snake_length': bench_snake_length,
+    'apple_point': bench_apple_point,
+    'regions': bench_regions,
+    'sample': bench_sample,
+    'levels': bench_levels,
+    'logs': bench_logs,
+    'hooks': bench_hooks,
+    'render': bench_render,
+    'batch': bench_batch,
+    'replay': bench_replay,
+    'recorder': bench_recorder,
+    'seek': bench_seek,
+    'huge': bench_huge,
+    'input': bench_input,
+    'async': bench_async,
+    'server': bench_server,
+    'hamilton': bench_hamilton,
+    'startup': bench_startup,
+}
+# горячий путь тика и запуск: быстрые замеры для проверки регрессий
+QUICK = (
+    'field', 'grid', 'manager', 'snake_length', 'apple_point',
+    'sample', 'levels', 'logs', 'hooks', 'render', 'startup',
+)
+
+# величины, которые лучше, когда меньше и когда больше
+LOWER_IS_BETTER = ('_us', '_ms', '_kb', '_mb', '_count')
+HIGHER_IS_BETTER = ('_per_s', '_tps')
+# величины времени, к ним применяется поправка на скорость машины
+TIME_METRICS = ('_us', '_ms', '_per_s', '_tps')
+# точные счётчики без шума: регрессия - любой рост, даже с нуля
+COUNT_METRICS = ('_count',)
+# регрессия - если величина хуже эталона больше чем на столько;
+# на общих виртуалках шум доходит до полутора раз даже с
+# поправкой, на выделенной машине можно брать --threshold 0.1
+THRESHOLD = 0.5
+# порог для --quick, им проверяется эталон из --quick прогона;
+# замеры короткие, но от всплесков шума защищают лучший из
+# MIN_BASELINE_ROUNDS прогонов и перепроверка RECHECKS
+QUICK_THRESHOLD = 0.5
+# с меньшим числом прогонов лучшее значение - ещё шум,
+# поэтому сравнение с эталоном гоняет хотя бы столько
+MIN_BASELINE_ROUNDS = 3
+# сколько раз перегонять замеры, которые вышли регрессией
+RECHECKS = 3
+
+
+def metric_sign(key: str) -> int:
+    """1 - чем меньше, тем лучше, -1 - чем больше, 0 - не величина"""
+    if key.endswith(LOWER_IS_BETTER):
+        return 1
+    if key.endswith(HIGHER_IS_BETTER):
+        return -1
+    return 0
+
+
+def best_of(rounds: list) -> list:
+    """
+    Строки нескольких прогонов одного замера: каждая величина
+    берётся лучшая за все прогоны, остальное - из первого.
+    Так шум от соседних процессов меньше влияет на сравнение.
+    """
+    best = [dict(row) for row in rounds[0]]
+    for rows in rounds[1:]:
+        for row, other in zip(best, rows):
+            for key, value in other.items():
+                sign = metric_sign(key)
+                if sign and isinstance(value, (int, float)) \
+                        and isinstance(row.get(key), (int, float)):
+                    row[key] = min(row[key], value, key=lambda v: v * sign)
+    return best
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Время эталонной работы на чистом Python в мкс, лучшее
+    из repeat. Замеряется перед каждым замером: если машина
+    в это время занята чем-то ещё, эталон медленнее во
+    столько же раз, и compare делит на это отношение.
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        cells = bytearray(4096)
+        total = 0
+        for index in range(20000):
+            cells[index & 4095] = index & 127
+            total += cells[(index * 7) & 4095]
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1e6, 1)
+
+
+def run_suite(
+        names: tuple = tuple(BENCHMARKS),
+        rounds: int = 1,
+        report=None,
+) -> dict:
+    """
+    Запускает замеры по именам из BENCHMARKS, каждый rounds
+    раз, и оставляет лучшие величины (см. best_of).
+    report(name, rows) вызывается после каждого замера.
+    Возвращает результаты с описанием машины для JSON.
+    """
+    results = {}
+    calibration = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Нет такого замера: {name}')
+        runs = []
+        calibration[name] = None
+        for _ in range(rounds):
+            speed = calibrate()
+            if calibration[name] is None or speed < calibration[name]:
+                calibration[name] = speed
+            runs.append(BENCHMARKS[name]())
+        results[name] = best_of(runs)
+        if report is not None:
+            report(name, results[name])
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'rounds': rounds,
+        # эталонная работа перед каждым замером, мкс
+        'calibration_us': calibration,
+        'results': results,
+    }
+
+
+def row_label(row: dict) -> tuple:
+    """Подпись строки: первый столбец и все строковые столбцы"""
+    first = next(iter(row))
+    return tuple(
+        (key, value) for key, value in row.items()
+        if key == first or isinstance(value, str) and not metric_sign(key)
+    )
+
+
+def compare(current: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Сравнивает прогоны run_suite. Строки замеров сопоставляются
+    по подписям, замеры и строки, которых нет в одном из прогонов,
+    пропускаются. Возвращает по строке на каждую величину:
+    ratio - во сколько раз хуже эталона (меньше 1 - лучше) с
+    поправкой на скорость машины по calibrate,
+    regression - хуже больше чем на threshold, у счётчиков
+    COUNT_METRICS - любой рост.
+    """
+    changes = []
+    for name, rows in current['results'].items():
+        # во сколько раз машина сейчас медленнее, чем при эталоне
+        speed = 1.0
+        now = current.get('calibration_us', {}).get(name)
+        then = baseline.get('calibration_us', {}).get(name)
+        if now and then:
+            speed = now / then
+        base_rows = {
+            row_label(row): row
+            for row in baseline['results'].get(name, ())
+        }
+        for row in rows:
+            base = base_rows.get(row_label(row))
+            if base is None:
+                continue
+            for key, value in row.items():
+                sign = metric_sign(key)
+                old = base.get(key)
+                if not sign or not isinstance(value, (int, float)) \
+                        or not isinstance(old, (int, float)):
+                    continue
+                if key.endswith(COUNT_METRICS):
+                    if old:
+                        ratio = value / old
+                    else:
+                        ratio = 1.0 if value == 0 else float('inf')
+                    regression = value > old
+                elif old <= 0 or value <= 0:
+                    continue
+                else:
+                    ratio = (value / old) ** sign
+                    if key.endswith(TIME_METRICS):
+                        ratio /= speed
+                    regression = ratio > 1 + threshold
+                changes.append({
+                    'bench': name,
+                    'row': ' '.join(str(value) for _, value in row_label(row)),
+                    'metric': key,
+                    'baseline': old,
+                    'current': value,
+                    'ratio': round(ratio, 3),
+                    'regression': regression,
+                })
+    return changes
+
+
+def recheck(
+        suite: dict,
+        baseline: dict,
+        threshold: float = THRESHOLD,
+        rounds: int = MIN_BASELINE_ROUNDS,
+        attempts: int = RECHECKS,
+) -> list:
+    """
+    compare, но замеры с регрессиями гоняются ещё раз, до
+    attempts раз, и их лучшие величины сливаются с прошлыми
+    в suite. Шум на виртуалках идёт всплесками, и повтор его
+    обычно снимает, а настоящая регрессия остаётся.
+    """
+    changes = compare(suite, baseline, threshold)
+    for _ in range(attempts):
+        names = sorted({
+            change['bench'] for change in changes if change['regression']
+        })
+        if not names:
+            break
+        print(f'[перепроверка: {", ".join(names)}]')
+        again = run_suite(names, rounds)
+        for name in names:
+            suite['results'][name] = best_of([
+                suite['results'][name], again['results'][name]
+            ])
+            suite['calibration_us'][name] = min(
+                suite['calibration_us'][name],
+                again['calibration_us'][name],
+            )
+        changes = compare(suite, baseline, threshold)
+    return changes
+
+
+def print_table(results: list) -> None:
+    """Печатает результаты замеров таблицей"""
+    if not results:
+        return None
+    keys = list(results[0])
+    print(' | '.join(f'{key:>12}' for key in keys))
+    for result in results:
+        print(' | '.join(f'{str(result[key]):>12}' for key in keys))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры производительности')
+    parser.add_argument('names', nargs='*', help='замеры, по умолчанию все')
+    parser.add_argument('--quick', action='store_true',
+                        help='только горячий путь тика')
+    parser.add_argument('--json', help='записать результаты в файл JSON')
+    parser.add_argument('--baseline', help='сравнить с эталоном JSON')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help=f'допустимое ухудшение, доля, по умолчанию '
+                             f'{THRESHOLD}, с --quick {QUICK_THRESHOLD}')
+    parser.add_argument('--rounds', type=int, default=MIN_BASELINE_ROUNDS,
+                        help='прогонов каждого замера, берётся лучший; '
+                             f'с --baseline не меньше {MIN_BASELINE_ROUNDS}')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='записать прогон в файл --baseline')
+    args = parser.parse_args()
+
+    names = args.names or (QUICK if args.quick else tuple(BENCHMARKS))
+    threshold = args.threshold
+    if threshold is None:
+        threshold = QUICK_THRESHOLD if args.quick else THRESHOLD
+    rounds = args.rounds
+    if args.baseline and not args.save_baseline \
+            and rounds < MIN_BASELINE_ROUNDS:
+        print(f'Для сравнения с эталоном нужно хотя бы '
+              f'{MIN_BASELINE_ROUNDS} прогона, --rounds {rounds} поднят')
+        rounds = MIN_BASELINE_ROUNDS
+
+    def report(name: str, rows: list) -> None:
+        print(f'[{name}]')
+        print_table(rows)
+
+    suite = run_suite(names, rounds, report)
+
+    regressions = []
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(suite, file, ensure_ascii=False, indent=1)
+    elif args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        changes = recheck(suite, baseline, threshold, rounds)
+        regressions = [change for change in changes if change['regression']]
+        print(f'[сравнение с {args.baseline}, порог {threshold:.0%}]')
+        print_table(regressions or changes)
+        if regressions:
+            print(f'Регрессий: {len(regressions)} из {len(changes)}')
+        else:
+            print(f'Регрессий нет, сравнено величин: {len(changes)}')
+
+    # в JSON - результаты вместе с перепроверками
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(suite, file, ensure_ascii=False, indent=1)
+    if regressions:
+        sys.exit(1)
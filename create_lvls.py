@@ -33,7 +33,7 @@ GameManager.create_lvl(
     lvl=1,
     snake=snake,
     field=field,
-    direction='DOWN',
+    direction='UP',
     delay=0.1
 )
 # ====================================================================
@@ -0,0 +1,402 @@
+"""
+Гамильтонов цикл по свободным клеткам уровня.
+
+Змейка, которая ходит по циклу через все свободные клетки поля,
+никогда в себя не врежется и съест все яблоки. Цикл ищется один
+раз на уровень поворотами Поша: путь начинается с тела змейки
+от хвоста к голове, поэтому змейка с первого хода уже стоит на
+цикле. Найденный цикл сохраняется рядом с уровнем в файл .cycle,
+а во время игры следующий ход берётся из таблицы за O(1).
+
+Цикла может не быть: на поле с чётными сторонами клетки
+раскрашиваются в шахматном порядке и цикл чередует цвета,
+тупик (клетка с одним свободным соседом) в цикл не войдёт,
+а в клетку не могут вести три обязательных ребра. Такие
+уровни отсекаются до поиска.
+
+Запуск: python hamilton.py - ищет циклы для уровней кампании,
+сохраняет их и печатает уровни, где цикла нет. Если цикла нет
+только через начальное тело змейки, а от одной головы он есть,
+это печатается отдельно: цикл у поля есть, но змейка встанет
+на него не с первого хода.
+"""
+import os
+import struct
+import zlib
+from array import array
+from random import Random
+from time import perf_counter
+from typing import Optional
+
+from autopilot import DIRECTIONS, neighbours
+from objects import Grid, Field
+
+
+MAGIC = b'SNKC'
+VERSION = 1
+EXTENSION = '.cycle'
+# x_len, y_len, контрольная сумма стен и змейки, длина цикла
+HEADER = struct.Struct('<4sBIIII')
+# сколько шагов поиска на одну попытку
+SEARCH_STEPS = 10000
+# попыток с разными сидами
+ATTEMPTS = 64
+
+
+class NoCycle(Exception):
+    """Гамильтонова цикла по свободным клеткам нет или он не найден"""
+
+
+def layout_key(grid: Grid, snake: tuple) -> int:
+    """Контрольная сумма стен и начальной змейки: цикл строится под них"""
+    walls = bytes(
+        Grid.LET if code == Grid.LET else Grid.DEFAULT for code in grid.cells
+    )
+    points = b''.join(
+        struct.pack('<I', row * grid.y_len + col) for row, col in snake
+    )
+    return zlib.crc32(walls + points)
+
+
+def free_neighbours(grid: Grid) -> list:
+    """Для каждой клетки - соседние клетки без стен, для стены - ()"""
+    x_len, y_len = grid.x_len, grid.y_len
+    cells = grid.cells
+    return [
+        tuple(
+            neighbour
+            for neighbour in dict.fromkeys(neighbours(index, x_len, y_len))
+            if cells[neighbour] != Grid.LET
+        ) if cells[index] != Grid.LET else ()
+        for index in range(len(cells))
+    ]
+
+
+def check_cycle_possible(grid: Grid, snake: tuple) -> list:
+    """
+    Проверки до поиска, NoCycle - если цикла точно нет.
+    Возвращает обязательные рёбра цикла: для каждой клетки
+    множество соседей, с которыми она в цикле соединена.
+    Обязательны рёбра тела змейки и оба ребра клетки, у
+    которой всего два соседа; у клетки с двумя обязательными
+    рёбрами остальные рёбра выбрасываются, и так по кругу.
+    """
+    y_len = grid.y_len
+    cells = grid.cells
+    adjacent = free_neighbours(grid)
+    free = [index for index in range(len(cells)) if adjacent[index]]
+    if len(free) < 4:
+        raise NoCycle('Свободных клеток меньше четырёх')
+    body = [row * y_len + col for row, col in snake]
+    for index in body:
+        if cells[index] == Grid.LET:
+            raise NoCycle(f'Змейка стоит на стене {divmod(index, y_len)}')
+
+    # с чётными сторонами поле двудольное, цикл чередует цвета
+    if grid.x_len % 2 == 0 and y_len % 2 == 0:
+        black = sum(sum(divmod(index, y_len)) % 2 for index in free)
+        if black * 2 != len(free):
+            raise NoCycle(
+                f'Клеток разного цвета не поровну: {black} и '
+                f'{len(free) - black}'
+            )
+
+    # все свободные клетки должны быть связны
+    seen = {free[0]}
+    stack = [free[0]]
+    while stack:
+        for neighbour in adjacent[stack.pop()]:
+            if neighbour not in seen:
+                seen.add(neighbour)
+                stack.append(neighbour)
+    if len(seen) != len(free):
+        raise NoCycle('Свободные клетки не связны')
+
+    edges = [set(neighbour) for neighbour in adjacent]
+    must = [set() for _ in adjacent]
+    for first, second in zip(body, body[1:]):
+        must[first].add(second)
+        must[second].add(first)
+    changed = True
+    while changed:
+        changed = False
+        for index in free:
+            if len(edges[index]) < 2:
+                raise NoCycle(f'Тупик в клетке {divmod(index, y_len)}')
+            if len(must[index]) > 2:
+                raise NoCycle(
+                    f'В клетку {divmod(index, y_len)} '
+                    f'ведут три обязательных ребра'
+                )
+            if len(edges[index]) == 2 and len(must[index]) < 2:
+                for neighbour in edges[index]:
+                    must[index].add(neighbour)
+                    must[neighbour].add(index)
+                changed = True
+            if len(must[index]) == 2 and len(edges[index]) > 2:
+                for neighbour in edges[index] - must[index]:
+                    edges[neighbour].discard(index)
+                edges[index] = set(must[index])
+                changed = True
+    return must
+
+
+def search_cycle(
+        grid: Grid,
+        snake: tuple,
+        must: list,
+        steps: int = SEARCH_STEPS,
+        seed: int = 0,
+) -> Optional[list]:
+    """
+    Ищет цикл поворотами Поша. Путь начинается с тела змейки
+    от хвоста к голове и растёт с конца, следующей берётся
+    клетка с наименьшим числом свободных соседей. Если конец
+    упёрся, путь разворачивается: берётся сосед конца на пути,
+    и кусок пути после него переворачивается, конец меняется.
+    Тело змейки и обязательные рёбра при этом не рвутся.
+    Возвращает клетки цикла от хвоста змейки к голове и
+    дальше или None, если за steps шагов цикл не найден.
+    """
+    rng = Random(seed)
+    adjacent = free_neighbours(grid)
+    free = sum(bool(neighbour) for neighbour in adjacent)
+
+    path = [row * grid.y_len + col for row, col in reversed(snake)]
+    # с этого места путь можно переворачивать
+    fixed = len(path) - 1
+    start = path[0]
+    # место клетки на пути, -1 - клетки на пути нет
+    place = array('i', [-1]) * len(adjacent)
+    for position, index in enumerate(path):
+        place[index] = position
+
+    def fresh_count(index: int) -> tuple:
+        return (
+            sum(place[neighbour] < 0 for neighbour in adjacent[index]),
+            rng.random(),
+        )
+
+    for _ in range(steps):
+        end = path[-1]
+        if len(path) == free and start in adjacent[end]:
+            return path
+        fresh = [n for n in adjacent[end] if place[n] < 0]
+        forced = [n for n in fresh if n in must[end]]
+        if forced or fresh:
+            index = min(forced or fresh, key=fresh_count)
+            place[index] = len(path)
+            path.append(index)
+            continue
+
+        pivots = [
+            place[neighbour] for neighbour in adjacent[end]
+            if fixed <= place[neighbour] < len(path) - 2
+            and path[place[neighbour] + 1] not in must[neighbour]
+        ]
+        if not pivots:
+            # развернуться некуда, обрезаем путь и растим заново
+            cut = fixed + 1 + rng.randrange(len(path) - fixed)
+            for index in path[cut:]:
+                place[index] = -1
+            del path[cut:]
+            continue
+        pivot = rng.choice(pivots)
+        path[pivot + 1:] = path[:pivot:-1]
+        for position in range(pivot + 1, len(path)):
+            place[path[position]] = position
+    return None
+
+
+def find_cycle(
+        grid: Grid,
+        snake: tuple,
+        steps: int = SEARCH_STEPS,
+        attempts: int = ATTEMPTS,
+) -> list:
+    """
+    Цикл для поля и змейки, NoCycle - если его нет или не нашёлся.
+    Поиск с разными сидами повторяется attempts раз: короткие
+    попытки находят цикл чаще, чем одна длинная.
+    """
+    must = check_cycle_possible(grid, snake)
+    for seed in range(attempts):
+        cycle = search_cycle(grid, snake, must, steps, seed)
+        if cycle is not None:
+            return cycle
+    raise NoCycle(f'Цикл не найден за {attempts} попыток по {steps} шагов')
+
+
+class Cycle:
+    """
+    Гамильтонов цикл поля: порядок клеток и таблица
+    клетка -> направление на следующую клетку цикла
+    """
+
+    def __init__(self, x_len: int, y_len: int, order: list, key: int = 0):
+        self.x_len = x_len
+        self.y_len = y_len
+        self.order = array('I', order)
+        self.key = key
+        size = x_len * y_len
+        # место клетки в цикле, -1 - клетки в цикле нет
+        self.position = array('i', [-1]) * size
+        # код направления из DIRECTIONS на следующую клетку
+        self.moves = bytearray(b'\xff') * size
+        for place, index in enumerate(order):
+            self.position[index] = place
+            following = order[(place + 1) % len(order)]
+            self.moves[index] = neighbours(index, x_len, y_len).index(following)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def next_direction(self, index: int) -> str:
+        return DIRECTIONS[self.moves[index]]
+
+
+def dumps(cycle: Cycle) -> bytes:
+    return HEADER.pack(
+        MAGIC, VERSION, cycle.x_len, cycle.y_len, cycle.key, len(cycle)
+    ) + cycle.order.tobytes()
+
+
+def loads(data: bytes) -> Cycle:
+    if len(data) < HEADER.size:
+        raise ValueError('Файл цикла обрезан')
+    magic, version, x_len, y_len, key, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Это не файл цикла')
+    if version != VERSION:
+        raise ValueError(f'Неизвестная версия цикла: {version}')
+    order = array('I')
+    if len(data) != HEADER.size + order.itemsize * length:
+        raise ValueError('Файл цикла обрезан или повреждён')
+    order.frombytes(data[HEADER.size:])
+    return Cycle(x_len, y_len, order.tolist(), key)
+
+
+def cycle_path(level_path: str) -> str:
+    return os.path.splitext(level_path)[0] + EXTENSION
+
+
+def level_cycle(level_path: str) -> Cycle:
+    """
+    Цикл уровня из файла .cycle рядом с уровнем.
+    Если файла нет или уровень с тех пор поменялся,
+    цикл ищется заново и сохраняется.
+    NoCycle - если для уровня цикла нет.
+    """
+    from levels import read_level
+
+    level = read_level(level_path)
+    key = layout_key(level.grid, level.snake)
+    path = cycle_path(level_path)
+    try:
+        with open(path, 'rb') as file:
+            cycle = loads(file.read())
+        if cycle.key == key:
+            return cycle
+    except (OSError, ValueError):
+        pass
+
+    order = find_cycle(level.grid, level.snake)
+    cycle = Cycle(level.x_len, level.y_len, order, key)
+    with open(path, 'wb') as file:
+        file.write(dumps(cycle))
+    return cycle
+
+
+class CycleController:
+    """
+    Контроллер, который ведёт змейку по циклу.
+
+    Без срезок змейка просто идёт по циклу и выигрывает
+    всегда. Со срезками (shortcuts=True) она может прыгнуть
+    вперёд по циклу к соседней клетке ближе к яблоку, если
+    не проскочит яблоко и между новой головой и хвостом
+    останется места на все оставшиеся яблоки. Тело тогда
+    всё так же лежит на цикле между хвостом и головой,
+    и выигрыш сохраняется, а игра идёт быстрее.
+    """
+
+    def __init__(self, cycle: Cycle, shortcuts: bool = False):
+        self.cycle = cycle
+        self.shortcuts = shortcuts
+
+    def __call__(self, field: Field, direction: str) -> str:
+        cycle = self.cycle
+        y_len = field.y_len
+        head = field.row_head * y_len + field.col_head
+        if not self.shortcuts:
+            return cycle.next_direction(head)
+
+        position = cycle.position
+        length = len(cycle)
+        row_tail, col_tail = field.snake.points[-1]
+        tail = position[row_tail * y_len + col_tail]
+        # места в цикле считаются от хвоста
+        ahead = (position[head] - tail) % length
+        cells = field.field.cells
+        apple = cells.find(Grid.APPLE)
+        target = length
+        if apple != -1:
+            place = (position[apple] - tail) % length
+            if place > ahead:
+                target = place
+        # клеток между новой головой и хвостом должно хватить
+        # на рост змейки от всех оставшихся яблок
+        limit = min(target, length - 2 - field.apples)
+
+        best, best_move = ahead + 1, cycle.moves[head]
+        for move, neighbour in enumerate(
+                neighbours(head, field.x_len, y_len)
+        ):
+            if cells[neighbour] not in (Grid.DEFAULT, Grid.APPLE):
+                continue
+            place = (position[neighbour] - tail) % length
+            if best < place <= limit:
+                best, best_move = place, move
+        return DIRECTIONS[best_move]
+
+
+if __name__ == '__main__':
+    from levels import level_path, read_level
+    from objects import GameManager
+
+    for lvl in GameManager.ALL_LEVELS:
+        path = level_path(lvl)
+        started = perf_counter()
+        try:
+            cycle = level_cycle(path)
+        except NoCycle as error:
+            level = read_level(path)
+            try:
+                order = find_cycle(level.grid, level.snake[:1])
+            except NoCycle as head_error:
+                print(f'Уровень {lvl}: цикла нет - {head_error}')
+            else:
+                print(
+                    f'Уровень {lvl}: цикла через начальное тело змейки '
+                    f'нет - {error}; от головы есть цикл из '
+                    f'{len(order)} клеток'
+                )
+            continue
+        found = perf_counter() - started
+
+        results = []
+        for shortcuts in (False, True):
+            game = read_level(path).build_game()
+            controller = CycleController(cycle, shortcuts)
+            started = perf_counter()
+            result = game.run_headless(controller, max_ticks=100000)
+            result['speed'] = result['ticks'] / (perf_counter() - started)
+            results.append(result)
+        print(
+            f'Уровень {lvl}: цикл из {len(cycle)} клеток за {found:.3f} с; '
+            + '; '.join(
+                f'{name}: {result["outcome"]} за {result["ticks"]} тиков, '
+                f'{result["speed"]:.0f} тиков/с'
+                for name, result in zip(('по циклу', 'со срезками'), results)
+            )
+        )
@@ -0,0 +1,124 @@
+"""
+Очередь нажатий клавиш между потоком клавиатуры и игровым циклом.
+
+Хоткеи keyboard вызываются из своего потока, а игровой цикл
+забирает из очереди не больше одного поворота за тик. Так два
+быстрых нажатия внутри одного тика (например, вверх и сразу
+влево) превращаются в два поворота на двух тиках подряд, а
+разворот на 180 градусов проверяется по направлению, в котором
+змейка действительно едет.
+"""
+from array import array
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+from timing import percentile
+
+
+HORIZONTAL = ('UP', 'DOWN')
+VERTICAL = ('LEFT', 'RIGHT')
+
+
+def is_turn(current: str, direction: str) -> bool:
+    """
+    Можно ли повернуть из current в direction:
+    только на 90 градусов, разворот и то же
+    направление поворотом не считаются
+    """
+    return (
+        current in HORIZONTAL and direction in VERTICAL
+        or current in VERTICAL and direction in HORIZONTAL
+    )
+
+
+class InputQueue:
+    """
+    Ограниченная потокобезопасная очередь нажатий.
+
+    push() вызывается из потока клавиатуры, next_direction() -
+    из игрового цикла раз в тик. Если очередь заполнена,
+    новое нажатие отбрасывается. Для каждого применённого
+    нажатия запоминается, сколько прошло от нажатия до хода.
+    """
+
+    def __init__(
+            self,
+            depth: int = 3,
+            clock: Callable[[], float] = perf_counter,
+    ):
+        if depth < 1:
+            raise ValueError('Глубина очереди должна быть не меньше 1')
+        # сколько нажатий может ждать своего тика
+        self.depth = depth
+        self.clock = clock
+        self.lock = Lock()
+        # пары (направление, момент нажатия)
+        self.pending = deque()
+
+        # задержка от нажатия до хода в секундах
+        self.latency = array('d')
+        # нажатия, не влезшие в очередь
+        self.dropped = 0
+        # нажатия, которые не были поворотом
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __getstate__(self) -> dict:
+        # блокировку не сохранить и не скопировать,
+        # ждущие нажатия к копии игры не относятся
+        state = dict(self.__dict__)
+        del state['lock']
+        state['pending'] = deque()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def push(self, direction: str) -> bool:
+        """Запоминает нажатие, False - если очередь заполнена"""
+        pressed = self.clock()
+        with self.lock:
+            if len(self.pending) >= self.depth:
+                self.dropped += 1
+                return False
+            self.pending.append((direction, pressed))
+            return True
+
+    def next_direction(self, current: str) -> str:
+        """
+        Направление на следующий ход: первый из ждущих
+        поворотов относительно current. Нажатия, которые
+        не поворачивают змейку, выбрасываются по пути.
+        """
+        with self.lock:
+            while self.pending:
+                direction, pressed = self.pending.popleft()
+                if is_turn(current, direction):
+                    self.latency.append(self.clock() - pressed)
+                    return direction
+                self.rejected += 1
+        return current
+
+    def clear(self) -> None:
+        with self.lock:
+            self.pending.clear()
+
+    def summary(self) -> dict:
+        """
+        Сводка по нажатиям: сколько применено, отброшено
+        и задержка до хода в миллисекундах
+        """
+        return {
+            'applied': len(self.latency),
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'p50': percentile(self.latency, 50) * 1000,
+            'p95': percentile(self.latency, 95) * 1000,
+            'p99': percentile(self.latency, 99) * 1000,
+            'max': max(self.latency, default=0.0) * 1000,
+        }
@@ -0,0 +1,262 @@
+"""
+Инструменты для разбора медленных сессий GameManager.play
+и play_async.
+
+    Hooks             - функции, которые вызываются до и после
+                        тика, хода змейки и отрисовки кадра
+    Counters          - счётчики сессии, их можно читать прямо
+                        во время игры из хука или другого потока
+    SamplingProfiler  - профилировщик по выборкам: раз в interval
+                        секунд смотрит, где сейчас игровой поток,
+                        и в конце даёт разбивку по функциям
+
+Пока хуков нет, игровой цикл их не вызывает вовсе, а
+счётчики - это несколько сложений за тик.
+"""
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, sleep
+from typing import Callable, Optional
+
+
+EVENTS = (
+    'before_tick', 'after_tick',
+    'before_move', 'after_move',
+    'before_render', 'after_render',
+)
+
+
+class Hooks:
+    """
+    Хуки по событиям EVENTS. Хук - функция hook(game),
+    game - GameManager, который сейчас играет.
+    """
+
+    def __init__(self):
+        self.hooks = {event: [] for event in EVENTS}
+
+    def __bool__(self) -> bool:
+        return any(self.hooks.values())
+
+    def add(self, event: str, hook: Callable) -> None:
+        if event not in self.hooks:
+            raise ValueError(f'Нет такого события: {event}')
+        self.hooks[event].append(hook)
+
+    def remove(self, event: str, hook: Callable) -> None:
+        self.hooks[event].remove(hook)
+
+    def fire(self, event: str, game) -> None:
+        for hook in self.hooks[event]:
+            hook(game)
+
+
+class Counters:
+    """
+    Счётчики сессии: тики, съеденные яблоки, байты кадров
+    и сколько секунд ушло на каждую фазу тика:
+    move - ввод, ход змейки и запись лога,
+    render - вывод кадра вместе с очисткой экрана,
+    sleep - ожидание следующего тика.
+    """
+    PHASES = ('move', 'render', 'sleep')
+
+    def __init__(
+            self,
+            field=None,
+            renderer=None,
+            clock: Callable[[], float] = perf_counter,
+    ):
+        self.clock = clock
+        self.started = clock()
+        self.ticks = 0
+        self.move = 0.0
+        self.render = 0.0
+        self.sleep = 0.0
+        # яблоки и байты не копятся за тик, а считаются при
+        # чтении по полю и рендереру от значений на старте
+        self.field = field
+        self.renderer = renderer
+        self.start_apples = field.apples if field is not None else 0
+        self.start_frames = renderer.frames if renderer is not None else 0
+        self.start_bytes = (
+            renderer.bytes_written if renderer is not None else 0
+        )
+        # итог после finish
+        self.finished = None
+        self.totals = None
+
+    @property
+    def apples(self) -> int:
+        if self.totals is not None:
+            return self.totals['apples']
+        if self.field is None:
+            return 0
+        return self.start_apples - self.field.apples
+
+    @property
+    def frames(self) -> int:
+        if self.totals is not None:
+            return self.totals['frames']
+        if self.renderer is None:
+            return 0
+        return self.renderer.frames - self.start_frames
+
+    @property
+    def render_bytes(self) -> int:
+        if self.totals is not None:
+            return self.totals['render_bytes']
+        if self.renderer is None:
+            return 0
+        return self.renderer.bytes_written - self.start_bytes
+
+    def finish(self) -> None:
+        """
+        Конец сессии: время останавливается, счётчики
+        запоминаются, а поле и рендерер отпускаются,
+        чтобы игру можно было копировать и сохранять
+        """
+        self.finished = self.clock()
+        self.totals = {
+            'apples': self.apples,
+            'frames': self.frames,
+            'render_bytes': self.render_bytes,
+        }
+        self.field = None
+        self.renderer = None
+
+    def add(self, move: float, render: float, sleep: float) -> None:
+        self.ticks += 1
+        self.move += move
+        self.render += render
+        self.sleep += sleep
+
+    def elapsed(self) -> float:
+        if self.finished is not None:
+            return self.finished - self.started
+        return self.clock() - self.started
+
+    def ticks_per_second(self) -> float:
+        elapsed = self.elapsed()
+        return self.ticks / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> dict:
+        """Счётчики и доли фаз от времени сессии"""
+        elapsed = self.elapsed()
+        result = {
+            'ticks': self.ticks,
+            'ticks_per_second': self.ticks_per_second(),
+            'elapsed': elapsed,
+            'apples': self.apples,
+            'frames': self.frames,
+            'render_bytes': self.render_bytes,
+        }
+        for phase in self.PHASES:
+            spent = getattr(self, phase)
+            result[phase] = {
+                'seconds': spent,
+                'share': spent / elapsed if elapsed > 0 else 0.0,
+            }
+        return result
+
+
+def frame_name(code) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:' \
+           f'{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """
+    Профилировщик по выборкам для одного потока.
+
+    Раз в interval секунд берётся текущий стек профилируемого
+    потока. self - в скольких выборках функция была наверху
+    стека, total - сколько раз она была в стеке вообще. Игра
+    при этом не замедляется на каждый вызов функции, как с
+    cProfile, а только на сами выборки.
+
+    Там, где есть signal.setitimer, а профилируется главный
+    поток, выборки снимает обработчик SIGALRM прямо в этом
+    потоке. Иначе их снимает отдельный поток, но он получает
+    GIL в основном, когда игра спит, поэтому разбивка по
+    функциям выходит грубее.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.thread_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+        # обработчик SIGALRM до старта, None - выборки в потоке
+        self.previous_handler = None
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        """Начинает выборки потока thread_id, по умолчанию текущего"""
+        self.thread_id = thread_id or threading.get_ident()
+        if hasattr(signal, 'setitimer') \
+                and self.thread_id == threading.main_thread().ident \
+                and threading.get_ident() == self.thread_id:
+            self.previous_handler = signal.signal(
+                signal.SIGALRM, self.handle_signal
+            )
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+            return None
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.previous_handler is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+            self.previous_handler = None
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self) -> 'SamplingProfiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def handle_signal(self, signum: int, frame) -> None:
+        self.record(frame)
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            sleep(self.interval)
+            self.record(sys._current_frames().get(self.thread_id))
+
+    def record(self, frame) -> None:
+        if frame is None:
+            return None
+        self.samples += 1
+        self.self_counts[frame_name(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            name = frame_name(frame.f_code)
+            if name not in seen:
+                seen.add(name)
+                self.total_counts[name] += 1
+            frame = frame.f_back
+
+    def summary(self, limit: int = 30) -> list:
+        """limit функций с наибольшим total, доли от всех выборок"""
+        samples = self.samples or 1
+        return [
+            {
+                'function': name,
+                'self': self.self_counts[name] / samples,
+                'total': total / samples,
+            }
+            for name, total in self.total_counts.most_common(limit)
+        ]
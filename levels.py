@@ -0,0 +1,336 @@
+"""
+Компактный формат уровней кампании (.lvl).
+
+Файл уровня:
+
+    b'SNKL', версия (1 байт)
+    x_len, y_len (uint32), delay (float64), яблок (uint32),
+    код начального направления (1 байт, 255 - случайное),
+    длина змейки (uint32),
+    точки змейки от головы к хвосту (uint32 индекс клетки),
+    стены по 1 биту на клетку
+
+Индекс клетки - row * y_len + col, как в Grid. В файле нет
+объектов Python, поэтому загрузка не исполняет чужой код,
+а поле собирается из битовой карты сразу в bytearray Grid.
+
+Запуск: python levels.py - переводит старые уровни .pkl
+из папки lvls в .lvl, python levels.py --check - проверяет
+уровни папки lvls функцией check_level
+"""
+import os
+import struct
+import sys
+from functools import lru_cache
+from typing import Optional
+
+from objects import Grid, Regions, Snake, Field, GameManager
+
+
+MAGIC = b'SNKL'
+VERSION = 1
+EXTENSION = '.lvl'
+LEVELS_DIR = 'lvls'
+# сколько прочитанных файлов уровней держать в памяти
+LEVEL_CACHE_SIZE = 32
+
+# коды направлений, как в повторах
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+# код случайного направления
+RANDOM_DIRECTION = 255
+
+HEADER = struct.Struct('<4sBIIdIBI')
+POINT = struct.Struct('<I')
+
+# байт битовой карты -> 8 клеток Grid
+WALLS_TABLE = [
+    bytes(
+        Grid.LET if byte >> bit & 1 else Grid.DEFAULT
+        for bit in range(8)
+    )
+    for byte in range(256)
+]
+
+
+def pack_walls(cells: bytes) -> bytes:
+    """Битовая карта стен по 8 клеток в байт"""
+    result = bytearray((len(cells) + 7) // 8)
+    for index, code in enumerate(cells):
+        if code == Grid.LET:
+            result[index >> 3] |= 1 << (index & 7)
+    return bytes(result)
+
+
+def unpack_walls(walls: bytes, size: int) -> bytearray:
+    """Клетки Grid по битовой карте стен"""
+    return bytearray(b''.join(WALLS_TABLE[byte] for byte in walls)[:size])
+
+
+class Level:
+    """
+    Уровень: размеры поля, стены, начальная змейка,
+    направление, задержка и кол-во яблок.
+    Поле из битовой карты собирается один раз при создании
+    первой игры, дальше новые поля копируются с него. Вместе
+    с полем один раз считается индекс областей, поле получает
+    его, только если стены делят его на несколько областей.
+    Прочитанные уровни лежат в кэше, поэтому их не меняют.
+    """
+
+    def __init__(
+            self,
+            x_len: int,
+            y_len: int,
+            walls: bytes,
+            snake: list,
+            apples: int,
+            delay: float = 0.2,
+            direction: Optional[str] = None,
+    ):
+        self.x_len = x_len
+        self.y_len = y_len
+        # стены по 1 биту на клетку
+        self.walls = walls
+        # точки змейки от головы к хвосту
+        self.snake = tuple(snake)
+        self.apples = apples
+        self.delay = delay
+        # None - направление выбирается случайно при старте
+        self.direction = direction
+        # поле со стенами, собирается при первом обращении
+        self._grid = None
+        # индекс областей для check_level, если поле его не держит
+        self._regions = None
+
+    @property
+    def grid(self) -> Grid:
+        """Поле со стенами без змейки и яблок, только для чтения"""
+        if self._grid is None:
+            grid = Grid.from_cells(
+                self.x_len,
+                self.y_len,
+                unpack_walls(self.walls, self.x_len * self.y_len),
+            )
+            grid.set_regions(Regions.split(grid))
+            self._grid = grid
+        return self._grid
+
+    @property
+    def regions(self) -> Regions:
+        """Связные области уровня по стенам, см. check_level"""
+        if self.grid.regions is not None:
+            return self.grid.regions
+        if self._regions is None:
+            self._regions = Regions.from_grid(self.grid)
+        return self._regions
+
+    @classmethod
+    def from_field(
+            cls,
+            field: Field,
+            delay: float = 0.2,
+            direction: Optional[str] = None,
+    ) -> 'Level':
+        """Уровень по готовому полю: стены - клетки Cell.let"""
+        return cls(
+            x_len=field.x_len,
+            y_len=field.y_len,
+            walls=pack_walls(field.field.cells),
+            snake=list(field.snake),
+            apples=field.apples,
+            delay=delay,
+            direction=direction,
+        )
+
+    def build_field(self) -> Field:
+        """
+        Собирает поле уровня и ставит первое яблоко.
+        Каждый вызов даёт новое поле.
+        """
+        return Field.from_grid(
+            snake=Snake(start_points=list(self.snake)),
+            grid=self.grid.copy(),
+            apples=self.apples,
+            gen_apple=True,
+        )
+
+    def build_game(self) -> GameManager:
+        field = self.build_field()
+        return GameManager(
+            snake=field.snake,
+            field=field,
+            delay=self.delay,
+            direction=self.direction,
+        )
+
+
+def dumps(level: Level) -> bytes:
+    if level.direction is None:
+        direction = RANDOM_DIRECTION
+    else:
+        direction = DIRECTION_CODES[level.direction]
+    parts = [HEADER.pack(
+        MAGIC,
+        VERSION,
+        level.x_len,
+        level.y_len,
+        level.delay,
+        level.apples,
+        direction,
+        len(level.snake),
+    )]
+    parts.extend(
+        POINT.pack(row * level.y_len + col) for row, col in level.snake
+    )
+    parts.append(level.walls)
+    return b''.join(parts)
+
+
+def loads(data: bytes) -> Level:
+    if len(data) < HEADER.size:
+        raise ValueError('Файл уровня обрезан')
+    magic, version, x_len, y_len, delay, apples, direction, length = (
+        HEADER.unpack_from(data)
+    )
+    if magic != MAGIC:
+        raise ValueError('Это не файл уровня')
+    if version != VERSION:
+        raise ValueError(f'Неизвестная версия уровня: {version}')
+
+    offset = HEADER.size
+    walls_size = (x_len * y_len + 7) // 8
+    if len(data) != offset + POINT.size * length + walls_size:
+        raise ValueError('Файл уровня обрезан или повреждён')
+
+    snake = []
+    for _ in range(length):
+        (index,) = POINT.unpack_from(data, offset)
+        offset += POINT.size
+        snake.append(divmod(index, y_len))
+
+    return Level(
+        x_len=x_len,
+        y_len=y_len,
+        walls=data[offset:],
+        snake=snake,
+        apples=apples,
+        delay=delay,
+        direction=None if direction == RANDOM_DIRECTION else DIRECTIONS[direction],
+    )
+
+
+def level_path(lvl: int) -> str:
+    return os.path.join(LEVELS_DIR, f'{lvl}{EXTENSION}')
+
+
+@lru_cache(maxsize=LEVEL_CACHE_SIZE)
+def compile_level(path: str, mtime: int) -> Level:
+    """
+    Читает уровень из файла. Кэшируется по пути и времени
+    изменения файла, счётчики - compile_level.cache_info()
+    """
+    with open(path, 'rb') as file:
+        return loads(file.read())
+
+
+def read_level(path: str) -> Level:
+    """
+    Уровень из файла через кэш: пока файл не менялся,
+    он не перечитывается.
+    """
+    return compile_level(path, os.stat(path).st_mtime_ns)
+
+
+def save_level(lvl: int, level: Level) -> str:
+    """Сохраняет уровень в папку lvls, возвращает путь к файлу"""
+    os.makedirs(LEVELS_DIR, exist_ok=True)
+    path = level_path(lvl)
+    with open(path, 'wb') as file:
+        file.write(dumps(level))
+    return path
+
+
+def load_level(lvl: int) -> GameManager:
+    """Новая игра на уровне lvl из папки lvls"""
+    return read_level(level_path(lvl)).build_game()
+
+
+def check_level(level: Level) -> list:
+    """
+    Проверка раскладки уровня по индексу областей.
+    Возвращает список проблем, пустой - уровень в порядке:
+    змейка на стене или в нескольких областях сразу,
+    клетки, куда змейке не попасть, и яблоки, которым не
+    хватит места в области змейки.
+    """
+    regions = level.regions
+    problems = []
+    labels = {regions.label(row, col) for row, col in level.snake}
+    if Regions.WALL in labels:
+        problems.append('змейка стоит на стене')
+        labels.discard(Regions.WALL)
+    if len(labels) > 1:
+        problems.append(f'змейка лежит в {len(labels)} областях')
+    if len(labels) != 1:
+        return problems
+
+    (region,) = labels
+    pockets = sum(regions.sizes) - regions.sizes[region]
+    if pockets:
+        problems.append(
+            f'{pockets} клеток в {len(regions) - 1} областях, '
+            f'куда змейке не попасть'
+        )
+    room = regions.sizes[region] - len(level.snake)
+    if level.apples > room:
+        problems.append(
+            f'яблок {level.apples}, а свободных клеток '
+            f'в области змейки {room}'
+        )
+    return problems
+
+
+def convert_pickle(path: str) -> str:
+    """
+    Переводит старый уровень .pkl (pickle GameManager)
+    в формат .lvl рядом с ним. Возвращает путь к новому файлу.
+    Старый файл читается через pickle, поэтому
+    переводить стоит только свои уровни.
+    """
+    import pickle
+
+    with open(path, 'rb') as file:
+        game = pickle.load(file)
+    # яблоко, уже стоящее на старом поле, в уровень не попадает
+    cells = bytes(
+        Grid.DEFAULT if code == Grid.APPLE else code
+        for code in game.field.field.cells
+    )
+    field = Field.from_grid(
+        snake=game.snake,
+        grid=Grid.from_cells(game.field.x_len, game.field.y_len, cells),
+        apples=game.field.apples,
+    )
+    new_path = path[:-len('.pkl')] + EXTENSION
+    with open(new_path, 'wb') as file:
+        file.write(dumps(Level.from_field(
+            field=field,
+            delay=game.delay,
+            direction=game.direction,
+        )))
+    return new_path
+
+
+if __name__ == '__main__':
+    if '--check' in sys.argv[1:]:
+        for filename in sorted(os.listdir(LEVELS_DIR)):
+            if filename.endswith(EXTENSION):
+                level = read_level(os.path.join(LEVELS_DIR, filename))
+                problems = check_level(level)
+                print(f'{filename}: {len(level.regions)} обл., '
+                      f'{"; ".join(problems) or "ок"}')
+    else:
+        for filename in sorted(os.listdir(LEVELS_DIR)):
+            if filename.endswith('.pkl'):
+                print(convert_pickle(os.path.join(LEVELS_DIR, filename)))
@@ -1,13 +1,15 @@
 import os
-import keyboard
-import pickle
-from time import sleep
-from functools import partial
-from random import choice, randint
+from array import array
+from time import perf_counter
+from functools import lru_cache, partial
+from random import choice, randint, randrange
 from collections import deque
-from copy import deepcopy
-from datetime import datetime
-from typing import Optional
+from typing import Callable, Iterable, Optional
+
+from inputs import InputQueue, is_turn
+from instrument import Counters, Hooks, SamplingProfiler
+from render import TerminalRenderer, ViewportRenderer
+from timing import TickScheduler, TickStats
 
 
 class Cell:
@@ -21,10 +23,523 @@ class Cell:
         self.content = content
 
 
+class CellView(Cell):
+    """
+    Ячейка-представление над хранилищем Grid.
+    Нужна для совместимости со старым доступом
+    вида field.field[row][col].content
+    """
+
+    def __init__(self, grid: 'Grid', index: int):
+        self.grid = grid
+        self.index = index
+
+    @property
+    def content(self) -> str:
+        return chr(self.grid.cells[self.index])
+
+    @content.setter
+    def content(self, content: str) -> None:
+        self.grid.set_code(self.index, ord(content))
+
+
+class GridRow:
+    """Строка поля Grid, отдаёт ячейки CellView"""
+
+    def __init__(self, grid: 'Grid', row: int):
+        self.grid = grid
+        self.row = row
+
+    def __len__(self) -> int:
+        return self.grid.y_len
+
+    def __getitem__(self, col: int) -> CellView:
+        if col < 0:
+            col += self.grid.y_len
+        if not 0 <= col < self.grid.y_len:
+            raise IndexError('Индекс столбца за пределами поля')
+        return CellView(self.grid, self.row * self.grid.y_len + col)
+
+    def __iter__(self):
+        start = self.row * self.grid.y_len
+        for index in range(start, start + self.grid.y_len):
+            yield CellView(self.grid, index)
+
+    def __str__(self) -> str:
+        return self.grid.row_string(self.row)
+
+
+class FreeCells:
+    """
+    Индекс свободных клеток поля.
+
+    groups - плотные массивы индексов свободных клеток,
+    один на всё поле или по одному на каждую область
+    Regions, positions - позиция каждой клетки в массиве
+    её группы или -1. Удаление из середины делается
+    перестановкой с последним элементом, поэтому
+    добавление, удаление и случайный выбор работают за O(1).
+    """
+
+    def __init__(
+            self,
+            cells: bytearray,
+            free_code: int,
+            regions: Optional['Regions'] = None,
+    ):
+        self.labels = None if regions is None else regions.labels
+        if regions is None and cells.count(free_code) == len(cells):
+            # пустое поле собираем без цикла на Python
+            self.groups = [array('i', range(len(cells)))]
+            self.positions = array('i', range(len(cells)))
+            return None
+
+        if regions is None:
+            self.groups = [array('i', [
+                index for index, code in enumerate(cells)
+                if code == free_code
+            ])]
+        else:
+            # последняя группа - для стен, которые потом стёрли:
+            # их метка Regions.WALL = -1 попадает как раз в неё
+            self.groups = [array('i') for _ in range(len(regions) + 1)]
+            for index, code in enumerate(cells):
+                if code == free_code:
+                    self.groups[self.labels[index]].append(index)
+        self.positions = array('i', [-1]) * len(cells)
+        for items in self.groups:
+            for position, index in enumerate(items):
+                self.positions[index] = position
+
+    @property
+    def items(self) -> array:
+        """Все свободные клетки одним массивом"""
+        if len(self.groups) == 1:
+            return self.groups[0]
+        items = array('i')
+        for group in self.groups:
+            items.extend(group)
+        return items
+
+    def __len__(self) -> int:
+        if len(self.groups) == 1:
+            return len(self.groups[0])
+        return sum(len(items) for items in self.groups)
+
+    def __contains__(self, index: int) -> bool:
+        return self.positions[index] != -1
+
+    def count(self, region: int) -> int:
+        """Сколько свободных клеток в области region"""
+        return len(self.groups[region])
+
+    def add(self, index: int) -> None:
+        if self.positions[index] == -1:
+            if self.labels is None:
+                items = self.groups[0]
+            else:
+                items = self.groups[self.labels[index]]
+            self.positions[index] = len(items)
+            items.append(index)
+
+    def discard(self, index: int) -> None:
+        position = self.positions[index]
+        if position == -1:
+            return None
+        if self.labels is None:
+            items = self.groups[0]
+        else:
+            items = self.groups[self.labels[index]]
+        last = items.pop()
+        if last != index:
+            items[position] = last
+            self.positions[last] = position
+        self.positions[index] = -1
+
+    def copy(self) -> 'FreeCells':
+        free = FreeCells.__new__(FreeCells)
+        # метки областей не меняются, их не копируем
+        free.labels = self.labels
+        free.groups = [items[:] for items in self.groups]
+        free.positions = self.positions[:]
+        return free
+
+    def choice(self, region: Optional[int] = None) -> int:
+        """
+        Случайная свободная клетка во всём поле или в области
+        region, IndexError если таких нет
+        """
+        if region is not None:
+            items = self.groups[region]
+        elif len(self.groups) == 1:
+            items = self.groups[0]
+        elif len(self):
+            position = randrange(len(self))
+            for items in self.groups:
+                if position < len(items):
+                    return items[position]
+                position -= len(items)
+        else:
+            items = None
+        if not items:
+            raise IndexError('Свободных клеток не осталось')
+        return items[randrange(len(items))]
+
+
+class Regions:
+    """
+    Индекс связных областей поля по стенам.
+
+    Змейка ходит с переносом через края, как в move_snake,
+    и не проходит сквозь стены, поэтому из одной области в
+    другую ей не попасть. labels - номер области каждой
+    клетки, у стен WALL, sizes - сколько клеток в каждой
+    области. Индекс считается заливкой один раз на раскладку
+    стен и дальше не меняется, поэтому копии поля делят его.
+    """
+    WALL = -1
+
+    def __init__(self, x_len: int, y_len: int, labels: array, sizes: tuple):
+        self.x_len = x_len
+        self.y_len = y_len
+        self.labels = labels
+        self.sizes = sizes
+
+    @classmethod
+    def from_grid(cls, grid: 'Grid') -> 'Regions':
+        """
+        Области по стенам Cell.let поля grid.
+        Заливка идёт не по клеткам, а по отрезкам строк
+        между стенами: отрезки соседних строк (и концы одной
+        строки) с общими клетками склеиваются в одну область.
+        Номера областей идут по первой клетке в порядке
+        row * y_len + col, как при заливке по клеткам.
+        """
+        x_len, y_len = grid.x_len, grid.y_len
+        cells = grid.cells
+        # отрезки каждой строки: (начало, конец, номер отрезка)
+        rows = []
+        count = 0
+        for row in range(x_len):
+            line = cells[row * y_len:(row + 1) * y_len]
+            runs = []
+            col = 0
+            while col < y_len:
+                wall = line.find(Grid.LET, col)
+                if wall == -1:
+                    wall = y_len
+                if wall > col:
+                    runs.append((col, wall, count))
+                    count += 1
+                col = wall + 1
+            rows.append(runs)
+
+        parent = list(range(count))
+
+        def find(run: int) -> int:
+            while parent[run] != run:
+                parent[run] = parent[parent[run]]
+                run = parent[run]
+            return run
+
+        def union(first: int, second: int) -> None:
+            first, second = find(first), find(second)
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+
+        for row, runs in enumerate(rows):
+            # перенос через левый и правый край
+            if len(runs) > 1 and runs[0][0] == 0 and runs[-1][1] == y_len:
+                union(runs[0][2], runs[-1][2])
+            # перенос через нижний край - строка x_len - 1 и строка 0
+            below = rows[(row + 1) % x_len]
+            index = 0
+            for start, end, run in runs:
+                while index < len(below) and below[index][1] <= start:
+                    index += 1
+                other = index
+                while other < len(below) and below[other][0] < end:
+                    union(run, below[other][2])
+                    other += 1
+
+        labels = array('i', [cls.WALL]) * (x_len * y_len)
+        sizes = []
+        numbers = {}
+        for row, runs in enumerate(rows):
+            base = row * y_len
+            for start, end, run in runs:
+                root = find(run)
+                region = numbers.get(root)
+                if region is None:
+                    region = numbers[root] = len(sizes)
+                    sizes.append(0)
+                labels[base + start:base + end] = (
+                    array('i', [region]) * (end - start)
+                )
+                sizes[region] += end - start
+        return cls(x_len, y_len, labels, tuple(sizes))
+
+    @classmethod
+    def split(cls, grid: 'Grid') -> Optional['Regions']:
+        """
+        Индекс областей, если стены делят поле grid на
+        несколько областей, иначе None: на поле из одной
+        области индекс ничего не меняет, а без него свободные
+        клетки лежат одной группой и поле дешевле.
+        """
+        if Grid.LET not in grid.cells:
+            return None
+        regions = cls.from_grid(grid)
+        return regions if len(regions) > 1 else None
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def label(self, row: int, col: int) -> int:
+        """Область клетки (row, col), WALL - стена"""
+        return self.labels[row * self.y_len + col]
+
+    def cells(self, region: int) -> list:
+        """Клетки области region индексами row * y_len + col"""
+        return [
+            index for index, label in enumerate(self.labels)
+            if label == region
+        ]
+
+
+class Grid:
+    """
+    Компактное хранилище игрового поля.
+
+    Все ячейки лежат в одном bytearray, индекс ячейки
+    считается как row * y_len + col. В ячейке хранится
+    код символа из Cell, поэтому строка поля - это срез
+    массива без создания объектов на каждую клетку.
+    """
+    DEFAULT = ord(Cell.default)
+    APPLE = ord(Cell.apple)
+    SNAKE = ord(Cell.snake)
+    LET = ord(Cell.let)
+    # поле хранит все клетки подряд, см. также sparse.SparseGrid
+    sparse = False
+    # индекс областей Regions, если он посчитан для раскладки
+    # стен, яблоки тогда ставятся только в область головы
+    regions = None
+    # растёт при каждом изменении стен, по нему кэши раскладки
+    # стен (например в autopilot) понимают, что она устарела
+    walls_version = 0
+
+    def __init__(
+            self,
+            x_len: int,
+            y_len: int,
+            content: str = Cell.default,
+    ):
+        # длина по вертикали
+        self.x_len = x_len
+        # длина по горизонтали
+        self.y_len = y_len
+        # содержимое всех ячеек подряд, строка за строкой
+        self.cells = bytearray(content.encode()) * (x_len * y_len)
+        # свободные клетки для спавна яблок
+        self.free = FreeCells(self.cells, self.DEFAULT)
+
+    @classmethod
+    def from_rows(cls, rows: list) -> 'Grid':
+        """Создаёт поле по списку строк из символов Cell"""
+        grid = cls(len(rows), len(rows[0]) if rows else 0)
+        for r_index, row in enumerate(rows):
+            if len(row) != grid.y_len:
+                raise ValueError(
+                    f'Строка {r_index} поля имеет длину {len(row)}, '
+                    f'а ожидалось {grid.y_len}'
+                )
+            start = r_index * grid.y_len
+            grid.cells[start:start + grid.y_len] = ''.join(row).encode()
+        grid.free = FreeCells(grid.cells, cls.DEFAULT)
+        return grid
+
+    @classmethod
+    def from_cells(
+            cls,
+            x_len: int,
+            y_len: int,
+            cells: bytes,
+            regions: Optional[Regions] = None,
+    ) -> 'Grid':
+        """
+        Создаёт поле по готовым кодам клеток.
+        regions - индекс областей той же раскладки стен
+        """
+        if len(cells) != x_len * y_len:
+            raise ValueError(
+                f'Для поля {x_len}x{y_len} нужно {x_len * y_len} клеток, '
+                f'а передано {len(cells)}'
+            )
+        grid = cls.__new__(cls)
+        grid.x_len = x_len
+        grid.y_len = y_len
+        grid.cells = bytearray(cells)
+        if regions is not None:
+            grid.regions = regions
+        grid.free = FreeCells(grid.cells, cls.DEFAULT, regions)
+        return grid
+
+    def copy(self) -> 'Grid':
+        """Копия поля вместе с индексом свободных клеток"""
+        grid = Grid.__new__(Grid)
+        grid.x_len = self.x_len
+        grid.y_len = self.y_len
+        grid.cells = self.cells[:]
+        grid.free = self.free.copy()
+        grid.regions = self.regions
+        return grid
+
+    def __getstate__(self) -> dict:
+        # индекс свободных клеток не сохраняем, он
+        # восстанавливается по содержимому поля
+        state = dict(self.__dict__)
+        del state['free']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.free = FreeCells(self.cells, self.DEFAULT, self.regions)
+
+    def set_regions(self, regions: Optional[Regions]) -> None:
+        """
+        Задаёт индекс областей для раскладки стен этого поля,
+        индекс свободных клеток пересобирается по областям
+        """
+        self.regions = regions
+        self.free = FreeCells(self.cells, self.DEFAULT, regions)
+
+    def index(self, row: int, col: int) -> int:
+        return row * self.y_len + col
+
+    def get(self, row: int, col: int) -> str:
+        return chr(self.cells[row * self.y_len + col])
+
+    def set(self, row: int, col: int, content: str) -> None:
+        self.set_code(row * self.y_len + col, ord(content))
+
+    def set_code(self, index: int, code: int) -> None:
+        """
+        Записывает код в ячейку по индексу.
+        Все изменения поля должны идти через этот метод,
+        иначе индекс свободных клеток разъедется с полем.
+        """
+        old = self.cells[index]
+        if old == code:
+            return None
+        if old == self.DEFAULT:
+            self.free.discard(index)
+        elif code == self.DEFAULT:
+            self.free.add(index)
+        if old == self.LET or code == self.LET:
+            self.walls_version += 1
+        self.cells[index] = code
+
+    def row_string(self, row: int) -> str:
+        start = row * self.y_len
+        return self.cells[start:start + self.y_len].decode()
+
+    def window(self, top: int, left: int, rows: int, cols: int) -> bytes:
+        """
+        Кусок поля rows x cols с левым верхним углом (top, left)
+        строка за строкой. Поле замкнуто, как для змейки:
+        за краем продолжается с противоположной стороны.
+        """
+        parts = []
+        left %= self.y_len
+        for r_index in range(rows):
+            start = (top + r_index) % self.x_len * self.y_len
+            stop = left + cols
+            parts.append(self.cells[start + left:start + min(stop, self.y_len)])
+            if stop > self.y_len:
+                parts.append(self.cells[start:start + stop - self.y_len])
+        return b''.join(parts)
+
+    def __len__(self) -> int:
+        return self.x_len
+
+    def __getitem__(self, row: int) -> GridRow:
+        if row < 0:
+            row += self.x_len
+        if not 0 <= row < self.x_len:
+            raise IndexError('Индекс строки за пределами поля')
+        return GridRow(self, row)
+
+    def __iter__(self):
+        for row in range(self.x_len):
+            yield GridRow(self, row)
+
+    def __str__(self) -> str:
+        return ''.join(
+            self.row_string(row) + '\n' for row in range(self.x_len)
+        )
+
+
+class CompiledSample:
+    """
+    Разобранный шаблон поля для set_field_by_sample.
+
+    grid - поле со стенами без змейки и яблок, его не меняют,
+    а копируют для каждого нового поля, вместе с ним копии
+    получают индекс областей grid.regions (None, если стены
+    не делят поле на несколько областей). Индекс считается
+    при первом обращении к grid, а не при разборе шаблона.
+    apples - клетки, где в шаблоне стоят яблоки: змейке там
+    появляться нельзя.
+    """
+
+    def __init__(self, grid: Grid, apples: frozenset):
+        self._grid = grid
+        self.indexed = False
+        self.apples = apples
+
+    @property
+    def grid(self) -> Grid:
+        if not self.indexed:
+            regions = Regions.split(self._grid)
+            if regions is not None:
+                self._grid.set_regions(regions)
+            self.indexed = True
+        return self._grid
+
+
+# сколько последних разных шаблонов держать разобранными
+SAMPLE_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=SAMPLE_CACHE_SIZE)
+def compile_sample(sample: str) -> CompiledSample:
+    """
+    Разбирает шаблон поля из символов Cell, пробелы
+    и пустые строки пропускаются. Результат кэшируется
+    по тексту шаблона, счётчики - compile_sample.cache_info()
+    """
+    rows = [row.replace(' ', '') for row in sample.split('\n')]
+    rows = [row for row in rows if row]
+    apples = frozenset(
+        (r_index, c_index)
+        for r_index, row in enumerate(rows)
+        for c_index, cell in enumerate(row)
+        if cell == Cell.apple
+    )
+    rows = [row.replace(Cell.apple, Cell.default) for row in rows]
+    return CompiledSample(Grid.from_rows(rows), apples)
+
+
 class Snake:
     def __init__(self, start_points: list[tuple]):
         # координаты точек змейки
         self.points = deque(start_points)
+        # сколько точек змейки лежит в каждой клетке,
+        # нужно для проверки принадлежности за O(1)
+        self.occupied = {}
+        for point in self.points:
+            self.occupied[point] = self.occupied.get(point, 0) + 1
 
     def __iter__(self):
         yield from self.points
@@ -32,6 +547,17 @@ class Snake:
     def __len__(self) -> int:
         return len(self.points)
 
+    def __contains__(self, point: tuple) -> bool:
+        return point in self.occupied
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        # в старых сохранениях индекса клеток нет
+        if 'occupied' not in state:
+            self.occupied = {}
+            for point in self.points:
+                self.occupied[point] = self.occupied.get(point, 0) + 1
+
     def grow(self, row: int, col: int) -> None:
         """
         Отвечает за рост змейки.
@@ -39,6 +565,7 @@ class Snake:
         координатами точки.
         """
         self.points.appendleft((row, col))
+        self.occupied[(row, col)] = self.occupied.get((row, col), 0) + 1
 
     def del_last_point(self) -> tuple:
         """
@@ -46,7 +573,13 @@ class Snake:
         тела змеи. Это нужно для создания эффекта
         движения змейки по полю.
         """
-        return self.points.pop()
+        point = self.points.pop()
+        count = self.occupied[point] - 1
+        if count:
+            self.occupied[point] = count
+        else:
+            del self.occupied[point]
+        return point
 
 
 class Field:
@@ -76,6 +609,9 @@ class Field:
     V
     x, row
     """
+    # если True, после каждого хода поле проверяется
+    # полной сверкой с телом змейки (для тестов)
+    debug = False
 
     def __init__(
         self,
@@ -90,7 +626,7 @@ class Field:
         self.y_len = y_len
 
         # игровое поле
-        self.field = [[Cell() for _ in range(y_len)] for _ in range(x_len)]
+        self.field = Grid(x_len, y_len)
 
         # объект змейки
         self.snake = snake
@@ -107,24 +643,89 @@ class Field:
         # for x, y in self.apples_points:
         #     self.field[x][y] = Cell(content=Cell.apple)
 
-        # вставляем первое яблочко
-        row, col = self.__generate_apple_point()
-        self.field[row][col].content = Cell.apple
-
         # координата головы
         self.row_head, self.col_head = self.snake.points[0]
 
+        # поле обновляется по разнице между тиками,
+        # поэтому тело змейки рисуем один раз на старте
+        self.paint_snake()
+
         # True, если игрок победил. False, если игрок проиграл или игра продолжается
         self.is_win = False
         # True, если игрок проиграл, False если победил или игра продолжается
         self.is_gameover = False
 
-    def __generate_apple_point(self) -> tuple:
-        while True:
-            row, col = randint(0, self.x_len - 1), randint(0, self.y_len - 1)
-            if (row, col) not in self.snake \
-               and self.field[row][col].content != Cell.let:
-                return row, col
+        # вставляем первое яблочко, если поле забито
+        # змейкой целиком, то это сразу победа
+        point = self.__generate_apple_point()
+        if point is None:
+            self.is_win = True
+        else:
+            self.field.set(*point, Cell.apple)
+
+    @classmethod
+    def from_grid(
+            cls,
+            snake: Snake,
+            grid: Grid,
+            apples: int,
+            apples_points: Iterable = (),
+            gen_apple: bool = False,
+    ) -> 'Field':
+        """
+        Собирает поле по готовому состоянию, например для повтора.
+        gen_apple - поставить первое яблоко, как при создании поля.
+        """
+        field = cls.__new__(cls)
+        field.x_len = grid.x_len
+        field.y_len = grid.y_len
+        field.field = grid
+        field.snake = snake
+        field.apples = apples
+        field.apples_points = deque(apples_points)
+        field.row_head, field.col_head = snake.points[0]
+        field.paint_snake()
+        field.is_win = False
+        field.is_gameover = False
+        if gen_apple:
+            point = field.__generate_apple_point()
+            if point is None:
+                field.is_win = True
+            else:
+                field.field.set(*point, Cell.apple)
+        return field
+
+    def __generate_apple_point(self) -> Optional[tuple]:
+        """
+        Выбирает случайную свободную клетку для яблока.
+        Если у поля есть индекс областей, то только в области
+        головы: в другие области змейке не попасть.
+        Возвращает None, если свободных клеток не осталось.
+        """
+        free = self.field.free
+        regions = self.field.regions
+        if regions is not None:
+            region = regions.label(self.row_head, self.col_head)
+            if region != Regions.WALL:
+                if not free.count(region):
+                    return None
+                return divmod(free.choice(region), self.y_len)
+        if not free:
+            return None
+        return divmod(free.choice(), self.y_len)
+
+    def __setstate__(self, state: dict) -> None:
+        # старые сохранения хранят поле списком списков Cell
+        if isinstance(state['field'], list):
+            state['field'] = Grid.from_rows([
+                [cell.content for cell in row]
+                for row in state['field']
+            ])
+            self.__dict__.update(state)
+            # старые версии рисовали змейку только в move_snake
+            self.paint_snake()
+        else:
+            self.__dict__.update(state)
 
     def game_status(self) -> str:
         if self.is_win:
@@ -135,11 +736,7 @@ class Field:
             return 'game'
 
     def __str__(self) -> str:
-        string = ''
-        for row in self.field:
-            string += ''.join(map(
-                lambda cell: cell.content, row)) + '\n'
-        return string
+        return str(self.field)
 
     def show(
             self,
@@ -151,11 +748,10 @@ class Field:
         width - символ между столбцами
         height - символ между строками
         """
-        for row in self.field:
-            print('\t' * 5, end='')
-            for cell in row:
-                print(cell.content, end=width)
-            print(height, end='')
+        print(''.join(
+            '\t' * 5 + width.join(self.field.row_string(row)) + width + height
+            for row in range(self.x_len)
+        ), end='')
 
     def set_field_by_sample(
             self,
@@ -166,30 +762,19 @@ class Field:
         Создаёт новое поле field
         на основании шаблона sample
         """
-        sample = list(map(list, sample.split('\n')))
-        self.field = []
+        compiled = compile_sample(sample)
+        # исключаем случай когда пытаемся
+        # вставить змейку в ячейку с яблоком
+        for row_snake, col_snake in self.snake:
+            if (row_snake, col_snake) in compiled.apples:
+                raise ValueError(
+                    f'Змейка не может заспавниться в точке {(row_snake, col_snake)}\n'
+                    f'Ибо в этой точке спавнится яблоко'
+                )
         self.apples = apples
-        for r_index, row in enumerate(filter(None, sample)):
-            self.field.append([])
-            for c_index, cell in enumerate(
-                    filter(lambda char: char != ' ', row)
-            ):
-                if cell == Cell.apple:
-                    # исключаем случай когда пытаемся
-                    # вставить змейку в ячейку с яблоком
-                    for row_snake, col_snake in self.snake:
-                        if (r_index, c_index) == (row_snake, col_snake):
-                            raise ValueError(
-                                f'Змейка не может заспавниться в точке {(row_snake, col_snake)}\n'
-                                f'Ибо в этой точке спавнится яблоко'
-                            )
-                    self.field[r_index].append(
-                        Cell(content=Cell.default)
-                    )
-                else:
-                    self.field[r_index].append(
-                        Cell(content=cell)
-                    )
+        self.field = compiled.grid.copy()
+        self.x_len, self.y_len = self.field.x_len, self.field.y_len
+        self.paint_snake()
         self.__insert_apple()
         self.apples_points.clear()
 
@@ -229,14 +814,16 @@ class Field:
         # для имитации её движения
         self.snake.grow(self.row_head, self.col_head)
 
-        head_content = self.field[self.row_head][self.col_head].content
+        grid = self.field
+        head_index = self.row_head * self.y_len + self.col_head
+        head_content = grid.cells[head_index]
 
         # если змейка скушала яблоко, то удалять хвост не нужно
-        if head_content == Cell.default:
+        if head_content == Grid.DEFAULT:
             row_del, col_del = self.snake.del_last_point()
             # устанавливает значок поля вместо точки змейки
-            self.field[row_del][col_del].content = Cell.default
-        elif head_content == Cell.apple:
+            grid.set_code(row_del * self.y_len + col_del, Grid.DEFAULT)
+        elif head_content == Grid.APPLE:
             self.apples -= 1
             # условие победы
             # на всякий поставил <=
@@ -248,24 +835,162 @@ class Field:
             else:
                 try:
                     row, col = self.apples_points.popleft()
-                    self.field[row][col].content = Cell.apple
+                    self.field.set(row, col, Cell.apple)
                 except IndexError:
                     pass
-        elif head_content in (Cell.let, Cell.snake):
+        elif head_content in (Grid.LET, Grid.SNAKE):
             # условие поражения
             self.is_gameover = True
             return None
 
-        # вставляем по координатам символ змейки в field
+        # рисуем только новую голову, хвост уже стёрт выше
+        grid.set_code(head_index, Grid.SNAKE)
+
+        if self.debug:
+            self.check_board()
+
+    def start_directions(self) -> tuple:
+        """
+        Направления, в которые змейке можно поехать на первом
+        тике: все, кроме того, что ведёт назад во вторую клетку
+        тела. Тело нарисовано на поле с самого старта, поэтому
+        такой ход сразу кончился бы проигрышем.
+        """
+        directions = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+        if len(self.snake) < 2:
+            return directions
+        row, col = self.snake.points[0]
+        steps = {
+            'UP': ((row - 1) % self.x_len, col),
+            'DOWN': ((row + 1) % self.x_len, col),
+            'LEFT': (row, (col - 1) % self.y_len),
+            'RIGHT': (row, (col + 1) % self.y_len),
+        }
+        neck = self.snake.points[1]
+        return tuple(
+            direction for direction in directions
+            if steps[direction] != neck
+        )
+
+    def paint_snake(self) -> None:
+        """Рисует на поле всё тело змейки целиком"""
         for row, col in self.snake:
-            self.field[row][col].content = Cell.snake
+            self.field.set_code(row * self.y_len + col, Grid.SNAKE)
+
+    def check_board(self) -> None:
+        """
+        Отладочная проверка: каждая точка змейки
+        должна быть нарисована на поле, а лишних
+        клеток змейки на поле быть не должно.
+        """
+        cells = self.field.cells
+        for row, col in self.snake:
+            if cells[row * self.y_len + col] != Grid.SNAKE:
+                raise RuntimeError(
+                    f'Точка змейки {(row, col)} не нарисована на поле'
+                )
+        painted = cells.count(Grid.SNAKE)
+        if painted != len(set(self.snake)):
+            raise RuntimeError(
+                f'На поле {painted} клеток змейки, '
+                f'а у змейки {len(set(self.snake))} точек'
+            )
 
     def __insert_apple(self) -> None:
-        """Вставляет одно яблоко в поле field"""
+        """
+        Вставляет одно яблоко в поле field.
+        Если свободных клеток нет, то змейка заняла
+        всё поле и это считается победой.
+        """
         if self.apples > 0:
-            row, col = self.__generate_apple_point()
+            point = self.__generate_apple_point()
+            if point is None:
+                self.is_win = True
+                return None
+            row, col = point
             self.apples_points.append((row, col))
-            self.field[row][col].content = Cell.apple
+            self.field.set(row, col, Cell.apple)
+
+    def snapshot(self) -> 'FieldSnapshot':
+        """Неизменяемый снимок текущего состояния поля"""
+        return FieldSnapshot(self)
+
+
+class FieldSnapshot:
+    """
+    Неизменяемый снимок поля Field, например начальное
+    состояние сессии для повтора.
+
+    Клетки плотного поля лежат одной строкой bytes, змейка
+    и яблоки - кортежами, поэтому снимок стоит одного
+    копирования массива клеток, а не deepcopy всего поля с
+    индексом свободных клеток. Разреженное поле хранится
+    копией SparseGrid, то есть только занятыми клетками, и
+    в плотное не разворачивается. Индекс областей regions
+    от стен не зависит от хода игры, поэтому снимок делит его
+    с полем. Поле Field по снимку собирает build_field,
+    каждый раз новое.
+    """
+    __slots__ = (
+        'x_len', 'y_len', 'board', 'regions', 'snake',
+        'apples', 'apples_points', 'is_win', 'is_gameover',
+    )
+
+    def __init__(self, field: Field):
+        self.x_len = field.x_len
+        self.y_len = field.y_len
+        grid = field.field
+        # bytes клеток или копия разреженного поля
+        self.board = grid.copy() if grid.sparse else bytes(grid.cells)
+        self.regions = grid.regions
+        self.snake = tuple(field.snake)
+        self.apples = field.apples
+        self.apples_points = tuple(field.apples_points)
+        self.is_win = field.is_win
+        self.is_gameover = field.is_gameover
+
+    # снимок не меняется, копировать его незачем
+    def __copy__(self) -> 'FieldSnapshot':
+        return self
+
+    def __deepcopy__(self, memo: dict) -> 'FieldSnapshot':
+        return self
+
+    @property
+    def cells(self):
+        """
+        Коды клеток строка за строкой, как Grid.cells:
+        bytes плотного поля или SparseCells разреженного
+        """
+        if isinstance(self.board, bytes):
+            return self.board
+        return self.board.cells
+
+    def game_status(self) -> str:
+        if self.is_win:
+            return 'win'
+        elif self.is_gameover:
+            return 'gameover'
+        else:
+            return 'game'
+
+    def build_field(self) -> Field:
+        """Новое поле Field в состоянии снимка"""
+        if isinstance(self.board, bytes):
+            grid = Grid.from_cells(
+                self.x_len, self.y_len, self.board, self.regions
+            )
+        else:
+            grid = self.board.copy()
+        field = Field.from_grid(
+            Snake(start_points=list(self.snake)),
+            grid,
+            self.apples,
+            self.apples_points,
+        )
+        field.is_win = self.is_win
+        field.is_gameover = self.is_gameover
+        return field
 
 
 class GameManager:
@@ -274,6 +999,9 @@ class GameManager:
     """
     # всего есть 5 уровней
     ALL_LEVELS = (1, 2, 3, 4, 5)
+    # хоткеи клавиатуры на весь процесс, см. set_keys
+    keys_registered = False
+    keys_target = None
 
     def __init__(
             self,
@@ -281,6 +1009,7 @@ class GameManager:
             field: Field,
             delay: float = 0.2,
             direction: Optional[str] = None,
+            input_depth: int = 3,
     ):
         # на всяки пожарный создадим объект змейки
         self.snake = snake
@@ -297,77 +1026,274 @@ class GameManager:
         }
 
         if not direction:
-            # рандомно дёргаем начальное направление змейки
-            self.direction = choice(tuple(self.keys_directs.values()))
+            # рандомно дёргаем начальное направление змейки,
+            # но не назад в собственное тело
+            self.direction = choice(self.field.start_directions())
         else:
             self.direction = direction
 
-        # регаем кнопки
-        self.set_keys()
-
         # задержка перехода между ячейками
         self.delay = delay
 
-        # для сохранения сессии
+        # нажатия из потока клавиатуры, не больше
+        # одного поворота за тик
+        self.inputs = InputQueue(depth=input_depth)
+
+        # для сохранения сессии, поле - снимок начального
+        # состояния, см. FieldSnapshot
+        self.start_session()
+
+        # название папки с логами
+        self.logs_dir = 'logs'
+
+        # хуки тиков и счётчики, статистика последней сессии
+        self.hooks = Hooks()
+        self.counters = None
+        self.tick_stats = None
+        self.render_stats = None
+        self.input_stats = None
+        self.profile = None
+
+    def start_session(self) -> None:
+        """
+        Начинает сессию для logs() с текущего состояния поля.
+        play() и play_async() вызывают её сами перед первым
+        тиком и записывают в сессию ходы (add_move) и новые
+        яблоки.
+        """
         self.session = {
-            'field': deepcopy(self.field),
-            'delay': deepcopy(self.delay),
+            'field': self.field.snapshot(),
+            'delay': self.delay,
             'iter_key': [],
             'apples_points': deque([]),
         }
+        # яблоки поля до старта сессии уже есть в снимке
+        self.session_apples = len(self.field.apples_points)
 
-        # название папки с логами
-        self.logs_dir = 'logs'
+    def add_move(self, direction: str) -> None:
+        """
+        Ход в сессию. Ходы лежат сериями [направление, ходов],
+        поэтому память сессии растёт с числом поворотов, а не
+        с длиной игры
+        """
+        runs = self.session['iter_key']
+        if runs and runs[-1][0] == direction:
+            runs[-1][1] += 1
+        else:
+            runs.append([direction, 1])
+
+    def finish_session(self) -> None:
+        """Переносит в сессию яблоки, появившиеся за игру"""
+        apples = self.field.apples_points
+        self.session['apples_points'].extend(
+            apples[index]
+            for index in range(self.session_apples, len(apples))
+        )
+        self.session_apples = len(apples)
 
     def set_keys(self) -> None:
-        """Регает кнопки управления"""
+        """
+        Регает кнопки управления. keyboard импортируется
+        только здесь: ему нужен root на Linux, и он запускает
+        свои потоки, а без живой игры он не нужен. Хоткеи
+        регаются один раз на процесс, нажатия идут в очередь
+        игры, которая последней вызвала set_keys.
+        """
+        GameManager.keys_target = self.inputs
+        if GameManager.keys_registered:
+            return None
+
+        import keyboard
+
         for keys, direction in self.keys_directs.items():
-            event = partial(self.__set_direction, direction)
+            event = partial(GameManager.push_key, direction)
             for key in keys:
                 keyboard.add_hotkey(key, event)
+        GameManager.keys_registered = True
+
+    @staticmethod
+    def push_key(direction: str) -> None:
+        """Нажатие с клавиатуры в очередь текущей игры"""
+        inputs = GameManager.keys_target
+        if inputs is not None:
+            inputs.push(direction)
 
     def __set_direction(self, direction: str) -> None:
         """
         Меняет направление движения змейки.
         Возможно будет перенесён в класс Snake
         """
-
-        horizontal = ('UP', 'DOWN')
-        vertical = ('LEFT', 'RIGHT')
-
-        if self.direction in horizontal and direction in vertical \
-           or self.direction in vertical and direction in horizontal:
+        if is_turn(self.direction, direction):
             self.direction = direction
 
-    def play(self, save_logs: bool = True) -> None:
+    def play(
+            self,
+            save_logs: bool = True,
+            renderer: Optional[TerminalRenderer] = None,
+            controller: Optional[Callable[[Field, str], str]] = None,
+            profile: bool = False,
+    ) -> None:
         """
         Запускает игровой цикл
         save_logs: bool - сохранять ли логи сессии
+        renderer - куда рисовать поле, по умолчанию в терминал
+        controller - кто ведёт змейку вместо клавиатуры,
+        как в run_headless, например autopilot.autopilot
+        profile - снимать профиль по выборкам, он попадёт
+        в self.profile и в статистику сессии
+        Огромные разреженные поля рисуются окном вокруг головы,
+        а лог для них не пишется: в нём всё поле целиком.
+        Хуки self.hooks, добавленные до старта, вызываются
+        на каждом тике, счётчики идут в self.counters.
+        Со save_logs статистика сессии сохраняется в JSON
+        рядом с логом.
         """
-        self.set_keys()
-        iter_key = 0
-        while self.field.game_status() == 'game':
-            os.system('cls')
-            self.session['iter_key'].append(
-                (iter_key, deepcopy(self.direction))
-            )
-            self.field.move_snake(self.direction)
-            self.field.show()
-            sleep(self.delay)
-            iter_key += 1
+        if self.field.field.sparse:
+            save_logs = False
+        if renderer is None:
+            if self.field.field.sparse:
+                renderer = ViewportRenderer()
+            else:
+                renderer = TerminalRenderer()
+        if controller is None:
+            self.set_keys()
+
+        # лог пишется по ходу игры, а не одним куском в конце
+        writer = None
+        log_path = None
+        if save_logs:
+            from replay import ReplayWriter
+
+            log_path = self.log_path()
+            writer = ReplayWriter(log_path, self.field, self.delay)
+
+        # без хуков цикл не тратит на них ни одного вызова
+        hooks = self.hooks if self.hooks else None
+        counters = self.counters = Counters(self.field, renderer)
+        profiler = None
+        if profile:
+            profiler = SamplingProfiler()
+            profiler.start()
+
+        # тики идут по расписанию от монотонных часов,
+        # время на ход и отрисовку не растягивает тик
+        scheduler = TickScheduler(self.delay)
+        self.tick_stats = TickStats()
+        # нажатия до старта игры не считаются
+        self.inputs.clear()
+        self.start_session()
+        scheduler.start()
+
+        try:
+            while self.field.game_status() == 'game':
+                started = perf_counter()
+                if hooks is not None:
+                    hooks.fire('before_tick', self)
+                    hooks.fire('before_move', self)
+                # нажатия копятся в очереди из потока клавиатуры,
+                # за тик применяется не больше одного поворота
+                if controller is None:
+                    self.direction = self.inputs.next_direction(self.direction)
+                else:
+                    self.__set_direction(
+                        controller(self.field, self.direction)
+                    )
+                direction = self.direction
+                self.field.move_snake(direction)
+                self.add_move(direction)
+                if writer is not None:
+                    writer.record(direction, self.field)
+                if hooks is not None:
+                    hooks.fire('after_move', self)
+                moved = perf_counter()
+
+                if hooks is not None:
+                    hooks.fire('before_render', self)
+                renderer.draw_field(self.field)
+                if hooks is not None:
+                    hooks.fire('after_render', self)
+                rendered = perf_counter()
+
+                if hooks is not None:
+                    hooks.fire('after_tick', self)
+                overshoot = scheduler.wait()
+                waited = perf_counter()
+                self.tick_stats.add(
+                    moved - started, rendered - moved, overshoot
+                )
+                counters.add(moved - started, rendered - moved, waited - rendered)
+        finally:
+            # даже при Ctrl-C лог закрывается с итогом сессии
+            if writer is not None:
+                writer.close(self.field)
+            self.finish_session()
+            counters.finish()
+            if profiler is not None:
+                profiler.stop()
+                self.profile = profiler.summary()
+
+        # сколько стоил вывод кадров за сессию
+        self.render_stats = renderer.stats()
+        # задержка от нажатия до хода
+        self.input_stats = self.inputs.summary()
+        if log_path is not None:
+            self.save_stats(os.path.splitext(log_path)[0] + '.json')
 
         if self.field.game_status() == 'win':
             print('Ты победил!')
         elif self.field.game_status() == 'gameover':
             print('Ты проиграл!')
 
-        self.session['apples_points'] = deepcopy(
-            self.field.apples_points
-        )
+    def stats(self) -> dict:
+        """Статистика последней сессии play для выгрузки в JSON"""
+        return {
+            'counters': self.counters.summary() if self.counters else None,
+            'ticks': self.tick_stats.summary() if self.tick_stats else None,
+            'render': self.render_stats,
+            'input': self.input_stats,
+            'profile': self.profile,
+        }
 
-        if save_logs:
-            # сохраняем логи сессии
-            self.logs()
+    def save_stats(self, path: str) -> None:
+        import json
+
+        with open(path, 'w') as file:
+            json.dump(self.stats(), file, ensure_ascii=False, indent=1)
+
+    def play_async(self, **kwargs):
+        """
+        Корутина игрового цикла на asyncio, см. asyncgame.play_async.
+        Запуск одной игры: asyncio.run(game.play_async())
+        """
+        from asyncgame import play_async
+
+        return play_async(self, **kwargs)
+
+    def run_headless(
+            self,
+            controller: Callable[[Field, str], str],
+            max_ticks: int = 10000,
+    ) -> dict:
+        """
+        Играет без вывода на экран и без задержек.
+        controller(field, direction) на каждом тике
+        возвращает желаемое направление, разворот
+        на 180 градусов игнорируется, как и с клавиатуры.
+        Игра обрывается через max_ticks тиков.
+        """
+        apples = self.field.apples
+        ticks = 0
+        while self.field.game_status() == 'game' and ticks < max_ticks:
+            self.__set_direction(controller(self.field, self.direction))
+            self.field.move_snake(self.direction)
+            ticks += 1
+
+        status = self.field.game_status()
+        return {
+            'outcome': 'timeout' if status == 'game' else status,
+            'ticks': ticks,
+            'apples': apples - self.field.apples,
+        }
 
     def logs(self, filename: Optional[str] = None) -> None:
         """
@@ -379,17 +1305,36 @@ class GameManager:
         Создаётся автоматически по дате и времени
         окончания сессии, но можно указать своё
         значение.
+
+        play() пишет лог сам по ходу игры, этот метод
+        сохраняет словарь session целиком, например после
+        play(save_logs=False). Сессия без ходов не сохраняется:
+        ValueError.
+        """
+        from replay import save_session
+
+        if not self.session['iter_key']:
+            raise ValueError('В сессии нет ни одного хода')
+        save_session(self.session, self.log_path(filename))
+
+    def log_path(self, filename: Optional[str] = None) -> str:
+        """
+        Путь к файлу лога в папке logs_dir.
+        По умолчанию имя - текущие дата и время.
         """
+        from replay import EXTENSION
+
         try:
             os.mkdir(self.logs_dir)
         except FileExistsError:
             pass
 
         if not filename:
+            from datetime import datetime
+
             filename = datetime.now().strftime('%d.%m.%Y %H-%M-%S')
 
-        with open(f'{self.logs_dir}/{filename}.pkl', 'wb') as file:
-            pickle.dump(self.session, file)
+        return f'{self.logs_dir}/{filename}{EXTENSION}'
 
     @staticmethod
     def get_user_index(dir: list) -> str:
@@ -411,12 +1356,25 @@ class GameManager:
                     print('Файла с таким номером не существует!')
                     break
 
-    def show_repeat(self) -> None:
+    def show_repeat(
+            self,
+            speed: Optional[int] = 1,
+            start_tick: int = 0,
+    ) -> None:
         """
         Показывает на экране уже отыгранную сессию.
         Информацию о сессии берёт из папки logs
+        speed - ходов на кадр (1, 2, 8...), None - сразу к концу
+        start_tick - с какого тика смотреть, отрицательный
+        считается от конца сессии (-1 - момент смерти)
         """
-        files = os.listdir(self.logs_dir)
+        from replay import EXTENSION
+
+        # рядом с логами лежит статистика сессий в JSON
+        files = [
+            filename for filename in os.listdir(self.logs_dir)
+            if filename.endswith((EXTENSION, '.pkl'))
+        ]
         if len(files) == 0:
             print('Игровых сессий не найдено.')
             return None
@@ -426,26 +1384,18 @@ class GameManager:
 
         filename = self.get_user_index(dir=files)
 
-        with open(f'{self.logs_dir}/{filename}', 'rb') as file:
-            session = pickle.load(file)
-
-        if session:
-            self.field = session['field']
-            self.field.apples_points = session['apples_points']
-            self.delay = session['delay']
-
-            for _, direction in session['iter_key']:
-                os.system('cls')
-                self.__set_direction(direction)
-                # устанавливаем режим когда яблоки генерить не нужно
-                # тогда move_snake будет их пытаться дёргать из
-                # списка self.apples_points
-                self.field.move_snake(
-                    self.direction,
-                    gen_apple=False,
-                )
-                self.field.show()
-                sleep(self.delay)
+        from replay import ReplayPlayer, read_replay
+
+        replay = read_replay(f'{self.logs_dir}/{filename}')
+        self.delay = replay.delay
+
+        # направления в логе уже проверены, поэтому плеер
+        # ставит их как есть, а яблоки берёт из лога
+        player = ReplayPlayer(replay)
+        player.seek(start_tick)
+        player.play(TerminalRenderer(), speed=speed)
+        self.field = player.field
+        self.snake = self.field.snake
 
     @staticmethod
     def get_game_by_lvl(lvl: int) -> 'GameManager':
@@ -453,8 +1403,9 @@ class GameManager:
         Возвращает объект(лвл) класса GameManager из папки lvls
         по указанному уровню
         """
-        with open(f'lvls/{str(lvl)}.pkl', 'rb') as file:
-            return pickle.load(file)
+        from levels import load_level
+
+        return load_level(lvl)
 
     @classmethod
     def create_lvl(
@@ -467,8 +1418,8 @@ class GameManager:
     ) -> None:
         """
         Метод для создания нового лвла. По заданным
-        харам создаёт объект класса GameManager и
-        добавляет его в папку lvls в формате .pkl
+        харам сохраняет стены, змейку, задержку, направление
+        и кол-во яблок в папку lvls в формате .lvl
         """
         if lvl not in cls.ALL_LEVELS:
             raise ValueError(
@@ -476,19 +1427,13 @@ class GameManager:
                 f'Твой лвл не входит в этот список: {lvl}'
             )
 
-        try:
-            os.mkdir('lvls')
-        except FileExistsError:
-            pass
+        from levels import Level, save_level
 
-        with open(f'lvls/{str(lvl)}.pkl', 'wb') as file:
-            obj_lvl = cls(
-                snake=snake,
-                field=field,
-                delay=delay,
-                direction=direction,
-            )
-            pickle.dump(obj_lvl, file)
+        save_level(lvl, Level.from_field(
+            field=field,
+            delay=delay,
+            direction=direction,
+        ))
 
 
 if __name__ == '__main__':
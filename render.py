@@ -0,0 +1,224 @@
+"""
+Вывод игрового поля в терминал через ANSI escape-последовательности.
+
+Рендерер помнит прошлый кадр и на каждом шаге пишет в терминал
+только изменившиеся клетки одним буфером.
+"""
+import os
+import sys
+from time import perf_counter
+from typing import Optional, TextIO
+
+
+class TerminalRenderer:
+    """
+    Дифференциальный рендерер поля.
+
+    Кадр - это bytes с кодами символов клеток, строка за
+    строкой (ровно так хранит поле Grid). Первый кадр и кадры,
+    где поменялась большая часть поля, рисуются целиком,
+    остальные - точечными перемещениями курсора.
+    """
+    # чистка экрана и курсор в левый верхний угол
+    CLEAR = '\x1b[H\x1b[2J'
+    # если поменялось больше этой доли клеток - рисуем целиком
+    FULL_REDRAW_RATIO = 0.5
+
+    def __init__(
+            self,
+            stream: Optional[TextIO] = None,
+            width: str = 1 * ' ',
+            indent: str = '\t' * 5,
+    ):
+        # куда пишем кадры
+        self.stream = stream if stream is not None else sys.stdout
+        # символ между столбцами
+        self.width = width
+        # отступ поля от левого края
+        self.indent = indent
+        # номер экранного столбца (с 1), где начинается поле
+        self.left = len(indent.expandtabs()) + 1
+        # шаг между клетками по горизонтали
+        self.step = 1 + len(width)
+
+        # прошлый кадр и его размеры
+        self.last_frame = None
+        self.last_shape = None
+
+        # статистика
+        self.frames = 0
+        self.full_frames = 0
+        self.bytes_written = 0
+        self.emit_time = 0.0
+        self.last_bytes = 0
+        self.last_emit_time = 0.0
+
+        # в консоли Windows так включается обработка ANSI
+        if os.name == 'nt':
+            os.system('')
+
+    def reset(self) -> None:
+        """Следующий кадр будет нарисован целиком"""
+        self.last_frame = None
+
+    def capture(self, field) -> tuple:
+        """
+        Снимок кадра поля Field: (кадр, строк, столбцов).
+        Снимок не меняется вместе с полем, поэтому его
+        можно рисовать позже или в другом потоке.
+        """
+        return bytes(field.field.cells), field.x_len, field.y_len
+
+    def draw_field(self, field, full: bool = False) -> int:
+        """Рисует поле Field, возвращает кол-во записанных байт"""
+        return self.draw(*self.capture(field), full=full)
+
+    def draw(
+            self,
+            frame: bytes,
+            rows: int,
+            cols: int,
+            full: bool = False,
+    ) -> int:
+        """
+        Рисует кадр frame размером rows x cols.
+        full - принудительно перерисовать всё поле.
+        Возвращает кол-во записанных байт.
+        """
+        start = perf_counter()
+
+        if full or self.last_frame is None \
+           or self.last_shape != (rows, cols):
+            buffer = self.__full(frame, rows, cols)
+        else:
+            buffer = self.__diff(frame, rows, cols)
+
+        if buffer:
+            # курсор под поле, чтобы сообщения игры шли ниже
+            buffer += f'\x1b[{rows + 1};1H'
+            self.stream.write(buffer)
+            self.stream.flush()
+
+        self.last_frame = frame
+        self.last_shape = (rows, cols)
+
+        self.last_emit_time = perf_counter() - start
+        self.last_bytes = len(buffer)
+        self.emit_time += self.last_emit_time
+        self.bytes_written += self.last_bytes
+        self.frames += 1
+        return self.last_bytes
+
+    def __full(self, frame: bytes, rows: int, cols: int) -> str:
+        self.full_frames += 1
+        lines = []
+        for row in range(rows):
+            line = frame[row * cols:(row + 1) * cols].decode()
+            lines.append(self.indent + self.width.join(line) + self.width)
+        return self.CLEAR + '\n'.join(lines)
+
+    def __diff(self, frame: bytes, rows: int, cols: int) -> str:
+        last = self.last_frame
+        if frame == last:
+            return ''
+
+        changes = []
+        for row in range(rows):
+            start = row * cols
+            stop = start + cols
+            # строки сравниваются целиком на стороне C,
+            # посимвольно идём только по изменившимся
+            if frame[start:stop] == last[start:stop]:
+                continue
+            for index in range(start, stop):
+                if frame[index] != last[index]:
+                    changes.append(index)
+
+        if len(changes) > len(frame) * self.FULL_REDRAW_RATIO:
+            return self.__full(frame, rows, cols)
+
+        parts = []
+        for index in changes:
+            row, col = divmod(index, cols)
+            parts.append(
+                f'\x1b[{row + 1};{self.left + col * self.step}H'
+                f'{chr(frame[index])}'
+            )
+        return ''.join(parts)
+
+    def stats(self) -> dict:
+        """Статистика вывода за всё время работы рендерера"""
+        frames = self.frames or 1
+        return {
+            'frames': self.frames,
+            'full_frames': self.full_frames,
+            'bytes_written': self.bytes_written,
+            'bytes_per_frame': self.bytes_written / frames,
+            'emit_time': self.emit_time,
+            'emit_time_per_frame': self.emit_time / frames,
+        }
+
+
+class ViewportRenderer(TerminalRenderer):
+    """
+    Рендерер окна rows x cols вокруг головы змейки.
+
+    Нужен для огромных полей: стоимость кадра зависит от
+    размера окна, а не поля. Камера стоит на месте, пока
+    голова внутри окна дальше margin клеток от края, и
+    перескакивает так, чтобы голова оказалась в центре,
+    когда голова подходит к краю. Поэтому на большинстве
+    тиков кадр рисуется разницей в пару клеток.
+    """
+
+    def __init__(
+            self,
+            rows: int = 24,
+            cols: int = 48,
+            margin: int = 4,
+            **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.rows = rows
+        self.cols = cols
+        self.margin = margin
+        # левый верхний угол окна на поле
+        self.camera_row = None
+        self.camera_col = None
+
+    def follow(self, field) -> tuple:
+        """
+        Сдвигает камеру за головой змейки.
+        Возвращает размер окна, не больше самого поля.
+        """
+        rows = min(self.rows, field.x_len)
+        cols = min(self.cols, field.y_len)
+        margin_row = min(self.margin, rows // 2)
+        margin_col = min(self.margin, cols // 2)
+
+        if self.camera_row is None:
+            self.camera_row = field.row_head - rows // 2
+            self.camera_col = field.col_head - cols // 2
+
+        # положение головы в окне, поле замкнуто по краям
+        row = (field.row_head - self.camera_row) % field.x_len
+        col = (field.col_head - self.camera_col) % field.y_len
+        if not margin_row <= row < rows - margin_row:
+            self.camera_row = field.row_head - rows // 2
+        if not margin_col <= col < cols - margin_col:
+            self.camera_col = field.col_head - cols // 2
+
+        # поле влезает в окно целиком - камеру не двигаем
+        if rows == field.x_len:
+            self.camera_row = 0
+        if cols == field.y_len:
+            self.camera_col = 0
+        self.camera_row %= field.x_len
+        self.camera_col %= field.y_len
+        return rows, cols
+
+    def capture(self, field) -> tuple:
+        """Снимок окна поля Field вокруг головы змейки"""
+        rows, cols = self.follow(field)
+        frame = field.field.window(self.camera_row, self.camera_col, rows, cols)
+        return frame, rows, cols
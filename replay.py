@@ -0,0 +1,642 @@
+"""
+Бинарный формат повторов игровых сессий (.rpl).
+
+Файл состоит из заголовка и блоков:
+
+    заголовок:
+        b'SNKR', версия (1 байт)
+        x_len, y_len (uint32), delay (float64),
+        яблок осталось (uint32), длина змейки (uint32),
+        точки змейки от головы к хвосту (uint32 индекс клетки),
+        поле по 2 бита на клетку
+    блок:
+        тег (1 байт), длина данных (varint), данные
+
+Блоки:
+    D - направления: серии varint(длина серии << 2 | код направления)
+    A - точки яблок: uint32 индексы клеток подряд
+    E - итог сессии, пишется последним при закрытии файла:
+        тиков (uint32), статус (1 байт), яблок осталось (uint32),
+        длина змейки (uint32), индекс клетки головы (uint32)
+    K - ключевой кадр, состояние после tick ходов:
+        тик (uint32), сколько яблок из блоков A уже вышло (uint32),
+        яблок осталось (uint32), статус (1 байт), длина змейки
+        (uint32), точки змейки (uint32), поле по 2 бита
+
+Блоков D и A может быть сколько угодно, во время игры они
+дописываются небольшими порциями. Индекс клетки - row * y_len + col,
+как в Grid. Неизвестные блоки читатель пропускает, а оборванный
+хвост файла (игра упала или её прервали) дочитывает сколько может.
+"""
+import pickle
+import struct
+from bisect import bisect_right
+from itertools import repeat
+from time import sleep
+from typing import Iterator, Optional
+
+from objects import Cell, Grid, Snake, Field, FieldSnapshot
+
+
+MAGIC = b'SNKR'
+VERSION = 1
+EXTENSION = '.rpl'
+
+# коды направлений в потоке ходов
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+# коды клеток поля по 2 бита
+CELLS = (Cell.default, Cell.apple, Cell.snake, Cell.let)
+# байт Grid -> 2-битный код и обратно: 4 кода -> 4 символа
+PACK_TABLE = bytes(
+    CELLS.index(chr(code)) if chr(code) in CELLS else 0
+    for code in range(256)
+)
+UNPACK_TABLE = [
+    ''.join(CELLS[byte >> shift & 3] for shift in (0, 2, 4, 6)).encode()
+    for byte in range(256)
+]
+
+HEADER = struct.Struct('<4sBIIdII')
+POINT = struct.Struct('<I')
+FOOTER = struct.Struct('<IBIII')
+KEYFRAME = struct.Struct('<IIIBI')
+
+TAG_DIRECTIONS = b'D'
+TAG_APPLES = b'A'
+TAG_END = b'E'
+TAG_KEYFRAME = b'K'
+
+# коды статуса игры в итоге сессии
+STATUSES = ('game', 'win', 'gameover')
+
+
+def write_varint(value: int) -> bytes:
+    result = bytearray()
+    while value > 0x7f:
+        result.append(value & 0x7f | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def read_varint(data: bytes, offset: int) -> tuple:
+    """Возвращает (значение, смещение после него)"""
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise EOFError('Файл повтора обрывается посреди числа')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def pack_cells(cells: bytes) -> bytes:
+    """Упаковывает коды клеток Grid по 4 клетки в байт"""
+    codes = bytes(cells).translate(PACK_TABLE)
+    codes += bytes(-len(codes) % 4)
+    return bytes(
+        a | b << 2 | c << 4 | d << 6
+        for a, b, c, d in zip(codes[::4], codes[1::4], codes[2::4], codes[3::4])
+    )
+
+
+def unpack_cells(packed: bytes, size: int) -> bytearray:
+    """Распаковывает поле обратно в коды клеток Grid"""
+    return bytearray(b''.join(UNPACK_TABLE[byte] for byte in packed)[:size])
+
+
+def encode_directions(directions) -> bytes:
+    """Сжимает поток направлений сериями одинаковых ходов"""
+    result = bytearray()
+    previous, run = None, 0
+    for direction in directions:
+        if direction == previous:
+            run += 1
+            continue
+        if run:
+            result += write_varint(run << 2 | DIRECTION_CODES[previous])
+        previous, run = direction, 1
+    if run:
+        result += write_varint(run << 2 | DIRECTION_CODES[previous])
+    return bytes(result)
+
+
+def block(tag: bytes, payload: bytes) -> bytes:
+    return tag + write_varint(len(payload)) + payload
+
+
+class Replay:
+    """
+    Прочитанный повтор: начальное состояние поля,
+    серии направлений и очередь яблок.
+    """
+
+    def __init__(
+            self,
+            x_len: int,
+            y_len: int,
+            delay: float,
+            apples: int,
+            snake: list,
+            cells: bytearray,
+            runs: list,
+            apples_points: list,
+    ):
+        self.x_len = x_len
+        self.y_len = y_len
+        self.delay = delay
+        # сколько яблок оставалось съесть на старте
+        self.apples = apples
+        # точки змейки от головы к хвосту
+        self.snake = snake
+        # коды клеток начального поля
+        self.cells = cells
+        # серии ходов: (направление, длина серии)
+        self.runs = runs
+        # яблоки в порядке появления
+        self.apples_points = apples_points
+        # итог сессии из блока E, None если файл не закрыт
+        self.footer = None
+        # True, если файл оборван посреди блока
+        self.truncated = False
+        # ключевые кадры по возрастанию тика
+        self.keyframes = []
+
+    @property
+    def ticks(self) -> int:
+        return sum(run for _, run in self.runs)
+
+    def iter_directions(self) -> Iterator[str]:
+        for direction, run in self.runs:
+            for _ in range(run):
+                yield direction
+
+    def build_field(self) -> Field:
+        """Начальное поле сессии, готовое к move_snake(gen_apple=False)"""
+        return Field.from_grid(
+            snake=Snake(start_points=list(self.snake)),
+            grid=Grid.from_cells(self.x_len, self.y_len, self.cells),
+            apples=self.apples,
+            apples_points=self.apples_points,
+        )
+
+
+class ReplayPlayer:
+    """
+    Просмотр повтора с перемоткой.
+
+    Переход на любой тик восстанавливает ближайший предыдущий
+    ключевой кадр и досчитывает от него не больше интервала
+    между кадрами, поэтому время перемотки не зависит от
+    длины сессии.
+    """
+
+    def __init__(self, replay: Replay):
+        self.replay = replay
+        # код направления на каждом тике
+        self.codes = bytearray()
+        for direction, run in replay.runs:
+            self.codes += bytes([DIRECTION_CODES[direction]]) * run
+        self.ticks = len(self.codes)
+        self.keyframe_ticks = [keyframe.tick for keyframe in replay.keyframes]
+
+        # текущее поле и сколько ходов в нём сделано
+        self.field = replay.build_field()
+        self.tick = 0
+
+    def seek(self, tick: int) -> Field:
+        """
+        Перематывает на состояние после tick ходов.
+        Отрицательный tick считается от конца: -1 - кадр смерти.
+        """
+        if tick < 0:
+            tick += self.ticks + 1
+        tick = max(0, min(tick, self.ticks))
+
+        position = bisect_right(self.keyframe_ticks, tick) - 1
+        keyframe_tick = self.keyframe_ticks[position] if position >= 0 else 0
+        # если цель впереди и ближе ключевого кадра,
+        # то досчитываем от текущего состояния
+        if tick < self.tick or keyframe_tick > self.tick:
+            if position >= 0:
+                keyframe = self.replay.keyframes[position]
+                self.field = keyframe.build_field(self.replay)
+                self.tick = keyframe.tick
+            else:
+                self.field = self.replay.build_field()
+                self.tick = 0
+
+        while self.tick < tick:
+            self.step()
+        return self.field
+
+    def seek_death(self, before: int = 0) -> Field:
+        """Перематывает за before ходов до конца сессии"""
+        return self.seek(self.ticks - before)
+
+    def step(self) -> bool:
+        """Один ход вперёд, False если повтор кончился"""
+        if self.tick >= self.ticks:
+            return False
+        self.field.move_snake(
+            DIRECTIONS[self.codes[self.tick]], gen_apple=False
+        )
+        self.tick += 1
+        return True
+
+    def play(self, renderer, speed: Optional[int] = 1) -> None:
+        """
+        Проигрывает повтор с текущего тика до конца.
+        speed - сколько ходов на один кадр: 1, 2, 8 и т.д.,
+        промежуточные кадры не рисуются. None - сразу в конец.
+        Скорость меньше 1 - ValueError.
+        """
+        if speed is not None and speed < 1:
+            raise ValueError(
+                f'Скорость должна быть не меньше 1, а передано {speed}'
+            )
+        if speed is None:
+            self.seek(self.ticks)
+            renderer.draw_field(self.field)
+            return None
+
+        renderer.draw_field(self.field)
+        while self.tick < self.ticks:
+            for _ in range(speed):
+                if not self.step():
+                    break
+            renderer.draw_field(self.field)
+            sleep(self.replay.delay)
+
+
+def dumps(
+        field: Field,
+        delay: float,
+        directions,
+        apples_points,
+) -> bytes:
+    """
+    Кодирует сессию: field - поле на момент старта
+    или его снимок FieldSnapshot, directions - направления по тикам,
+    apples_points - яблоки в порядке появления.
+    """
+    data = bytearray(dump_header(field, delay))
+    data += block(TAG_DIRECTIONS, encode_directions(directions))
+    data += block(TAG_APPLES, b''.join(
+        POINT.pack(row * field.y_len + col) for row, col in apples_points
+    ))
+    return bytes(data)
+
+
+def dump_header(field: Field, delay: float) -> bytes:
+    """Заголовок повтора: размеры, задержка и начальное поле"""
+    y_len = field.y_len
+    snake = list(field.snake)
+    data = bytearray(HEADER.pack(
+        MAGIC, VERSION, field.x_len, y_len, delay, field.apples, len(snake)
+    ))
+    for row, col in snake:
+        data += POINT.pack(row * y_len + col)
+    if isinstance(field, FieldSnapshot):
+        data += pack_cells(field.cells)
+    else:
+        data += pack_cells(field.field.cells)
+    return bytes(data)
+
+
+def dump_keyframe(field: Field, tick: int, apples_used: int) -> bytes:
+    """
+    Блок K: снимок поля после tick ходов.
+    apples_used - сколько яблок из потока уже вышло на поле.
+    """
+    y_len = field.y_len
+    snake = list(field.snake)
+    data = bytearray(KEYFRAME.pack(
+        tick,
+        apples_used,
+        max(field.apples, 0),
+        STATUSES.index(field.game_status()),
+        len(snake),
+    ))
+    for row, col in snake:
+        data += POINT.pack(row * y_len + col)
+    data += pack_cells(field.field.cells)
+    return block(TAG_KEYFRAME, bytes(data))
+
+
+class Keyframe:
+    """Ключевой кадр повтора, поле хранится упакованным"""
+
+    def __init__(
+            self,
+            tick: int,
+            apples_used: int,
+            apples: int,
+            status: str,
+            snake: list,
+            packed: bytes,
+    ):
+        self.tick = tick
+        self.apples_used = apples_used
+        self.apples = apples
+        self.status = status
+        self.snake = snake
+        self.packed = packed
+
+    def build_field(self, replay: 'Replay') -> Field:
+        """Поле в момент кадра с очередью оставшихся яблок"""
+        size = replay.x_len * replay.y_len
+        field = Field.from_grid(
+            snake=Snake(start_points=list(self.snake)),
+            grid=Grid.from_cells(
+                replay.x_len, replay.y_len, unpack_cells(self.packed, size)
+            ),
+            apples=self.apples,
+            apples_points=replay.apples_points[self.apples_used:],
+        )
+        field.is_win = self.status == 'win'
+        field.is_gameover = self.status == 'gameover'
+        return field
+
+
+def load_keyframe(payload: bytes, x_len: int, y_len: int) -> Keyframe:
+    tick, apples_used, apples, status, length = KEYFRAME.unpack_from(payload)
+    offset = KEYFRAME.size
+    snake = []
+    for _ in range(length):
+        (index,) = POINT.unpack_from(payload, offset)
+        snake.append(divmod(index, y_len))
+        offset += POINT.size
+    packed = payload[offset:offset + (x_len * y_len + 3) // 4]
+    return Keyframe(tick, apples_used, apples, STATUSES[status], snake, packed)
+
+
+def dump_footer(field: Field, ticks: int) -> bytes:
+    """Блок E с итогом сессии"""
+    return block(TAG_END, FOOTER.pack(
+        ticks,
+        STATUSES.index(field.game_status()),
+        max(field.apples, 0),
+        len(field.snake),
+        field.row_head * field.y_len + field.col_head,
+    ))
+
+
+def loads(data: bytes) -> Replay:
+    """Читает повтор из байт"""
+    if data[:4] != MAGIC:
+        raise ValueError('Это не файл повтора')
+    if len(data) < HEADER.size:
+        raise ValueError('Файл повтора обрывается в заголовке')
+    magic, version, x_len, y_len, delay, apples, length = \
+        HEADER.unpack_from(data)
+    if version > VERSION:
+        raise ValueError(
+            f'Версия повтора {version} новее поддерживаемой {VERSION}'
+        )
+
+    offset = HEADER.size
+    snake = []
+    for _ in range(length):
+        (index,) = POINT.unpack_from(data, offset)
+        snake.append(divmod(index, y_len))
+        offset += POINT.size
+
+    size = x_len * y_len
+    packed_size = (size + 3) // 4
+    if len(data) < offset + packed_size:
+        raise ValueError('Файл повтора обрывается в заголовке')
+    cells = unpack_cells(data[offset:offset + packed_size], size)
+    offset += packed_size
+
+    replay = Replay(
+        x_len=x_len,
+        y_len=y_len,
+        delay=delay,
+        apples=apples,
+        snake=snake,
+        cells=cells,
+        runs=[],
+        apples_points=[],
+    )
+
+    while offset < len(data):
+        tag = data[offset:offset + 1]
+        try:
+            length, offset = read_varint(data, offset + 1)
+        except EOFError:
+            replay.truncated = True
+            break
+        payload = data[offset:offset + length]
+        offset += length
+        if len(payload) < length:
+            # оборванный блок дочитываем до последней целой записи
+            replay.truncated = True
+
+        if tag == TAG_DIRECTIONS:
+            position = 0
+            while position < len(payload):
+                try:
+                    value, position = read_varint(payload, position)
+                except EOFError:
+                    break
+                replay.runs.append((DIRECTIONS[value & 3], value >> 2))
+        elif tag == TAG_APPLES:
+            whole = len(payload) - len(payload) % POINT.size
+            for (index,) in POINT.iter_unpack(payload[:whole]):
+                replay.apples_points.append(divmod(index, y_len))
+        elif tag == TAG_KEYFRAME and len(payload) == length:
+            replay.keyframes.append(load_keyframe(payload, x_len, y_len))
+        elif tag == TAG_END and len(payload) == FOOTER.size:
+            ticks, status, apples_left, length, head = \
+                FOOTER.unpack(payload)
+            replay.footer = {
+                'ticks': ticks,
+                'status': STATUSES[status],
+                'apples': apples_left,
+                'length': length,
+                'head': divmod(head, y_len),
+            }
+
+    replay.keyframes.sort(key=lambda keyframe: keyframe.tick)
+    return replay
+
+
+class ReplayWriter:
+    """
+    Запись повтора прямо во время игры.
+
+    Заголовок пишется сразу при создании, ходы копятся сериями
+    и каждые chunk_ticks тиков уходят в файл блоком D, новые
+    яблоки - блоком A. Память не растёт с длиной игры, а при
+    падении теряется не больше одной порции. Каждые keyframe_ticks
+    тиков пишется ключевой кадр (блок K), по которым повтор можно
+    перематывать. close() дописывает итог сессии (блок E).
+    """
+
+    def __init__(
+            self,
+            path: str,
+            field: Field,
+            delay: float,
+            chunk_ticks: int = 256,
+            keyframe_ticks: int = 256,
+    ):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.keyframe_ticks = keyframe_ticks
+        self.file = open(path, 'wb')
+        self.file.write(dump_header(field, delay))
+        self.file.flush()
+
+        # всего записано тиков
+        self.ticks = 0
+        # тиков с прошлого сброса в файл
+        self.pending = 0
+        # закрытые серии ходов
+        self.runs = bytearray()
+        # текущая серия
+        self.direction = None
+        self.run = 0
+        # яблоки с прошлого сброса
+        self.apples = bytearray()
+        # всего записано яблок
+        self.apples_total = 0
+        # сколько яблок field.apples_points уже прочитано,
+        # те, что были до старта, есть в начальном поле
+        self.apples_seen = len(field.apples_points)
+        self.y_len = field.y_len
+
+    def __enter__(self) -> 'ReplayWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def record(self, direction: str, field: Field) -> None:
+        """
+        Записывает ход тика и яблоки, появившиеся на нём.
+        Новые яблоки читаются с конца field.apples_points по
+        счётчику, очередь поля при этом не меняется: её читают
+        и другие, например сервер и сессия GameManager.
+        """
+        if direction == self.direction:
+            self.run += 1
+        else:
+            if self.run:
+                self.runs += write_varint(
+                    self.run << 2 | DIRECTION_CODES[self.direction]
+                )
+            self.direction = direction
+            self.run = 1
+
+        apples = field.apples_points
+        while self.apples_seen < len(apples):
+            row, col = apples[self.apples_seen]
+            self.apples_seen += 1
+            self.apples += POINT.pack(row * self.y_len + col)
+            self.apples_total += 1
+
+        self.ticks += 1
+        self.pending += 1
+        if self.ticks % self.keyframe_ticks == 0:
+            self.flush()
+            self.file.write(
+                dump_keyframe(field, self.ticks, self.apples_total)
+            )
+        elif self.pending >= self.chunk_ticks:
+            self.flush()
+
+    def flush(self) -> None:
+        """Сбрасывает накопленные ходы и яблоки в файл"""
+        if self.run:
+            self.runs += write_varint(
+                self.run << 2 | DIRECTION_CODES[self.direction]
+            )
+            # серия продолжится в следующем блоке с нуля
+            self.run = 0
+        data = b''
+        if self.runs:
+            data += block(TAG_DIRECTIONS, bytes(self.runs))
+        if self.apples:
+            data += block(TAG_APPLES, bytes(self.apples))
+        if data:
+            self.file.write(data)
+            self.file.flush()
+        self.runs.clear()
+        self.apples.clear()
+        self.pending = 0
+
+    def close(self, field: Optional[Field] = None) -> None:
+        """Дописывает остаток и итог сессии по полю field"""
+        if self.file.closed:
+            return None
+        self.flush()
+        if field is not None:
+            self.file.write(dump_footer(field, self.ticks))
+        self.file.close()
+
+
+def session_directions(iter_key) -> Iterator[str]:
+    """
+    Направления по тикам из session['iter_key']: серии
+    [направление, ходов], как их пишет GameManager.add_move,
+    или пары (тик, направление) из старых логов .pkl
+    """
+    for first, second in iter_key:
+        if isinstance(first, str):
+            yield from repeat(first, second)
+        else:
+            yield second
+
+
+def save_session(session: dict, path: str) -> None:
+    """Сохраняет словарь сессии GameManager.session в файл повтора"""
+    with open(path, 'wb') as file:
+        file.write(dumps(
+            field=session['field'],
+            delay=session['delay'],
+            directions=session_directions(session['iter_key']),
+            apples_points=session['apples_points'],
+        ))
+
+
+def read_replay(path: str) -> Replay:
+    """Читает повтор из файла .rpl или из старого .pkl"""
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as file:
+            session = pickle.load(file)
+        return loads(dumps(
+            field=session['field'],
+            delay=session['delay'],
+            directions=session_directions(session['iter_key']),
+            apples_points=session['apples_points'],
+        ))
+    with open(path, 'rb') as file:
+        return loads(file.read())
+
+
+def convert_pickle(path: str) -> str:
+    """
+    Переводит старый лог .pkl в формат .rpl рядом с ним.
+    Возвращает путь к новому файлу.
+    """
+    with open(path, 'rb') as file:
+        session = pickle.load(file)
+    new_path = path[:-len('.pkl')] + EXTENSION
+    save_session(session, new_path)
+    return new_path
+
+
+if __name__ == '__main__':
+    # перевод всех старых логов из папки logs
+    import os
+
+    for filename in sorted(os.listdir('logs')):
+        if filename.endswith('.pkl'):
+            print(convert_pickle(os.path.join('logs', filename)))
@@ -0,0 +1,395 @@
+"""
+Сервер на много игр по TCP.
+
+Каждое подключение - отдельная игра со своим полем Field.
+Все игры двигаются одним общим планировщиком тиков: за тик
+сервер по очереди ходит во всех идущих играх и пишет каждому
+клиенту одну строку с изменениями поля.
+
+Протокол строковый, строки в ASCII и кончаются '\\n'.
+
+Клиент -> сервер:
+    UP | DOWN | LEFT | RIGHT   поворот, не больше одного за тик
+    BOARD                      прислать поле целиком
+    NEW                        новая игра после конца старой
+    STATS                      статистика сервера
+    QUIT                       отключиться
+
+Сервер -> клиент:
+    HELLO <id> <x_len> <y_len> <delay>
+    BOARD <тик> <клетки поля строка за строкой одной строкой>
+    S <тик> <статус> <направление> <голова> <хвост> <яблоко> <длина>
+    END <статус>
+    STATS <json>
+    ERR <текст>                текст ошибки по-английски, тоже ASCII:
+                               line too long, game in progress,
+                               unknown command <команда>,
+                               server error
+
+В строке S клетки заданы индексом row * y_len + col, -1 - нет.
+Чтобы получить новое поле из старого, клиент стирает клетку
+хвоста, рисует голову и ставит яблоко, именно в таком порядке.
+
+Запуск: python server.py --port 7777 --delay 0.1
+"""
+import argparse
+import asyncio
+import json
+import sys
+import traceback
+from itertools import count
+from random import choice
+from time import perf_counter
+from typing import Optional
+
+from inputs import InputQueue
+from objects import Cell, Snake, Field
+from timing import TickScheduler, TickStats
+
+
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+
+
+class Session:
+    """Игра одного клиента"""
+
+    def __init__(
+            self,
+            session_id: int,
+            writer: asyncio.StreamWriter,
+            input_depth: int = 3,
+    ):
+        self.id = session_id
+        self.writer = writer
+        self.inputs = InputQueue(depth=input_depth)
+        self.field = None
+        self.direction = None
+        self.tick = 0
+        # сколько яблок field.apples_points уже отправлено
+        self.apples_seen = 0
+
+    def start(self, field: Field, direction: str) -> None:
+        self.field = field
+        self.direction = direction
+        self.tick = 0
+        self.apples_seen = len(field.apples_points)
+        self.inputs.clear()
+
+    @property
+    def playing(self) -> bool:
+        return self.field is not None and self.field.game_status() == 'game'
+
+    def send(self, line: str) -> None:
+        self.writer.write(line.encode() + b'\n')
+
+    def board_line(self) -> str:
+        return f'BOARD {self.tick} {self.field.field.cells.decode()}'
+
+    def advance(self) -> str:
+        """Один ход игры, возвращает строку S для клиента"""
+        field = self.field
+        y_len = field.y_len
+        row_tail, col_tail = field.snake.points[-1]
+        length = len(field.snake)
+
+        direction = self.inputs.next_direction(self.direction)
+        self.direction = direction
+        field.move_snake(direction)
+        self.tick += 1
+
+        head = tail = apple = -1
+        if not field.is_gameover:
+            head = field.row_head * y_len + field.col_head
+            if len(field.snake) == length:
+                tail = row_tail * y_len + col_tail
+        # яблоко за ход ставится не больше одного, очередь
+        # поля не трогаем, а читаем по счётчику
+        apples = field.apples_points
+        while self.apples_seen < len(apples):
+            row, col = apples[self.apples_seen]
+            self.apples_seen += 1
+            apple = row * y_len + col
+
+        return (
+            f'S {self.tick} {field.game_status()} {direction} '
+            f'{head} {tail} {apple} {len(field.snake)}'
+        )
+
+
+class GameServer:
+    """
+    Сервер игр. Поля новых игр строит new_field:
+    по умолчанию пустое поле x_len x y_len со змейкой
+    из двух клеток в центре, едущей влево.
+    """
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            delay: float = 0.1,
+            x_len: int = 16,
+            y_len: int = 16,
+            level: Optional[str] = None,
+            input_depth: int = 3,
+            max_buffer: int = 1 << 16,
+            backlog: int = 4096,
+    ):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.x_len = x_len
+        self.y_len = y_len
+        # путь к файлу уровня .lvl для всех игр
+        self.level = level
+        self.input_depth = input_depth
+        # клиент, у которого столько байт не дошло, отключается
+        self.max_buffer = max_buffer
+        # очередь подключений: при пачке клиентов маленькая
+        # очередь теряет подключения, и клиент ждёт повторов
+        self.backlog = backlog
+
+        self.sessions = {}
+        self.ids = count(1)
+        self.server = None
+        self.ticker = None
+
+        self.scheduler = TickScheduler(delay)
+        # simulate - время хода во всех играх за тик
+        self.tick_stats = TickStats()
+        self.ticks = 0
+        self.lines_sent = 0
+        self.dropped_clients = 0
+
+    def new_field(self) -> tuple:
+        """Поле и начальное направление новой игры"""
+        if self.level is not None:
+            from levels import read_level
+
+            level = read_level(self.level)
+            field = level.build_field()
+            return field, level.direction or choice(field.start_directions())
+        row, col = self.x_len // 2, self.y_len // 2
+        snake = Snake(start_points=[(row, col), (row, col + 1)])
+        return Field(snake=snake, x_len=self.x_len, y_len=self.y_len), 'LEFT'
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port, backlog=self.backlog
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ticker = asyncio.create_task(self.tick_loop())
+
+    async def close(self) -> None:
+        if self.ticker is not None:
+            self.ticker.cancel()
+            await asyncio.gather(self.ticker, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        self.sessions.clear()
+
+    async def tick_loop(self) -> None:
+        self.scheduler.start()
+        while True:
+            started = perf_counter()
+            try:
+                self.step()
+            except Exception:
+                # без тиков все игры встанут: пишем ошибку, отключаем
+                # клиентов и больше не принимаем новых
+                print('Ошибка в тике сервера, игры остановлены:',
+                      file=sys.stderr)
+                traceback.print_exc()
+                self.fail()
+                raise
+            simulated = perf_counter()
+            overshoot = await self.scheduler.wait_async()
+            self.tick_stats.add(simulated - started, 0.0, overshoot)
+
+    def step(self) -> None:
+        """Один тик во всех идущих играх"""
+        self.ticks += 1
+        for session in list(self.sessions.values()):
+            if not session.playing:
+                continue
+            session.send(session.advance())
+            self.lines_sent += 1
+            if not session.playing:
+                session.send(f'END {session.field.game_status()}')
+            transport = session.writer.transport
+            if transport.get_write_buffer_size() > self.max_buffer:
+                # клиент не читает, копить для него кадры не будем
+                self.dropped_clients += 1
+                self.drop(session)
+
+    def fail(self) -> None:
+        """Отключает всех клиентов с ERR, когда тики встали"""
+        if self.server is not None:
+            self.server.close()
+        for session in list(self.sessions.values()):
+            session.send('ERR server error')
+            self.drop(session)
+
+    def drop(self, session: Session) -> None:
+        self.sessions.pop(session.id, None)
+        session.writer.close()
+
+    def stats(self) -> dict:
+        return {
+            'sessions': len(self.sessions),
+            'ticks': self.ticks,
+            'lines_sent': self.lines_sent,
+            'late_ticks': self.scheduler.skipped,
+            'dropped_clients': self.dropped_clients,
+            'tick': self.tick_stats.summary(),
+        }
+
+    async def handle(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+    ) -> None:
+        session = Session(next(self.ids), writer, self.input_depth)
+        session.start(*self.new_field())
+        self.sessions[session.id] = session
+        session.send(
+            f'HELLO {session.id} {session.field.x_len} '
+            f'{session.field.y_len} {self.delay}'
+        )
+        session.send(session.board_line())
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    # строка длиннее лимита StreamReader
+                    session.send('ERR line too long')
+                    break
+                if not line:
+                    break
+                command = line.decode(errors='replace').strip().upper()
+                if command in DIRECTIONS:
+                    session.inputs.push(command)
+                elif command == 'BOARD':
+                    session.send(session.board_line())
+                elif command == 'NEW':
+                    if session.playing:
+                        session.send('ERR game in progress')
+                    else:
+                        session.start(*self.new_field())
+                        session.send(session.board_line())
+                elif command == 'STATS':
+                    session.send(f'STATS {json.dumps(self.stats())}')
+                elif command == 'QUIT':
+                    break
+                elif command:
+                    # команда могла прийти не в ASCII, а ответ - в ASCII
+                    command = command.encode('ascii', 'backslashreplace')
+                    session.send(f'ERR unknown command {command.decode()}')
+        except ConnectionError:
+            pass
+        finally:
+            self.drop(session)
+
+
+def apply_state(cells: bytearray, line: str) -> None:
+    """Применяет строку S к полю клиента"""
+    _, _, _, _, head, tail, apple, _ = line.split()
+    if int(tail) >= 0:
+        cells[int(tail)] = ord(Cell.default)
+    if int(head) >= 0:
+        cells[int(head)] = ord(Cell.snake)
+    if int(apple) >= 0:
+        cells[int(apple)] = ord(Cell.apple)
+
+
+async def run_client(
+        host: str,
+        port: int,
+        ticks: int,
+        turn_every: int = 3,
+) -> dict:
+    """
+    Клиент для тестов и замеров: играет ticks тиков,
+    поворачивая каждые turn_every тиков, и держит своё
+    поле по строкам S. Возвращает поле, сколько тиков
+    получено и задержки от команды до хода с ней.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    turns = ('UP', 'LEFT', 'DOWN', 'RIGHT')
+    result = {'ticks': 0, 'latency': [], 'status': 'game', 'cells': None}
+    # отправленный поворот и когда он отправлен
+    pending = None
+    turn = 0
+    try:
+        while result['ticks'] < ticks:
+            line = (await reader.readline()).decode()
+            if not line:
+                break
+            kind = line.split(' ', 1)[0]
+            if kind == 'BOARD':
+                result['cells'] = bytearray(line.split()[2].encode())
+            elif kind == 'S':
+                apply_state(result['cells'], line)
+                result['ticks'] += 1
+                direction = line.split()[3]
+                if pending is not None and direction == pending[0]:
+                    result['latency'].append(perf_counter() - pending[1])
+                    pending = None
+                if pending is None and result['ticks'] % turn_every == 0:
+                    direction = turns[turn % len(turns)]
+                    turn += 1
+                    pending = (direction, perf_counter())
+                    writer.write(direction.encode() + b'\n')
+            elif kind == 'END':
+                result['status'] = line.split()[1]
+                break
+        writer.write(b'QUIT\n')
+        await writer.drain()
+    finally:
+        writer.close()
+    return result
+
+
+async def request_stats(host: str, port: int) -> dict:
+    """Статистика сервера через отдельное подключение"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(b'STATS\n')
+        while True:
+            line = (await reader.readline()).decode()
+            if not line:
+                raise ConnectionError('Сервер закрыл соединение')
+            if line.startswith('STATS '):
+                return json.loads(line[len('STATS '):])
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--delay', type=float, default=0.1)
+    parser.add_argument('--level', default=None)
+    args = parser.parse_args()
+
+    async def main():
+        server = GameServer(
+            host=args.host, port=args.port, delay=args.delay, level=args.level
+        )
+        await server.start()
+        print(f'Сервер слушает {server.host}:{server.port}', flush=True)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
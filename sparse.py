@@ -0,0 +1,253 @@
+"""
+Огромные поля с разреженным хранением клеток.
+
+Плотный Grid держит байт на каждую клетку, поэтому поле
+100000x100000 в память не влезет. SparseGrid хранит только
+занятые клетки (стены, яблоки и тело змейки) в словарях по
+квадратным тайлам, все остальные клетки считаются пустыми.
+Интерфейс тот же, что у Grid, поэтому Field с ним работает
+без изменений. Рисовать такое поле нужно через
+render.ViewportRenderer, который выводит только окно вокруг
+головы змейки.
+"""
+from random import randint, randrange
+from typing import Iterable, Optional
+
+from objects import Cell, GridRow, Grid, Snake, Field
+
+
+# сторона тайла 2 ** TILE_SHIFT клеток
+TILE_SHIFT = 5
+
+
+def tile_span(start: int, length: int, size: int) -> list:
+    """
+    Номера тайлов, которые покрывает отрезок из length клеток
+    от start на замкнутой оси длиной size
+    """
+    segments = [(start, min(start + length, size))]
+    if start + length > size:
+        segments.append((0, start + length - size))
+    tiles = set()
+    for begin, end in segments:
+        tiles.update(range(begin >> TILE_SHIFT, (end - 1 >> TILE_SHIFT) + 1))
+    return sorted(tiles)
+
+
+class SparseCells:
+    """
+    Коды клеток SparseGrid по индексу row * y_len + col.
+
+    Отдаёт то же, что bytearray Grid.cells при чтении по
+    индексу, но хранит только непустые клетки:
+    tiles[(row >> TILE_SHIFT, col >> TILE_SHIFT)] = {индекс: код}
+    """
+
+    def __init__(self, x_len: int, y_len: int):
+        self.x_len = x_len
+        self.y_len = y_len
+        self.tiles = {}
+        # сколько клеток занято
+        self.occupied = 0
+
+    def tile_key(self, index: int) -> tuple:
+        row, col = divmod(index, self.y_len)
+        return row >> TILE_SHIFT, col >> TILE_SHIFT
+
+    def __len__(self) -> int:
+        return self.x_len * self.y_len
+
+    def __getitem__(self, index: int) -> int:
+        tile = self.tiles.get(self.tile_key(index))
+        if tile is None:
+            return Grid.DEFAULT
+        return tile.get(index, Grid.DEFAULT)
+
+    def __setitem__(self, index: int, code: int) -> None:
+        key = self.tile_key(index)
+        tile = self.tiles.get(key)
+        if code == Grid.DEFAULT:
+            if tile is not None and index in tile:
+                del tile[index]
+                self.occupied -= 1
+                if not tile:
+                    del self.tiles[key]
+            return None
+        if tile is None:
+            tile = self.tiles[key] = {}
+        if index not in tile:
+            self.occupied += 1
+        tile[index] = code
+
+    def count(self, code: int) -> int:
+        if code == Grid.DEFAULT:
+            return len(self) - self.occupied
+        return sum(
+            value == code
+            for tile in self.tiles.values()
+            for value in tile.values()
+        )
+
+    def items(self) -> Iterable:
+        """Пары (индекс, код) всех непустых клеток"""
+        for tile in self.tiles.values():
+            yield from tile.items()
+
+    def __bytes__(self) -> bytes:
+        """Всё поле подряд, как Grid.cells. Только для небольших полей"""
+        cells = bytearray(Cell.default.encode()) * len(self)
+        for index, code in self.items():
+            cells[index] = code
+        return bytes(cells)
+
+
+class SparseFree:
+    """
+    Свободные клетки SparseGrid.
+
+    Отдельного индекса нет: свободна любая клетка, которой
+    нет в тайлах. Случайная клетка выбирается повторными
+    попытками, на почти пустом огромном поле хватает одной.
+    """
+    # после стольких неудачных попыток ищем перебором
+    ATTEMPTS = 64
+
+    def __init__(self, cells: SparseCells):
+        self.cells = cells
+
+    def __len__(self) -> int:
+        return self.cells.count(Grid.DEFAULT)
+
+    def __contains__(self, index: int) -> bool:
+        return self.cells[index] == Grid.DEFAULT
+
+    def add(self, index: int) -> None:
+        pass
+
+    def discard(self, index: int) -> None:
+        pass
+
+    def choice(self) -> int:
+        """Случайная свободная клетка, IndexError если таких нет"""
+        if not len(self):
+            raise IndexError('Свободных клеток не осталось')
+        size = len(self.cells)
+        for _ in range(self.ATTEMPTS):
+            index = randrange(size)
+            if self.cells[index] == Grid.DEFAULT:
+                return index
+        # поле почти заполнено, такое бывает только на маленьких полях
+        free = [
+            index for index in range(size)
+            if self.cells[index] == Grid.DEFAULT
+        ]
+        return free[randrange(len(free))]
+
+
+class SparseGrid:
+    """
+    Разреженное поле с интерфейсом Grid.
+    Память - на занятые клетки, а не на площадь поля.
+    """
+    sparse = True
+    # индекса областей у разреженного поля нет
+    regions = None
+
+    def __init__(self, x_len: int, y_len: int):
+        self.x_len = x_len
+        self.y_len = y_len
+        self.cells = SparseCells(x_len, y_len)
+        self.free = SparseFree(self.cells)
+
+    def index(self, row: int, col: int) -> int:
+        return row * self.y_len + col
+
+    def get(self, row: int, col: int) -> str:
+        return chr(self.cells[row * self.y_len + col])
+
+    def set(self, row: int, col: int, content: str) -> None:
+        self.set_code(row * self.y_len + col, ord(content))
+
+    def set_code(self, index: int, code: int) -> None:
+        self.cells[index] = code
+
+    def copy(self) -> 'SparseGrid':
+        grid = SparseGrid(self.x_len, self.y_len)
+        grid.cells.tiles = {
+            key: dict(tile) for key, tile in self.cells.tiles.items()
+        }
+        grid.cells.occupied = self.cells.occupied
+        return grid
+
+    def window(self, top: int, left: int, rows: int, cols: int) -> bytes:
+        """
+        Кусок поля rows x cols, как Grid.window.
+        Просматриваются только тайлы, попавшие в окно.
+        """
+        frame = bytearray(Cell.default.encode()) * (rows * cols)
+        top %= self.x_len
+        left %= self.y_len
+        tile_rows = tile_span(top, rows, self.x_len)
+        tile_cols = tile_span(left, cols, self.y_len)
+
+        tiles = self.cells.tiles
+        for tile_row in tile_rows:
+            for tile_col in tile_cols:
+                cells = tiles.get((tile_row, tile_col))
+                if not cells:
+                    continue
+                for index, code in cells.items():
+                    row, col = divmod(index, self.y_len)
+                    r_index = (row - top) % self.x_len
+                    c_index = (col - left) % self.y_len
+                    if r_index < rows and c_index < cols:
+                        frame[r_index * cols + c_index] = code
+        return bytes(frame)
+
+    def row_string(self, row: int) -> str:
+        return self.window(row, 0, 1, self.y_len).decode()
+
+    def __len__(self) -> int:
+        return self.x_len
+
+    def __getitem__(self, row: int) -> GridRow:
+        if row < 0:
+            row += self.x_len
+        if not 0 <= row < self.x_len:
+            raise IndexError('Индекс строки за пределами поля')
+        return GridRow(self, row)
+
+    def __iter__(self):
+        for row in range(self.x_len):
+            yield GridRow(self, row)
+
+    def __str__(self) -> str:
+        return ''.join(
+            self.row_string(row) + '\n' for row in range(self.x_len)
+        )
+
+
+def huge_field(
+        snake: Snake,
+        x_len: int,
+        y_len: int,
+        apples: Optional[int] = None,
+        walls: Iterable = (),
+) -> Field:
+    """
+    Поле Field на разреженном SparseGrid с первым яблоком.
+    walls - точки стен, apples - сколько яблок до победы,
+    по умолчанию как в Field.
+    """
+    grid = SparseGrid(x_len, y_len)
+    for row, col in walls:
+        grid.set(row, col, Cell.let)
+    if apples is None:
+        middle = round((x_len + y_len) / 2)
+        apples = randint(round(middle / 2), middle)
+    return Field.from_grid(
+        snake=snake,
+        grid=grid,
+        apples=apples,
+        gen_apple=True,
+    )
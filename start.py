@@ -14,12 +14,15 @@ if status == '1':
         if status == '0':
             break
 elif status == '2':
-    lvls = os.listdir('lvls')
+    lvls = sorted(
+        filename for filename in os.listdir('lvls')
+        if filename.endswith('.lvl')
+    )
     print('Доступные уровни:')
     for index, filename in enumerate(lvls, 1):
         print(f'\t{index}. {filename}')
     filename = GameManager.get_user_index(dir=lvls)
-    lvl, _ = filename.split('.pkl')
+    lvl, _ = filename.split('.lvl')
     lvl = int(lvl)
     game = GameManager.get_game_by_lvl(lvl)
     game.play()
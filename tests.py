@@ -1,6 +1,43 @@
 from objects import *
+from render import TerminalRenderer, ViewportRenderer
+from timing import TickScheduler, TickStats, percentile
+from inputs import InputQueue
+from instrument import EVENTS, Hooks, SamplingProfiler
+import asyncgame
+import bench
+import autopilot
+import hamilton
+import levels
+import server
+import sparse
+import tournament
+import verify
+from replay import (
+    HEADER, ReplayPlayer, ReplayWriter, convert_pickle, dumps, loads, pack_cells, read_replay,
+    unpack_cells,
+)
 
+import asyncio
+import gc
+import io
+from contextlib import redirect_stderr, redirect_stdout
+from copy import deepcopy
+import json
+import random
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from time import perf_counter
+
+try:
+    import numpy
+    from batch import BatchField, DIRECTIONS
+except ImportError:
+    numpy = None
 
 
 class CellTest(unittest.TestCase):
@@ -19,6 +56,189 @@ class CellTest(unittest.TestCase):
         self.assertTrue(self.cell.content == self.cell.default)
 
 
+class GridTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.grid = Grid(x_len=3, y_len=4)
+
+    def test_size(self):
+        """Тест размерности поля Grid"""
+        self.assertTrue(len(self.grid.cells) == 3 * 4)
+        self.assertTrue(len(self.grid) == 3)
+        for row in self.grid:
+            self.assertTrue(len(row) == 4)
+
+    def test_adapter(self):
+        """
+        Тест совместимости с доступом
+        вида field[row][col].content
+        """
+        self.grid[1][2].content = Cell.apple
+        self.assertTrue(self.grid.get(1, 2) == Cell.apple)
+        self.assertTrue(
+            self.grid.cells[self.grid.index(1, 2)] == Grid.APPLE
+        )
+        self.assertTrue(self.grid[1][2].content == Cell.apple)
+        self.assertTrue(self.grid[-1][-1].content == Cell.default)
+        self.assertRaises(IndexError, lambda: self.grid[3])
+        self.assertRaises(IndexError, lambda: self.grid[0][4])
+
+    def test_str(self):
+        """Тест строкового представления Grid"""
+        self.grid.set(0, 0, Cell.let)
+        self.assertTrue(str(self.grid) == '#...\n....\n....\n')
+
+    def test_old_pickle(self):
+        """Тест загрузки поля из старого формата списка Cell"""
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        field = Field(snake=snake)
+        state = dict(field.__dict__)
+        state['field'] = [
+            [Cell(content=cell.content) for cell in row]
+            for row in field.field
+        ]
+        old_field = Field.__new__(Field)
+        old_field.__setstate__(state)
+        self.assertTrue(str(old_field) == str(field))
+
+
+class FreeCellsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.grid = Grid(x_len=4, y_len=4)
+
+    def test_sync(self):
+        """Индекс свободных клеток следует за записями в поле"""
+        self.assertTrue(len(self.grid.free) == 16)
+        self.grid.set(0, 0, Cell.let)
+        self.grid[1][1].content = Cell.apple
+        self.grid.set_code(self.grid.index(2, 2), Grid.SNAKE)
+        self.assertTrue(len(self.grid.free) == 13)
+        self.assertFalse(self.grid.index(1, 1) in self.grid.free)
+        self.grid.set(1, 1, Cell.default)
+        self.assertTrue(self.grid.index(1, 1) in self.grid.free)
+        for index in self.grid.free.items:
+            self.assertTrue(self.grid.cells[index] == Grid.DEFAULT)
+
+    def test_choice(self):
+        """Случайный выбор отдаёт только свободные клетки"""
+        for index in range(15):
+            self.grid.set_code(index, Grid.LET)
+        for _ in range(100):
+            self.assertTrue(self.grid.free.choice() == 15)
+        self.grid.set_code(15, Grid.LET)
+        self.assertRaises(IndexError, self.grid.free.choice)
+
+    def test_from_rows(self):
+        """Индекс собирается по стенам из шаблона"""
+        grid = Grid.from_rows(['#.#', '...'])
+        self.assertTrue(sorted(grid.free.items) == [1, 3, 4, 5])
+
+
+class RegionsTest(unittest.TestCase):
+    # стены в строках 2 и 5 делят поле на две области даже с
+    # переносом через края: строка 0 граничит со стеной 5
+    sample = """
+        . . . . . .
+        . . . . . .
+        # # # # # #
+        . . . . . .
+        . . . . . .
+        # # # # # #
+    """
+
+    def setUp(self) -> None:
+        random.seed(3)
+        self.snake = Snake(start_points=[(0, 1), (0, 2)])
+        self.field = Field(snake=self.snake, x_len=6, y_len=6)
+        self.field.set_field_by_sample(sample=self.sample, apples=5)
+        self.regions = self.field.field.regions
+
+    def test_regions(self):
+        """Области считаются по стенам с переносом через края"""
+        self.assertTrue(len(self.regions) == 2)
+        self.assertTrue(self.regions.sizes == (12, 12))
+        self.assertTrue(self.regions.label(2, 3) == Regions.WALL)
+        self.assertTrue(self.regions.label(0, 0) == self.regions.label(1, 5))
+        self.assertTrue(self.regions.label(0, 0) != self.regions.label(3, 0))
+        self.assertTrue(
+            self.regions.cells(self.regions.label(3, 0))
+            == list(range(18, 30))
+        )
+        # индекс общий для шаблона и всех полей по нему
+        self.assertTrue(compile_sample(self.sample).grid.regions
+                        is self.regions)
+
+    def test_apple_in_head_region(self):
+        """Яблоко ставится только туда, куда змейка может доползти"""
+        head = self.regions.label(0, 1)
+        for _ in range(200):
+            point = self.field._Field__generate_apple_point()
+            self.assertTrue(self.regions.label(*point) == head)
+
+        # область головы забита - ставить некуда
+        for index in self.regions.cells(head):
+            self.field.field.set_code(index, Grid.SNAKE)
+        self.assertTrue(self.field._Field__generate_apple_point() is None)
+
+    def test_free_groups(self):
+        """Свободные клетки разложены по областям и следуют за полем"""
+        grid = self.field.field
+        other = self.regions.label(3, 0)
+        free = grid.free.count(other)
+        grid.set(3, 0, Cell.snake)
+        self.assertTrue(grid.free.count(other) == free - 1)
+        copy = grid.copy()
+        grid.set(3, 0, Cell.default)
+        self.assertTrue(grid.free.count(other) == free)
+        self.assertTrue(copy.free.count(other) == free - 1)
+        for _ in range(100):
+            self.assertTrue(self.regions.labels[grid.free.choice(other)]
+                            == other)
+        # стёртая стена попадает в отдельную группу
+        grid.set(2, 0, Cell.default)
+        self.assertTrue(grid.index(2, 0) in grid.free)
+        self.assertTrue(len(grid.free) == sum(
+            grid.free.count(region) for region in range(len(self.regions))
+        ) + 1)
+
+    def test_split(self):
+        """Индекс держат только поля, которые стены делят на части"""
+        self.assertTrue(Regions.split(Grid(4, 4)) is None)
+        # стена поперёк строки не делит её: концы склеены переносом
+        grid = Grid.from_rows(['.#..', '.#..', '####', '....'])
+        self.assertTrue(Regions.split(grid) is None)
+        regions = Regions.from_grid(grid)
+        self.assertTrue(len(regions) == 1)
+        self.assertTrue(regions.label(0, 0) == regions.label(0, 3))
+        # стена по столбцу делит поле уже на две области
+        grid = Grid.from_rows(['.#.#', '.#.#', '.#.#'])
+        regions = Regions.split(grid)
+        self.assertTrue(regions.sizes == (3, 3))
+        self.assertTrue(regions.cells(1) == [2, 6, 10])
+
+        field = Field(snake=Snake(start_points=[(1, 1), (1, 2)]))
+        field.set_field_by_sample(sample='. . .\n. # .\n. . .', apples=1)
+        self.assertTrue(field.field.regions is None)
+
+    def test_check_level(self):
+        """check_level находит области, куда змейке не попасть"""
+        level = levels.Level.from_field(self.field)
+        problems = levels.check_level(level)
+        self.assertTrue(len(problems) == 1)
+        self.assertTrue('12 клеток' in problems[0])
+        self.assertTrue(level.build_field().field.regions is level.regions)
+        # снимок поля делит с ним индекс, новые поля его получают
+        snapshot = self.field.snapshot()
+        self.assertTrue(snapshot.regions is self.regions)
+        grid = snapshot.build_field().field
+        self.assertTrue(grid.regions is self.regions)
+        self.assertTrue(grid.free.count(self.regions.label(3, 0))
+                        == self.field.field.free.count(
+                            self.regions.label(3, 0)))
+
+        level = levels.Level.from_field(Field(snake=Snake([(1, 1), (1, 2)])))
+        self.assertTrue(levels.check_level(level) == [])
+
+
 class SnakeTest(unittest.TestCase):
     def setUp(self):
         self.start_points = [(1, 1), (1, 2)]
@@ -46,6 +266,30 @@ class SnakeTest(unittest.TestCase):
         self.assertTrue(del_point == self.start_points[-1])
 
 
+    def test_contains(self):
+        """Тест проверки принадлежности точки змейке"""
+        self.assertTrue((1, 1) in self.snake)
+        self.assertFalse((1, 3) in self.snake)
+        self.snake.grow(1, 3)
+        self.assertTrue((1, 3) in self.snake)
+        self.snake.del_last_point()
+        self.assertFalse((1, 2) in self.snake)
+
+    def test_contains_overlap(self):
+        """
+        Тест индекса клеток, когда голова
+        змейки наехала на её же тело
+        """
+        self.snake.grow(1, 2)
+        self.snake.del_last_point()
+        self.assertTrue((1, 2) in self.snake)
+        self.assertTrue(self.snake.occupied[(1, 2)] == 1)
+        self.snake.del_last_point()
+        self.assertTrue((1, 2) in self.snake)
+        self.snake.del_last_point()
+        self.assertFalse((1, 2) in self.snake)
+
+
 class FieldTest(unittest.TestCase):
     def setUp(self) -> None:
         self.start_points = [(1, 1), (2, 1)]
@@ -107,6 +351,31 @@ class FieldTest(unittest.TestCase):
                 (y, x) not in new_snake
             )
 
+    def test_generate_apple_point_2(self):
+        """
+        Тест генерации яблока на поле, где
+        свободной осталась одна клетка
+        """
+        points = [
+            (row, col)
+            for row in range(self.field.x_len)
+            for col in range(self.field.y_len)
+            if (row, col) != (5, 7)
+        ]
+        field = Field(snake=Snake(start_points=points))
+        self.assertTrue(field.field.get(5, 7) == Cell.apple)
+        self.assertTrue(field._Field__generate_apple_point() is None)
+
+    def test_full_board(self):
+        """Змейка на всё поле - это победа, а не зависание"""
+        points = [
+            (row, col)
+            for row in range(self.field.x_len)
+            for col in range(self.field.y_len)
+        ]
+        field = Field(snake=Snake(start_points=points))
+        self.assertTrue(field.game_status() == 'win')
+
     def test_move_snake(self):
         """
         Тест главного метода класса Field
@@ -246,6 +515,51 @@ class FieldTest(unittest.TestCase):
                 self.field.field[row][col].content == '0'
             )
 
+    def test_move_snake_7(self):
+        """
+        Тест главного метода класса Field
+        Поле обновляется только по голове и хвосту,
+        сверяем его с полной перерисовкой змейки
+        """
+        self.field.debug = True
+        # без новых яблок змейка вырастет не больше чем на
+        # клетку и на круге из 20 клеток в себя не врежется
+        directions = ('RIGHT', 'DOWN', 'LEFT', 'UP')
+        for tick in range(200):
+            self.field.move_snake(directions[tick // 5 % 4], gen_apple=False)
+            self.assertTrue(self.field.game_status() == 'game')
+            self.assertTrue(
+                str(self.field).count(Cell.snake) == len(self.field.snake)
+            )
+
+    def test_start_directions(self):
+        """Первый ход не ведёт назад во вторую клетку тела"""
+        self.assertTrue(
+            self.field.start_directions() == ('UP', 'LEFT', 'RIGHT')
+        )
+        # с переносом через край: шея на другой стороне поля
+        snake = Snake(start_points=[(0, 0), (15, 0)])
+        field = Field(snake=snake)
+        self.assertTrue(field.start_directions() == ('DOWN', 'LEFT', 'RIGHT'))
+
+    def test_start_py_game(self):
+        """Игра из start.py не кончается на первом тике"""
+        for seed in range(50):
+            random.seed(seed)
+            snake = Snake(start_points=[(1, 1), (1, 2)])
+            field = Field(snake=snake)
+            game = GameManager(snake=snake, field=field, delay=0.1)
+            self.assertTrue(game.direction != 'RIGHT')
+            field.move_snake(game.direction)
+            self.assertTrue(field.game_status() == 'game')
+
+    def test_check_board(self):
+        """Тест отладочной проверки поля"""
+        self.field.check_board()
+        row, col = self.field.snake.points[0]
+        self.field.field.set(row, col, Cell.default)
+        self.assertRaises(RuntimeError, self.field.check_board)
+
     def test_set_field_by_sample(self):
         lvl_2 = """
             .  .  .  .  .  .  .  .  .  .  .  .  .  .  .  .
@@ -272,13 +586,16 @@ class FieldTest(unittest.TestCase):
 
         sample = list(map(list, lvl_2.split('\n')))
         one_apple = False
-        for old_row, new_row in zip(
+        for r_index, (old_row, new_row) in enumerate(zip(
             self.field.field, filter(None, sample)
-        ):
-            for old_cell, new_cell_content in zip(
+        )):
+            for c_index, (old_cell, new_cell_content) in enumerate(zip(
                 old_row,
                 filter(lambda char: char != ' ', new_row)
-            ):
+            )):
+                # змейка рисуется на поле сразу после загрузки шаблона
+                if (r_index, c_index) in self.field.snake:
+                    new_cell_content = Cell.snake
                 if old_cell.content != new_cell_content and not one_apple:
                     one_apple = True
                 else:
@@ -294,6 +611,18 @@ class FieldTest(unittest.TestCase):
             for cell in filter(lambda char: char != ' ', row):
                 sample[index].append(cell)
 
+        # шаблон разбирается один раз, поле берётся копией
+        info = compile_sample.cache_info()
+        field = Field(snake=Snake(start_points=[(1, 1), (2, 1)]))
+        field.set_field_by_sample(sample=lvl_2, apples=5)
+        self.assertTrue(compile_sample.cache_info().hits == info.hits + 1)
+        self.assertTrue(compile_sample(lvl_2).grid.free.items
+                        is not field.field.free.items)
+        self.assertTrue(
+            bytes(compile_sample(lvl_2).grid.cells).count(Grid.SNAKE) == 0
+        )
+        field.check_board()
+
         sample[2][1] = Cell.apple
         sample = '\n'.join(map(''.join, sample))
         self.assertRaises(
@@ -304,6 +633,403 @@ class FieldTest(unittest.TestCase):
         )
 
 
+class TerminalRendererTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stream = io.StringIO()
+        self.renderer = TerminalRenderer(stream=self.stream, indent='')
+        self.snake = Snake(start_points=[(1, 1), (2, 1)])
+        self.field = Field(snake=self.snake)
+
+    def test_full_frame(self):
+        """Первый кадр рисуется целиком с очисткой экрана"""
+        self.renderer.draw_field(self.field)
+        output = self.stream.getvalue()
+        self.assertTrue(output.startswith(TerminalRenderer.CLEAR))
+        self.assertTrue(
+            self.field.field.row_string(1).replace('', ' ')[1:] in output
+        )
+        self.assertTrue(self.renderer.full_frames == 1)
+
+    def test_diff_frame(self):
+        """Следующие кадры пишут только изменившиеся клетки"""
+        self.renderer.draw_field(self.field)
+        full_bytes = self.renderer.last_bytes
+
+        self.field.field.set(0, 0, Cell.let)
+        self.field.field.set(3, 5, Cell.let)
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.renderer.draw_field(self.field)
+        output = self.stream.getvalue()
+
+        self.assertTrue(self.renderer.last_bytes < full_bytes)
+        self.assertTrue('\x1b[1;1H#' in output)
+        self.assertTrue('\x1b[4;11H#' in output)
+        self.assertFalse(TerminalRenderer.CLEAR in output)
+
+    def test_same_frame(self):
+        """Без изменений в терминал ничего не пишется"""
+        self.renderer.draw_field(self.field)
+        self.assertTrue(self.renderer.draw_field(self.field) == 0)
+
+    def test_full_redraw(self):
+        """Принудительная полная перерисовка"""
+        self.renderer.draw_field(self.field)
+        self.renderer.draw_field(self.field, full=True)
+        self.assertTrue(self.renderer.full_frames == 2)
+        self.renderer.reset()
+        self.renderer.draw_field(self.field)
+        self.assertTrue(self.renderer.full_frames == 3)
+        self.assertTrue(self.renderer.stats()['frames'] == 3)
+
+
+class SparseGridTest(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(11)
+        self.walls = [(0, 5), (7, 7), (19, 2), (10, 22), (3, 3)]
+        self.points = [(4, 20), (4, 21), (4, 22)]
+        self.apples = [(4, 2), (9, 10), (18, 21), (0, 0), (12, 12)]
+
+    def build(self, grid) -> Field:
+        for row, col in self.walls:
+            grid.set(row, col, Cell.let)
+        field = Field.from_grid(
+            snake=Snake(start_points=list(self.points)),
+            grid=grid,
+            apples=10,
+            apples_points=self.apples[1:],
+        )
+        field.field.set(*self.apples[0], Cell.apple)
+        return field
+
+    def test_same_game(self):
+        """Разреженное поле играет так же, как плотное"""
+        dense = self.build(Grid(20, 23))
+        field = self.build(sparse.SparseGrid(20, 23))
+        self.assertTrue(str(field) == str(dense))
+
+        directions = ['RIGHT'] * 7 + ['DOWN'] * 25 + ['LEFT'] * 30
+        for direction in directions:
+            dense.move_snake(direction, gen_apple=False)
+            field.move_snake(direction, gen_apple=False)
+            self.assertTrue(str(field) == str(dense))
+            self.assertTrue(field.game_status() == dense.game_status())
+            if dense.game_status() != 'game':
+                break
+        field.check_board()
+        self.assertTrue(bytes(field.field.cells) == bytes(dense.field.cells))
+        self.assertTrue(len(field.field.free) == len(dense.field.free))
+
+    def test_window(self):
+        """Окно поля с переносом через края"""
+        dense = self.build(Grid(20, 23))
+        field = self.build(sparse.SparseGrid(20, 23))
+        for top, left, rows, cols in (
+                (0, 0, 20, 23), (18, 20, 5, 7), (3, 4, 1, 23),
+                (-1, -1, 3, 3), (19, 0, 20, 5),
+        ):
+            frame = dense.field.window(top, left, rows, cols)
+            self.assertTrue(len(frame) == rows * cols)
+            self.assertTrue(
+                field.field.window(top, left, rows, cols) == frame
+            )
+        # змейка у правого края и яблоко за краем слева
+        self.assertTrue(dense.field.window(3, 21, 2, 5) == b'.....00..A')
+
+    def test_huge_field(self):
+        """Поле 100000x100000 занимает память только под занятые клетки"""
+        snake = Snake(start_points=[(5, 5), (5, 4), (5, 3)])
+        field = sparse.huge_field(
+            snake, 100000, 100000, apples=3, walls=[(5, 9)]
+        )
+        self.assertTrue(field.field.cells.occupied == 5)
+        self.assertTrue(field.field.cells.count(Grid.APPLE) == 1)
+        for _ in range(4):
+            field.move_snake('RIGHT', gen_apple=False)
+        self.assertTrue(field.game_status() == 'gameover')
+
+        snake = Snake(start_points=[(99999, 0)])
+        field = sparse.huge_field(snake, 100000, 100000, apples=3)
+        field.move_snake('DOWN')
+        field.move_snake('LEFT')
+        self.assertTrue((field.row_head, field.col_head) == (0, 99999))
+        self.assertTrue(field.field.cells.occupied == 2)
+
+    def test_snapshot(self):
+        """Снимок разреженного поля не разворачивает его в плотное"""
+        snake = Snake(start_points=[(5, 5), (5, 4), (5, 3)])
+        field = sparse.huge_field(
+            snake, 100000, 100000, apples=3, walls=[(5, 9)]
+        )
+        snapshot = field.snapshot()
+        field.move_snake('UP', gen_apple=False)
+        self.assertTrue(snapshot.cells.occupied == 5)
+        self.assertTrue(snapshot.cells[5 * 100000 + 9] == Grid.LET)
+        self.assertTrue(snapshot.cells[5 * 100000 + 5] == Grid.SNAKE)
+        copy = snapshot.build_field()
+        self.assertTrue(copy.field.sparse)
+        self.assertTrue(list(copy.snake) == [(5, 5), (5, 4), (5, 3)])
+
+    def test_free_choice(self):
+        """Случайная свободная клетка и заполненное поле"""
+        grid = sparse.SparseGrid(3, 3)
+        for index in range(8):
+            grid.set_code(index, Grid.LET)
+        self.assertTrue(len(grid.free) == 1)
+        self.assertTrue(grid.free.choice() == 8)
+        grid.set_code(8, Grid.LET)
+        self.assertRaises(IndexError, grid.free.choice)
+        grid.set_code(4, Grid.DEFAULT)
+        self.assertTrue(grid.free.choice() == 4)
+
+
+class ViewportRendererTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.stream = io.StringIO()
+        self.renderer = ViewportRenderer(
+            rows=10, cols=12, margin=2, stream=self.stream, indent=''
+        )
+        snake = Snake(start_points=[(50, 50), (50, 49)])
+        self.field = sparse.huge_field(snake, 1000, 1000, apples=5)
+
+    def test_follow(self):
+        """Камера держит голову в окне и сдвигается у края"""
+        self.renderer.draw_field(self.field)
+        self.assertTrue(self.renderer.last_shape == (10, 12))
+        self.assertTrue(
+            (self.renderer.camera_row, self.renderer.camera_col) == (45, 44)
+        )
+        cameras = set()
+        for _ in range(30):
+            self.field.move_snake('RIGHT', gen_apple=False)
+            self.renderer.draw_field(self.field)
+            col = self.field.col_head - self.renderer.camera_col
+            self.assertTrue(2 <= col < 10)
+            cameras.add(self.renderer.camera_col)
+        self.assertTrue(self.renderer.camera_row == 45)
+        # камера сдвигается скачками, а не на каждом тике
+        self.assertTrue(1 < len(cameras) < 10)
+        self.assertTrue(self.renderer.full_frames == 1)
+
+    def test_small_field(self):
+        """Поле меньше окна рисуется целиком без сдвигов"""
+        field = Field(snake=Snake(start_points=[(1, 1), (1, 2)]), x_len=6, y_len=8)
+        self.renderer.draw_field(field)
+        self.assertTrue(self.renderer.last_shape == (6, 8))
+        self.assertTrue(self.renderer.last_frame == bytes(field.field.cells))
+
+
+class FakeClock:
+    """Часы для тестов, время идёт только во время сна"""
+
+    def __init__(self):
+        self.now = 0.0
+        # сколько лишнего "спит" каждый вызов sleep
+        self.lag = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds + self.lag
+
+
+class TimingTest(unittest.TestCase):
+    def test_percentile(self):
+        """Тест перцентилей"""
+        values = list(range(1, 101))
+        self.assertTrue(percentile(values, 0) == 1)
+        self.assertTrue(percentile(values, 100) == 100)
+        self.assertAlmostEqual(percentile(values, 50), 50.5)
+        self.assertTrue(percentile([], 50) == 0.0)
+
+    def test_no_drift(self):
+        """
+        Работа внутри тика не сдвигает расписание:
+        тики идут ровно через period от старта
+        """
+        clock = FakeClock()
+        scheduler = TickScheduler(0.1, clock=clock, sleep=clock.sleep)
+        scheduler.start()
+        for tick in range(1, 51):
+            # имитируем ход и отрисовку
+            clock.now += 0.03
+            overshoot = scheduler.wait()
+            self.assertAlmostEqual(overshoot, 0.0)
+            self.assertAlmostEqual(clock.now, tick * 0.1)
+
+    def test_lagging(self):
+        """Сильно отставший цикл сдвигает расписание"""
+        clock = FakeClock()
+        scheduler = TickScheduler(0.1, clock=clock, sleep=clock.sleep)
+        scheduler.start()
+        clock.now += 0.35
+        self.assertAlmostEqual(scheduler.wait(), 0.25)
+        self.assertTrue(scheduler.skipped == 1)
+        self.assertAlmostEqual(scheduler.next_tick, 0.45)
+
+    def test_stats(self):
+        """Тест сводки по фазам тика"""
+        stats = TickStats()
+        for tick in range(100):
+            stats.add(0.001, 0.002, tick / 100000)
+        summary = stats.summary()
+        self.assertTrue(summary['ticks'] == 100)
+        self.assertAlmostEqual(summary['simulate']['p50'], 1.0)
+        self.assertAlmostEqual(summary['render']['p99'], 2.0)
+        self.assertAlmostEqual(summary['overshoot']['max'], 0.99)
+
+
+class InputQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.inputs = InputQueue(depth=3, clock=self.clock)
+
+    def test_one_turn_per_tick(self):
+        """Два нажатия за тик - два поворота на двух тиках"""
+        self.inputs.push('UP')
+        self.inputs.push('LEFT')
+        direction = self.inputs.next_direction('RIGHT')
+        self.assertTrue(direction == 'UP')
+        direction = self.inputs.next_direction(direction)
+        self.assertTrue(direction == 'LEFT')
+        self.assertTrue(self.inputs.next_direction(direction) == 'LEFT')
+
+    def test_reverse(self):
+        """Разворот проверяется по текущему направлению"""
+        self.inputs.push('LEFT')
+        self.inputs.push('UP')
+        self.assertTrue(self.inputs.next_direction('RIGHT') == 'UP')
+        self.assertTrue(self.inputs.rejected == 1)
+        self.assertTrue(len(self.inputs) == 0)
+
+    def test_depth(self):
+        """Лишние нажатия отбрасываются"""
+        for direction in ('UP', 'LEFT', 'DOWN', 'RIGHT'):
+            self.inputs.push(direction)
+        self.assertTrue(len(self.inputs) == 3)
+        self.assertTrue(self.inputs.dropped == 1)
+        self.assertRaises(ValueError, InputQueue, depth=0)
+
+    def test_latency(self):
+        """Задержка от нажатия до хода"""
+        self.inputs.push('UP')
+        self.clock.sleep(0.02)
+        self.inputs.push('LEFT')
+        self.clock.sleep(0.01)
+        direction = self.inputs.next_direction('RIGHT')
+        self.clock.sleep(0.02)
+        self.inputs.next_direction(direction)
+        self.assertAlmostEqual(self.inputs.latency[0], 0.03)
+        self.assertAlmostEqual(self.inputs.latency[1], 0.03)
+        summary = self.inputs.summary()
+        self.assertTrue(summary['applied'] == 2)
+        self.assertAlmostEqual(summary['max'], 30.0)
+
+    def test_threads(self):
+        """Нажатия из нескольких потоков не теряются"""
+        import threading
+
+        inputs = InputQueue(depth=10000)
+        threads = [
+            threading.Thread(
+                target=lambda: [inputs.push('UP') for _ in range(1000)]
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(inputs) == 4000)
+
+    def test_copy(self):
+        """Очередь копируется вместе с игрой"""
+        self.inputs.push('UP')
+        inputs = deepcopy(self.inputs)
+        self.assertTrue(len(inputs) == 0)
+        inputs.push('UP')
+        self.assertTrue(inputs.next_direction('LEFT') == 'UP')
+
+
+@unittest.skipIf(numpy is None, 'нужен numpy')
+class BatchFieldTest(unittest.TestCase):
+    def make_game(self, seed: int) -> tuple:
+        """
+        Поле со стенами, очередью яблок и
+        последовательностью ходов для сида seed
+        """
+        rnd = random.Random(seed)
+        random.seed(seed)
+        snake = Snake(start_points=[(5, 5), (5, 6), (5, 7)])
+        field = Field(snake=snake)
+        for _ in range(10):
+            row, col = rnd.randrange(16), rnd.randrange(16)
+            if (row, col) not in snake:
+                field.field.set(row, col, Cell.let)
+        field.apples_points = deque(
+            (rnd.randrange(16), rnd.randrange(16)) for _ in range(30)
+        )
+
+        direction = 'LEFT'
+        directions = []
+        for _ in range(300):
+            if rnd.random() < 0.3:
+                if direction in ('UP', 'DOWN'):
+                    direction = rnd.choice(('LEFT', 'RIGHT'))
+                else:
+                    direction = rnd.choice(('UP', 'DOWN'))
+            directions.append(direction)
+        return field, directions
+
+    def test_conformance(self):
+        """
+        Пакетный движок повторяет Field.move_snake
+        ход в ход на одних и тех же сидах и ходах
+        """
+        games = [self.make_game(seed) for seed in range(40)]
+        fields = [field for field, _ in games]
+        batch = BatchField.from_fields(fields)
+
+        codes = numpy.array([
+            [DIRECTIONS.index(direction) for direction in directions]
+            for _, directions in games
+        ]).T
+
+        for tick, tick_codes in enumerate(codes):
+            for field, directions in games:
+                if field.game_status() == 'game':
+                    field.move_snake(directions[tick], gen_apple=False)
+            batch.step(tick_codes)
+
+            for game, field in enumerate(fields):
+                self.assertTrue(batch.game_status(game) == field.game_status())
+                self.assertTrue(batch.board_string(game) == str(field))
+                self.assertTrue(
+                    (batch.row_head[game], batch.col_head[game])
+                    == (field.row_head, field.col_head)
+                )
+                self.assertTrue(
+                    batch.snake_points(game) == list(field.snake)
+                )
+                self.assertTrue(batch.apples[game] == field.apples)
+
+    def test_gen_apple(self):
+        """Случайные яблоки ставятся только в свободные клетки"""
+        snake = Snake(start_points=[(0, 2), (0, 1), (0, 0)])
+        field = Field(snake=snake, x_len=2, y_len=4)
+        for col in range(4):
+            field.field.set(1, col, Cell.default)
+        field.field.set(0, 3, Cell.apple)
+        field.apples = 10
+
+        batch = BatchField.from_fields([field], seed=1)
+        batch.step([DIRECTIONS.index('RIGHT')], gen_apple=True)
+        self.assertTrue(batch.length[0] == 4)
+        self.assertTrue((batch.boards[0, 0] == Grid.SNAKE).all())
+        self.assertTrue((batch.boards[0, 1] == Grid.APPLE).sum() == 1)
+
+
 class TestGameManager(unittest.TestCase):
     def setUp(self) -> None:
         # размеры поля сессии
@@ -370,37 +1096,1231 @@ class TestGameManager(unittest.TestCase):
 
         self.assertTrue(os.path.exists(self.game.logs_dir))
         self.assertTrue(
-            f'{os.path.exists(self.game.logs_dir)}/test_logs.pkl'
+            os.path.exists(f'{self.game.logs_dir}/test_logs.rpl')
         )
 
-        with open(f'{self.game.logs_dir}/test_logs.pkl', 'rb') as file:
-            session = pickle.load(file)
+        session = read_replay(f'{self.game.logs_dir}/test_logs.rpl')
 
-        for row_log, row in zip(
-                session['field'].field,
-                self.game.session['field'].field
-        ):
-            for cell_log, cell in zip(row_log, row):
-                self.assertTrue(cell_log.content == cell.content)
+        self.assertTrue(
+            bytes(session.cells)
+            == self.game.session['field'].cells
+        )
 
         self.assertTrue(
-            session['delay'] == self.game.session['delay']
+            session.delay == self.game.session['delay']
         )
 
-        for pack_log, pack in zip(
-            session['iter_key'],
+        for d_log, pack in zip(
+            session.iter_directions(),
             self.game.session['iter_key']
         ):
-            _, d_log = pack_log
             _, d = pack
 
             self.assertTrue(d_log == d)
 
-        os.remove(f'{self.game.logs_dir}/test_logs.pkl')
+        os.remove(f'{self.game.logs_dir}/test_logs.rpl')
 
     def test_create_lvl(self):
         pass
 
+    def test_logs_after_play(self):
+        """После play сессия совпадает с логом, который писался в игре"""
+        self.assertRaises(ValueError, self.game.logs)
+        random.seed(2)
+        game = GameManager.get_game_by_lvl(1)
+        game.delay = 0
+        game.logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, game.logs_dir)
+        game.play(
+            save_logs=True,
+            renderer=TerminalRenderer(stream=io.StringIO(), indent=''),
+            controller=autopilot.Autopilot(),
+        )
+        (written,) = [
+            name for name in os.listdir(game.logs_dir) if name.endswith('.rpl')
+        ]
+        game.logs('session')
+        played = read_replay(os.path.join(game.logs_dir, written))
+        saved = read_replay(game.log_path('session'))
+        self.assertTrue(len(game.session['iter_key']) > 0)
+        self.assertTrue(
+            list(saved.iter_directions()) == list(played.iter_directions())
+        )
+        self.assertTrue(saved.apples_points == played.apples_points)
+        self.assertTrue(len(played.apples_points) > 0)
+        # яблоки поля никто не забирает
+        self.assertTrue(
+            list(game.field.apples_points) == played.apples_points
+        )
+
+    def test_snapshot(self):
+        """Снимок сессии не меняется вместе с полем и собирает его заново"""
+        snapshot = self.game.session['field']
+        cells = bytes(self.game.field.field.cells)
+        snake = list(self.game.field.snake)
+        for direction in ('UP', 'UP', 'LEFT'):
+            self.game.field.move_snake(direction)
+        self.assertTrue(snapshot.cells == cells)
+        self.assertTrue(deepcopy(snapshot) is snapshot)
+        self.assertTrue(pickle.loads(pickle.dumps(snapshot)).cells == cells)
+
+        field = snapshot.build_field()
+        self.assertTrue(bytes(field.field.cells) == cells)
+        self.assertTrue(list(field.snake) == snake)
+        self.assertTrue(field.apples == snapshot.apples)
+        self.assertTrue(len(field.field.free) == cells.count(Grid.DEFAULT))
+        # каждое новое поле - своё
+        field.move_snake('DOWN')
+        self.assertTrue(bytes(snapshot.build_field().field.cells) == cells)
+
+    def test_lazy_imports(self):
+        """Без живой игры keyboard и прочие тяжёлые модули не грузятся"""
+        code = (
+            'import sys, objects\n'
+            'game = objects.GameManager.get_game_by_lvl(1)\n'
+            'game.run_headless(lambda field, direction: direction, 10)\n'
+            f'print(*[name for name in {bench.HEAVY_MODULES!r} '
+            'if name in sys.modules])\n'
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertTrue(output.split() == [])
+
+    def test_set_keys_once(self):
+        """Хоткеи регаются один раз, нажатия идут в последнюю игру"""
+        registered = GameManager.keys_registered
+        # как будто хоткеи уже есть, keyboard не трогаем
+        GameManager.keys_registered = True
+        try:
+            other = GameManager(
+                snake=Snake(start_points=[(1, 1), (1, 2)]),
+                field=Field(snake=Snake(start_points=[(1, 1), (1, 2)])),
+                direction='LEFT',
+            )
+            self.game.set_keys()
+            other.set_keys()
+            GameManager.push_key('UP')
+            self.assertTrue(len(self.game.inputs) == 0)
+            self.assertTrue(other.inputs.next_direction('LEFT') == 'UP')
+        finally:
+            GameManager.keys_registered = registered
+            GameManager.keys_target = None
+
+
+class SlowRenderer(TerminalRenderer):
+    """Рендерер, который долго выводит каждый кадр"""
+
+    def draw(self, frame: bytes, rows: int, cols: int, full: bool = False) -> int:
+        import time
+
+        time.sleep(0.02)
+        return super().draw(frame, rows, cols, full=full)
+
+
+class AsyncGameTest(unittest.TestCase):
+    def make_game(self, delay: float = 0.005) -> GameManager:
+        """Змейка едет вправо на стену, сверху ряд стен"""
+        snake = Snake(start_points=[(5, 5), (5, 4)])
+        field = Field(snake=snake)
+        for col in range(field.y_len):
+            field.field.set(1, col, Cell.let)
+        field.field.set(5, 11, Cell.let)
+        field.apples = 100
+        return GameManager(
+            snake=snake, field=field, delay=delay, direction='RIGHT'
+        )
+
+    def test_inputs(self):
+        """Направления из асинхронного источника и отрисовка"""
+        async def inputs():
+            yield 'UP'
+
+        game = self.make_game()
+        stream = io.StringIO()
+        renderer = TerminalRenderer(stream=stream, indent='')
+        result = asyncio.run(game.play_async(renderer=renderer, inputs=inputs()))
+
+        self.assertTrue(result['outcome'] == 'gameover')
+        self.assertTrue(result['ticks'] == 5)
+        self.assertTrue(game.field.col_head == 6)
+        self.assertTrue(1 <= result['frames'] <= 5)
+        self.assertTrue(renderer.last_frame == bytes(game.field.field.cells))
+        self.assertTrue(game.input_stats['applied'] == 1)
+        self.assertTrue(len(game.tick_stats) == 5)
+
+    def test_play_many(self):
+        """Игры на одном цикле событий идут одновременно"""
+        games = [self.make_game(delay=0.02) for _ in range(20)]
+
+        async def no_input():
+            return
+            yield
+
+        start = perf_counter()
+        results = asyncio.run(asyncgame.play_many(
+            games, inputs_list=[no_input() for _ in games]
+        ))
+        elapsed = perf_counter() - start
+        self.assertTrue(len(results) == 20)
+        for result in results:
+            self.assertTrue(result['outcome'] == 'gameover')
+            self.assertTrue(result['ticks'] == 6)
+        # 20 игр по 6 тиков, по очереди это было бы 2.4 секунды
+        self.assertTrue(elapsed < 1)
+
+    def test_max_ticks(self):
+        """Игра обрывается по лимиту тиков"""
+        async def turns():
+            for direction in ('UP', 'LEFT'):
+                yield direction
+
+        game = self.make_game()
+        game.direction = 'DOWN'
+        result = asyncio.run(game.play_async(inputs=turns(), max_ticks=3))
+        self.assertTrue(result['outcome'] == 'timeout')
+        self.assertTrue(result['ticks'] == 3)
+        self.assertTrue(game.field.game_status() == 'game')
+
+    def test_hooks_counters(self):
+        """Хуки и счётчики работают и в асинхронной игре"""
+        async def no_input():
+            return
+            yield
+
+        game = self.make_game()
+        events = []
+        for event in EVENTS:
+            game.hooks.add(
+                event, lambda game, name=event: events.append(name)
+            )
+        renderer = TerminalRenderer(stream=io.StringIO(), indent='')
+        result = asyncio.run(
+            game.play_async(renderer=renderer, inputs=no_input())
+        )
+        tick = ['before_tick', 'before_move', 'after_move', 'after_tick']
+        self.assertTrue(
+            [event for event in events if event in tick] == tick * 6
+        )
+        # кадр рисуется не на каждом тике, зато целиком
+        self.assertTrue(
+            events.count('before_render') == events.count('after_render')
+            == result['frames']
+        )
+        summary = game.counters.summary()
+        self.assertTrue(summary['ticks'] == 6)
+        self.assertTrue(summary['frames'] == result['frames'])
+        self.assertTrue(summary['render_bytes'] == renderer.bytes_written)
+        self.assertTrue(summary['render']['seconds'] > 0)
+        self.assertTrue(summary['sleep']['seconds'] > 0)
+
+    def test_slow_render(self):
+        """Медленная отрисовка пропускает кадры, а не тики"""
+        async def no_input():
+            return
+            yield
+
+        game = self.make_game(delay=0.005)
+        renderer = SlowRenderer(stream=io.StringIO(), indent='')
+        result = asyncio.run(game.play_async(
+            renderer=renderer, inputs=no_input(), render_thread=True
+        ))
+        self.assertTrue(result['ticks'] == 6)
+        self.assertTrue(result['frames'] < result['ticks'])
+        self.assertTrue(result['skipped_frames'] > 0)
+        self.assertTrue(renderer.last_frame == bytes(game.field.field.cells))
+
+
+class WallServer(server.GameServer):
+    """Сервер, где змейка на четвёртом ходу врезается в стену"""
+
+    def new_field(self) -> tuple:
+        field, direction = super().new_field()
+        field.field.set(8, 4, Cell.let)
+        return field, direction
+
+
+class ServerTest(unittest.TestCase):
+    async def read(self, reader, kind: str, cells=None) -> str:
+        """Читает строки до строки вида kind, применяя строки S"""
+        while True:
+            line = (await reader.readline()).decode()
+            self.assertTrue(line)
+            if line.startswith('S ') and cells is not None:
+                server.apply_state(cells, line)
+            if line.startswith(kind + ' '):
+                return line
+
+    def test_level_direction(self):
+        """Случайное направление уровня не ведёт змейку в себя"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, '1.lvl')
+        snake = Snake(start_points=[(1, 1), (1, 2)])
+        level = levels.Level.from_field(Field(snake=snake))
+        with open(path, 'wb') as file:
+            file.write(levels.dumps(level))
+
+        game_server = server.GameServer(level=path)
+        for seed in range(50):
+            random.seed(seed)
+            field, direction = game_server.new_field()
+            self.assertTrue(direction != 'RIGHT')
+            field.move_snake(direction)
+            self.assertTrue(field.game_status() == 'game')
+
+    def test_clients(self):
+        """Клиенты получают все тики и собирают по ним поле"""
+        async def main():
+            game_server = server.GameServer(delay=0.005)
+            await game_server.start()
+            try:
+                results = await asyncio.gather(*(
+                    server.run_client('127.0.0.1', game_server.port, ticks=40)
+                    for _ in range(5)
+                ))
+                stats = await server.request_stats(
+                    '127.0.0.1', game_server.port
+                )
+            finally:
+                await game_server.close()
+            return results, stats
+
+        results, stats = asyncio.run(main())
+        for result in results:
+            self.assertTrue(result['ticks'] == 40 or result['status'] != 'game')
+            self.assertTrue(result['latency'])
+            self.assertTrue(bytes(result['cells']).count(Grid.SNAKE) >= 2)
+        self.assertTrue(stats['ticks'] >= 40)
+        self.assertTrue(stats['tick']['ticks'] > 0)
+
+    def test_board_sync(self):
+        """Поле по строкам S совпадает с полем на сервере"""
+        async def main():
+            game_server = server.GameServer(delay=0.002)
+            await game_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', game_server.port
+                )
+                hello = await self.read(reader, 'HELLO')
+                self.assertTrue(hello.split()[2:4] == ['16', '16'])
+                cells = bytearray(
+                    (await self.read(reader, 'BOARD')).split()[2].encode()
+                )
+                for direction in ('UP', 'RIGHT', 'DOWN', 'RIGHT') * 5:
+                    writer.write(direction.encode() + b'\n')
+                    for _ in range(4):
+                        await self.read(reader, 'S', cells)
+                writer.write(b'BOARD\n')
+                board = await self.read(reader, 'BOARD', cells)
+                self.assertTrue(board.split()[2].encode() == bytes(cells))
+                writer.write(b'JUMP\n')
+                self.assertTrue((await self.read(reader, 'ERR', cells)))
+                writer.close()
+            finally:
+                await game_server.close()
+
+        asyncio.run(main())
+
+    def test_ascii_errors(self):
+        """Ответы ERR - в ASCII, даже на команду не в ASCII"""
+        async def main():
+            game_server = server.GameServer(delay=0.002)
+            await game_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', game_server.port
+                )
+                writer.write('ВВЕРХ\n'.encode())
+                line = await self.read(reader, 'ERR')
+                writer.close()
+            finally:
+                await game_server.close()
+            return line
+
+        line = asyncio.run(main())
+        self.assertTrue(line.isascii())
+        self.assertTrue(line.startswith('ERR unknown command '))
+
+    def test_tick_error(self):
+        """Ошибка в тике пишется в stderr, клиенты отключаются с ERR"""
+        class BrokenServer(server.GameServer):
+            def step(self) -> None:
+                if self.sessions:
+                    raise RuntimeError('сломалось')
+
+        async def main():
+            game_server = BrokenServer(delay=0.002)
+            await game_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', game_server.port
+                )
+                line = await self.read(reader, 'ERR')
+                self.assertTrue(await reader.read() == b'')
+                writer.close()
+                with self.assertRaises(RuntimeError):
+                    await game_server.ticker
+            finally:
+                await game_server.close()
+            return line
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            line = asyncio.run(main())
+        self.assertTrue(line == 'ERR server error\n')
+        self.assertTrue('RuntimeError: сломалось' in stderr.getvalue())
+
+    def test_long_line(self):
+        """Слишком длинная строка - ERR и отключение, а не падение"""
+        async def main():
+            game_server = server.GameServer(delay=0.002)
+            await game_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', game_server.port
+                )
+                await self.read(reader, 'BOARD')
+                writer.write(b'X' * (1 << 17) + b'\n')
+                self.assertTrue('too long' in await self.read(reader, 'ERR'))
+                # сервер закрывает соединение, с непрочитанным
+                # остатком строки - сбросом
+                try:
+                    while await reader.read(1 << 16):
+                        pass
+                except ConnectionResetError:
+                    pass
+                self.assertTrue(not game_server.sessions)
+                writer.close()
+            finally:
+                await game_server.close()
+
+        asyncio.run(main())
+
+    def test_new_game(self):
+        """После конца игры клиент начинает новую"""
+        async def main():
+            game_server = WallServer(delay=0.002)
+            await game_server.start()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', game_server.port
+                )
+                self.assertTrue(
+                    (await self.read(reader, 'END')).split()[1] == 'gameover'
+                )
+                self.assertTrue(len(game_server.sessions) == 1)
+                writer.write(b'NEW\n')
+                board = await self.read(reader, 'BOARD')
+                self.assertTrue(board.split()[1] == '0')
+                await self.read(reader, 'S')
+                writer.write(b'QUIT\n')
+                await reader.read()
+                self.assertTrue(not game_server.sessions)
+            finally:
+                await game_server.close()
+
+        asyncio.run(main())
+
+
+class LevelsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(5)
+        self.snake = Snake(start_points=[(3, 2), (3, 3), (3, 4)])
+        self.field = Field(snake=self.snake, x_len=6, y_len=7)
+        for row in range(6):
+            self.field.field.set(row, 0, Cell.let)
+        self.field.field.set(5, 6, Cell.let)
+        self.level = levels.Level.from_field(
+            field=self.field, delay=0.15, direction='LEFT'
+        )
+
+    def test_dumps_loads(self):
+        """Уровень сохраняется и читается без потерь"""
+        data = levels.dumps(self.level)
+        self.assertTrue(
+            len(data) == levels.HEADER.size + 4 * 3 + (6 * 7 + 7) // 8
+        )
+        level = levels.loads(data)
+        self.assertTrue((level.x_len, level.y_len) == (6, 7))
+        self.assertTrue(level.walls == self.level.walls)
+        self.assertTrue(level.snake == ((3, 2), (3, 3), (3, 4)))
+        self.assertTrue(level.delay == 0.15)
+        self.assertTrue(level.direction == 'LEFT')
+        self.assertTrue(level.apples == self.field.apples)
+
+        self.level.direction = None
+        self.assertTrue(levels.loads(levels.dumps(self.level)).direction is None)
+
+    def test_build_field(self):
+        """Поле уровня: стены, змейка и одно яблоко"""
+        field = levels.loads(levels.dumps(self.level)).build_field()
+        cells = bytes(field.field.cells)
+        self.assertTrue(cells.count(Grid.LET) == 7)
+        self.assertTrue(cells.count(Grid.SNAKE) == 3)
+        self.assertTrue(cells.count(Grid.APPLE) == 1)
+        self.assertTrue(field.field.get(5, 6) == Cell.let)
+        self.assertTrue(list(field.snake) == [(3, 2), (3, 3), (3, 4)])
+        self.assertTrue(not field.apples_points)
+        self.assertTrue(field.game_status() == 'game')
+        # каждое поле - новое, змейка уровня не меняется
+        field.move_snake('LEFT', gen_apple=False)
+        self.assertTrue(self.level.snake == ((3, 2), (3, 3), (3, 4)))
+
+    def test_read_level_cache(self):
+        """Файл уровня перечитывается только после изменения"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, '1.lvl')
+        with open(path, 'wb') as file:
+            file.write(levels.dumps(self.level))
+
+        hits = levels.compile_level.cache_info().hits
+        level = levels.read_level(path)
+        self.assertTrue(levels.read_level(path) is level)
+        self.assertTrue(levels.compile_level.cache_info().hits == hits + 1)
+
+        # поля игр копируются с поля уровня и не влияют на него
+        field = level.build_field()
+        field.move_snake('LEFT', gen_apple=False)
+        self.assertTrue(bytes(level.grid.cells).count(Grid.SNAKE) == 0)
+        self.assertTrue(level.build_field().field.cells
+                        != field.field.cells)
+
+        self.level.direction = 'UP'
+        with open(path, 'wb') as file:
+            file.write(levels.dumps(self.level))
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(levels.read_level(path).direction == 'UP')
+
+    def test_broken(self):
+        """Чужой или обрезанный файл не читается"""
+        data = levels.dumps(self.level)
+        with self.assertRaises(ValueError):
+            levels.loads(data[:-1])
+        with self.assertRaises(ValueError):
+            levels.loads(b'SNKR' + data[4:])
+
+    def test_campaign(self):
+        """Все уровни кампании загружаются"""
+        for lvl in GameManager.ALL_LEVELS:
+            game = GameManager.get_game_by_lvl(lvl)
+            self.assertTrue(game.field.game_status() == 'game')
+            self.assertTrue(
+                bytes(game.field.field.cells).count(Grid.APPLE) == 1
+            )
+            head = game.snake.points[0]
+            self.assertTrue(game.field.field.get(*head) == Cell.snake)
+
+    def test_convert_pickle(self):
+        """Старый уровень .pkl переводится в .lvl"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        game = GameManager(
+            snake=self.snake, field=self.field, delay=0.15, direction='LEFT'
+        )
+        path = os.path.join(directory, '1.pkl')
+        with open(path, 'wb') as file:
+            pickle.dump(game, file)
+
+        level = levels.read_level(levels.convert_pickle(path))
+        self.assertTrue(level.walls == self.level.walls)
+        self.assertTrue(level.snake == self.level.snake)
+        self.assertTrue(level.direction == 'LEFT')
+        self.assertTrue(level.apples == self.field.apples)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(3)
+        self.snake = Snake(start_points=[(5, 5), (5, 6)])
+        self.field = Field(snake=self.snake)
+        self.field.field.set(8, 2, Cell.let)
+        self.start = deepcopy(self.field)
+
+        directions = ['LEFT'] * 20 + ['DOWN'] * 7 + ['RIGHT'] * 30
+        self.directions = []
+        for direction in directions:
+            if self.field.game_status() != 'game':
+                break
+            self.directions.append(direction)
+            self.field.move_snake(direction)
+
+    def test_pack_cells(self):
+        """Поле пакуется по 2 бита на клетку и обратно"""
+        cells = self.start.field.cells
+        packed = pack_cells(cells)
+        self.assertTrue(len(packed) == 16 * 16 // 4)
+        self.assertTrue(unpack_cells(packed, len(cells)) == cells)
+        self.assertTrue(unpack_cells(pack_cells(b'#A0..'), 5) == b'#A0..')
+
+    def test_run_length(self):
+        """Одинаковые направления подряд сжимаются в серии"""
+        replay = loads(dumps(
+            self.start, 0.2, self.directions, self.field.apples_points
+        ))
+        self.assertTrue(list(replay.iter_directions()) == self.directions)
+        self.assertTrue(len(replay.runs) <= 3)
+        self.assertTrue(replay.ticks == len(self.directions))
+
+    def test_replay(self):
+        """Повтор приводит к тому же полю, что и игра"""
+        replay = loads(dumps(
+            self.start, 0.2, self.directions, self.field.apples_points
+        ))
+        field = replay.build_field()
+        for direction in replay.iter_directions():
+            field.move_snake(direction, gen_apple=False)
+        self.assertTrue(str(field) == str(self.field))
+        self.assertTrue(field.game_status() == self.field.game_status())
+
+    def test_convert_pickle(self):
+        """Старый лог .pkl переводится в .rpl"""
+        os.makedirs('logs', exist_ok=True)
+        session = {
+            'field': self.start,
+            'delay': 0.1,
+            'iter_key': list(enumerate(self.directions)),
+            'apples_points': self.field.apples_points,
+        }
+        with open('logs/test_convert.pkl', 'wb') as file:
+            pickle.dump(session, file)
+        path = convert_pickle('logs/test_convert.pkl')
+        replay = read_replay(path)
+        self.assertTrue(path == 'logs/test_convert.rpl')
+        self.assertTrue(replay.delay == 0.1)
+        self.assertTrue(list(replay.iter_directions()) == self.directions)
+        self.assertTrue(
+            replay.apples_points == list(self.field.apples_points)
+        )
+        os.remove('logs/test_convert.pkl')
+        os.remove(path)
+
+
+class ReplayWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs('logs', exist_ok=True)
+        self.path = 'logs/test_writer.rpl'
+        random.seed(5)
+        self.snake = Snake(start_points=[(5, 5), (5, 6)])
+        self.field = Field(snake=self.snake)
+        self.start = deepcopy(self.field)
+
+        self.directions = []
+        with ReplayWriter(self.path, self.field, 0.1, chunk_ticks=7) \
+                as self.writer:
+            turns = ('LEFT', 'DOWN', 'RIGHT', 'DOWN')
+            for tick in range(120):
+                if self.field.game_status() != 'game':
+                    break
+                direction = turns[tick // 4 % 4]
+                self.field.move_snake(direction)
+                self.writer.record(direction, self.field)
+                self.directions.append(direction)
+            self.writer.close(self.field)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_stream(self):
+        """Лог, записанный порциями, читается целиком"""
+        replay = read_replay(self.path)
+        self.assertFalse(replay.truncated)
+        self.assertTrue(list(replay.iter_directions()) == self.directions)
+        self.assertTrue(replay.footer['ticks'] == len(self.directions))
+        self.assertTrue(
+            replay.footer['status'] == self.field.game_status()
+        )
+        self.assertTrue(
+            replay.footer['head']
+            == (self.field.row_head, self.field.col_head)
+        )
+
+        field = replay.build_field()
+        for direction in replay.iter_directions():
+            field.move_snake(direction, gen_apple=False)
+        self.assertTrue(str(field) == str(self.field))
+
+    def test_bounded_memory(self):
+        """Яблоки не копятся в поле, ходы - в записи"""
+        self.assertTrue(len(self.field.apples_points) == 0)
+        self.assertTrue(len(self.writer.runs) == 0)
+
+    def test_truncated(self):
+        """Оборванный файл читается до последней целой записи"""
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        full = loads(data)
+        # заголовок: поля, точки змейки и поле по 2 бита
+        header = HEADER.size + 4 * len(self.start.snake) + 16 * 16 // 4
+        for size in range(header, len(data)):
+            replay = loads(data[:size])
+            self.assertTrue(replay.footer is None)
+            directions = list(replay.iter_directions())
+            self.assertTrue(
+                directions == self.directions[:len(directions)]
+            )
+            self.assertTrue(
+                replay.apples_points
+                == full.apples_points[:len(replay.apples_points)]
+            )
+
+
+class CountingRenderer:
+    """Рендерер для тестов, запоминает нарисованные тики"""
+
+    def __init__(self, player: ReplayPlayer):
+        self.player = player
+        self.ticks = []
+
+    def draw_field(self, field: Field) -> int:
+        self.ticks.append(self.player.tick)
+        return 0
+
+
+class ReplayPlayerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        os.makedirs('logs', exist_ok=True)
+        self.path = 'logs/test_player.rpl'
+        random.seed(7)
+        snake = Snake(start_points=[(5, 5), (5, 6)])
+        field = Field(snake=snake)
+
+        # состояние поля после каждого тика
+        self.states = [str(field)]
+        with ReplayWriter(
+                self.path, field, 0, chunk_ticks=16, keyframe_ticks=10
+        ) as writer:
+            turns = ('LEFT', 'DOWN', 'RIGHT', 'DOWN')
+            for tick in range(95):
+                if field.game_status() != 'game':
+                    break
+                direction = turns[tick // 6 % 4]
+                field.move_snake(direction)
+                writer.record(direction, field)
+                self.states.append(str(field))
+            writer.close(field)
+        self.replay = read_replay(self.path)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_keyframes(self):
+        """Ключевые кадры пишутся каждые keyframe_ticks тиков"""
+        ticks = len(self.states) - 1
+        self.assertTrue(
+            [keyframe.tick for keyframe in self.replay.keyframes]
+            == list(range(10, ticks + 1, 10))
+        )
+
+    def test_seek(self):
+        """Перемотка в любую сторону даёт то же поле, что и игра"""
+        player = ReplayPlayer(self.replay)
+        ticks = list(range(len(self.states)))
+        for tick in ticks + ticks[::-1] + random.sample(ticks, len(ticks)):
+            self.assertTrue(str(player.seek(tick)) == self.states[tick])
+            self.assertTrue(player.tick == tick)
+
+    def test_seek_death(self):
+        """Переход к моменту смерти и отсчёт от конца"""
+        player = ReplayPlayer(self.replay)
+        self.assertTrue(str(player.seek_death()) == self.states[-1])
+        self.assertTrue(str(player.seek(-3)) == self.states[-3])
+        self.assertTrue(str(player.seek_death(5)) == self.states[-6])
+
+    def test_speed(self):
+        """На скорости 8 рисуется каждый восьмой кадр"""
+        player = ReplayPlayer(self.replay)
+        renderer = CountingRenderer(player)
+        player.play(renderer, speed=8)
+        self.assertTrue(renderer.ticks[:3] == [0, 8, 16])
+        self.assertTrue(renderer.ticks[-1] == player.ticks)
+
+        player.seek(0)
+        renderer = CountingRenderer(player)
+        player.play(renderer, speed=None)
+        self.assertTrue(renderer.ticks == [player.ticks])
+
+        for speed in (0, -1):
+            with self.assertRaises(ValueError):
+                player.play(renderer, speed=speed)
+
+
+class VerifyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        random.seed(11)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def write_log(self, name: str, extra: int = 0) -> str:
+        """
+        Пишет лог игры до смерти змейки.
+        extra - сколько лишних ходов дописать после смерти.
+        """
+        path = os.path.join(self.directory, name)
+        snake = Snake(start_points=[(5, 5), (5, 6)])
+        field = Field(snake=snake)
+        field.field.set(5, 0, Cell.let)
+        with ReplayWriter(path, field, 0.1, keyframe_ticks=2) as writer:
+            while field.game_status() == 'game':
+                field.move_snake('LEFT')
+                writer.record('LEFT', field)
+            for _ in range(extra):
+                writer.record('LEFT', field)
+            writer.close(field)
+        return path
+
+    def test_valid(self):
+        """Честный лог проходит проверку"""
+        result = verify.verify_file(self.write_log('ok.rpl'))
+        self.assertTrue(result['divergence'] is None)
+        self.assertTrue(result['status'] == 'gameover')
+        self.assertTrue(result['ticks'] == 5)
+
+    def test_extra_moves(self):
+        """Ходы после конца игры - это расхождение"""
+        result = verify.verify_file(self.write_log('extra.rpl', extra=3))
+        self.assertTrue('тике 5' in result['divergence'])
+
+    def test_corrupted_keyframe(self):
+        """Испорченный ключевой кадр ловится по тику"""
+        path = self.write_log('bad.rpl')
+        with open(path, 'rb') as file:
+            data = bytearray(file.read())
+        # портим последний байт поля в первом ключевом кадре
+        packed = read_replay(path).keyframes[0].packed
+        position = data.index(packed) + len(packed) - 1
+        data[position] ^= 0xff
+        with open(path, 'wb') as file:
+            file.write(data)
+        result = verify.verify_file(path)
+        self.assertTrue('ключевым кадром на тике 2' in result['divergence'])
+
+    def test_verify_dir(self):
+        """Проверка всей папки в пуле процессов"""
+        for index in range(5):
+            self.write_log(f'{index}.rpl')
+        self.write_log('extra.rpl', extra=1)
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as file:
+            file.write('не лог')
+
+        results = list(verify.verify_dir(self.directory, workers=2, window=2))
+        self.assertTrue(len(results) == 6)
+        self.assertTrue(
+            sum(result['divergence'] is not None for result in results) == 1
+        )
+
+
+class TournamentTest(unittest.TestCase):
+    def test_run_headless(self):
+        """Игра уровня без экрана до проигрыша или лимита тиков"""
+        game = GameManager.get_game_by_lvl(2)
+        result = game.run_headless(tournament.keep_direction, max_ticks=50)
+        self.assertTrue(result['outcome'] in ('gameover', 'win', 'timeout'))
+        self.assertTrue(0 < result['ticks'] <= 50)
+        self.assertTrue(result['outcome'] == game.field.game_status()
+                        or result['outcome'] == 'timeout')
+
+    def test_run_tournament(self):
+        """Турнир в пуле процессов и сводная таблица"""
+        results = tournament.run_tournament(
+            levels=(1, 2),
+            seeds=range(3),
+            workers=2,
+            chunksize=2,
+            max_ticks=30,
+        )
+        self.assertTrue(
+            [(result['level'], result['seed']) for result in results]
+            == [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]
+        )
+        table = tournament.summarize(results)
+        self.assertTrue([row['level'] for row in table] == [1, 2])
+        self.assertTrue(all(row['games'] == 3 for row in table))
+
+    def test_seed_repeatable(self):
+        """Итог игры зависит только от сида, а не от процесса"""
+        tournament._levels.clear()
+        first = tournament.play_chunk(autopilot.autopilot, 1, [0, 1], 300)
+        random.seed(12345)
+        tournament._levels.clear()
+        random.random()
+        tournament.get_level(1)
+        second = tournament.play_chunk(autopilot.autopilot, 1, [0, 1], 300)
+        self.assertTrue(first == second)
+
+
+class AutopilotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pilot = autopilot.Autopilot()
+
+    def test_distance_map(self):
+        """Расстояния с переносом через края и в обход стен"""
+        walls = bytearray(Cell.default.encode()) * 25
+        walls[2 * 5 + 1] = Grid.LET
+        distance = autopilot.distance_map(bytes(walls), 5, 5, 2 * 5 + 0)
+        # через левый край к последнему столбцу
+        self.assertTrue(distance[2 * 5 + 4] == 1)
+        # сквозь стену не пройти, в обход через край короче
+        self.assertTrue(distance[2 * 5 + 2] == 3)
+        self.assertTrue(distance[2 * 5 + 1] == autopilot.UNREACHABLE)
+
+    def test_cache(self):
+        """Карта считается заново только когда яблоко переехало"""
+        snake = Snake(start_points=[(5, 5), (5, 6)])
+        field = Field(snake=snake, x_len=10, y_len=10)
+        field.apples = 3
+        self.pilot(field, 'LEFT')
+        self.pilot(field, 'LEFT')
+        info = self.pilot.cache_info()
+        self.assertTrue(info['misses'] == 1 and info['hits'] == 1)
+
+        apple = self.pilot.find_apple(field.field)
+        field.field.set_code(apple, Grid.DEFAULT)
+        field.field.set(0, 0, Cell.apple)
+        self.pilot(field, 'LEFT')
+        self.assertTrue(self.pilot.cache_info()['misses'] == 2)
+
+    def test_walls_changed(self):
+        """После изменения стен карта не берётся из кэша"""
+        grid = Grid.from_rows(['.....', '.###.', '.....'])
+        apple = grid.index(1, 4)
+        before = self.pilot.distances(grid, apple)
+        self.assertTrue(before[grid.index(1, 0)] == 1)
+        self.assertTrue(before[grid.index(1, 2)] == autopilot.UNREACHABLE)
+        # стену стёрли, а потом поставили в другом месте
+        grid.set(1, 2, Cell.default)
+        grid.set(0, 2, Cell.let)
+        after = self.pilot.distances(grid, apple)
+        self.assertTrue(after[grid.index(1, 2)] == 4)
+        self.assertTrue(after[grid.index(0, 2)] == autopilot.UNREACHABLE)
+        self.assertTrue(self.pilot.cache_info()['misses'] == 2)
+
+        # поле закончившейся игры кэш не держит
+        self.assertTrue(len(self.pilot.layouts) == 1)
+        del grid
+        gc.collect()
+        self.assertTrue(len(self.pilot.layouts) == 0)
+
+        with self.assertRaises(ValueError):
+            self.pilot.layout(sparse.SparseGrid(5, 5))
+
+    def test_win(self):
+        """Автопилот съедает все яблоки на пустом поле"""
+        random.seed(0)
+        snake = Snake(start_points=[(5, 5), (5, 6)])
+        field = Field(snake=snake, x_len=10, y_len=10)
+        field.apples = 5
+        game = GameManager(snake, field, delay=0, direction='LEFT')
+        result = game.run_headless(self.pilot, max_ticks=1000)
+        self.assertTrue(result['outcome'] == 'win')
+        self.assertTrue(result['apples'] == 5)
+
+    def test_play(self):
+        """play с контроллером вместо клавиатуры"""
+        random.seed(0)
+        snake = Snake(start_points=[(2, 2), (2, 3)])
+        field = Field(snake=snake, x_len=6, y_len=6)
+        field.apples = 2
+        game = GameManager(snake, field, delay=0, direction='LEFT')
+        renderer = TerminalRenderer(stream=io.StringIO(), indent='')
+        game.play(save_logs=False, renderer=renderer, controller=self.pilot)
+        self.assertTrue(game.field.game_status() == 'win')
+        self.assertTrue(game.input_stats['applied'] == 0)
+
+
+class HamiltonTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.snake = Snake(start_points=[(2, 2), (2, 3), (2, 4)])
+        self.field = Field(snake=self.snake, x_len=6, y_len=6)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def check_cycle(self, grid: Grid, snake: tuple, order: list) -> None:
+        free = [
+            index for index in range(len(grid.cells))
+            if grid.cells[index] != Grid.LET
+        ]
+        self.assertTrue(sorted(order) == free)
+        for index, following in zip(order, order[1:] + order[:1]):
+            self.assertTrue(
+                following in autopilot.neighbours(index, grid.x_len, grid.y_len)
+            )
+        # цикл начинается с тела змейки от хвоста к голове
+        body = [row * grid.y_len + col for row, col in reversed(snake)]
+        self.assertTrue(order[:len(body)] == body)
+
+    def test_find_cycle(self):
+        snake = tuple(self.snake.points)
+        order = hamilton.find_cycle(self.field.field, snake)
+        self.check_cycle(self.field.field, snake, order)
+
+        cycle = hamilton.Cycle(6, 6, order)
+        head = order.index(2 * 6 + 2)
+        self.assertTrue(
+            cycle.position[order[head + 1]] == head + 1
+            and cycle.next_direction(order[head]) in autopilot.DIRECTIONS
+        )
+
+    def test_no_cycle(self):
+        """Уровни, где цикла нет, отсекаются до поиска"""
+        grid = Grid(6, 6)
+        # нечётное число клеток одного цвета
+        grid.set(0, 0, Cell.let)
+        with self.assertRaises(hamilton.NoCycle):
+            hamilton.find_cycle(grid, ((3, 3), (3, 4)))
+
+        # клетка (2, 1) зажата стенами, её оба ребра обязательны,
+        # и вместе с телом змейки в (2, 2) сходятся три ребра
+        grid = Grid(6, 6)
+        for point in ((1, 1), (3, 1), (4, 5), (5, 4)):
+            grid.set(*point, Cell.let)
+        with self.assertRaises(hamilton.NoCycle) as error:
+            hamilton.check_cycle_possible(grid, ((2, 3), (2, 2), (1, 2)))
+        self.assertTrue('(2, 2)' in str(error.exception))
+
+        for lvl in (2, 3, 4):
+            with self.assertRaises(hamilton.NoCycle):
+                hamilton.level_cycle(levels.level_path(lvl))
+        # на уровне 4 цикл мешает только начальное тело змейки
+        level = levels.read_level(levels.level_path(4))
+        order = hamilton.find_cycle(level.grid, level.snake[:1])
+        self.assertTrue(len(order) == 228)
+
+    def test_dumps_loads(self):
+        order = hamilton.find_cycle(self.field.field, tuple(self.snake.points))
+        cycle = hamilton.Cycle(6, 6, order, key=7)
+        data = hamilton.dumps(cycle)
+        loaded = hamilton.loads(data)
+        self.assertTrue(list(loaded.order) == order and loaded.key == 7)
+        self.assertTrue(loaded.moves == cycle.moves)
+        with self.assertRaises(ValueError):
+            hamilton.loads(data[:-1])
+
+    def test_level_cycle(self):
+        """Цикл ищется один раз и дальше читается из файла"""
+        path = os.path.join(self.dir, '1.lvl')
+        shutil.copy(levels.level_path(1), path)
+        cycle = hamilton.level_cycle(path)
+        level = levels.read_level(path)
+        self.check_cycle(level.grid, level.snake, list(cycle.order))
+
+        cycle_path = hamilton.cycle_path(path)
+        self.assertTrue(os.path.exists(cycle_path))
+        mtime = os.stat(cycle_path).st_mtime_ns
+        self.assertTrue(
+            list(hamilton.level_cycle(path).order) == list(cycle.order)
+        )
+        self.assertTrue(os.stat(cycle_path).st_mtime_ns == mtime)
+
+    def test_controller(self):
+        """По циклу змейка выигрывает и без срезок, и со срезками"""
+        order = hamilton.find_cycle(self.field.field, tuple(self.snake.points))
+        cycle = hamilton.Cycle(6, 6, order)
+        ticks = []
+        for shortcuts in (False, True):
+            random.seed(1)
+            game = deepcopy(GameManager(
+                self.snake, self.field, delay=0, direction='LEFT'
+            ))
+            game.field.apples = 12
+            result = game.run_headless(
+                hamilton.CycleController(cycle, shortcuts)
+            )
+            self.assertTrue(result['outcome'] == 'win')
+            ticks.append(result['ticks'])
+        self.assertTrue(ticks[1] <= ticks[0])
+
+
+class BenchTest(unittest.TestCase):
+    def suite(self, rows: list, calibration: float = 100.0) -> dict:
+        return {
+            'calibration_us': {'field': calibration},
+            'results': {'field': rows},
+        }
+
+    def test_compare(self):
+        """Регрессия - только ухудшение больше порога"""
+        baseline = self.suite([
+            {'size': '16x16', 'move_us': 2.0, 'ticks_per_s': 1000},
+            {'size': '64x64', 'move_us': 2.0, 'ticks_per_s': 1000},
+        ])
+        current = self.suite([
+            {'size': '16x16', 'move_us': 3.2, 'ticks_per_s': 1100},
+            {'size': '64x64', 'move_us': 1.0, 'ticks_per_s': 500},
+            {'size': '256x256', 'move_us': 9.0, 'ticks_per_s': 1},
+        ])
+        changes = bench.compare(current, baseline, threshold=0.5)
+        # строки 256x256 в эталоне нет
+        self.assertTrue(len(changes) == 4)
+        regressions = {
+            (change['row'], change['metric'])
+            for change in changes if change['regression']
+        }
+        self.assertTrue(
+            regressions == {('16x16', 'move_us'), ('64x64', 'ticks_per_s')}
+        )
+
+    def test_calibration(self):
+        """Если машина медленнее вдвое, время вдвое больше - не регрессия"""
+        baseline = self.suite([{'size': 16, 'move_us': 2.0}], 100.0)
+        current = self.suite([{'size': 16, 'move_us': 4.0}], 200.0)
+        (change,) = bench.compare(current, baseline, threshold=0.1)
+        self.assertTrue(change['ratio'] == 1.0 and not change['regression'])
+
+    def test_count_metrics(self):
+        """Точный счётчик - регрессия при любом росте, даже с нуля"""
+        baseline = self.suite([{'scenario': 'game', 'heavy_count': 0}], 100.0)
+        current = self.suite([{'scenario': 'game', 'heavy_count': 1}], 50.0)
+        (change,) = bench.compare(current, baseline, threshold=10)
+        self.assertTrue(change['regression'])
+        (change,) = bench.compare(baseline, baseline)
+        self.assertTrue(change['ratio'] == 1.0 and not change['regression'])
+
+    def test_recheck(self):
+        """Всплеск шума снимается перепроверкой, регрессия остаётся"""
+        self.addCleanup(bench.BENCHMARKS.pop, 'fake', None)
+        for runs, regression in (([9.0, 2.0], False), ([9.0, 8.0, 7.0], True)):
+            times = iter(runs)
+            bench.BENCHMARKS['fake'] = lambda: [
+                {'size': 16, 'move_us': next(times)}
+            ]
+            baseline = {'results': {'fake': [{'size': 16, 'move_us': 2.0}]}}
+            suite = bench.run_suite(('fake',))
+            with redirect_stdout(io.StringIO()):
+                (change,) = bench.recheck(
+                    suite, baseline, 0.5, rounds=1, attempts=2
+                )
+            self.assertTrue(change['regression'] == regression)
+            self.assertTrue(change['current'] == min(runs))
+
+    def test_best_of(self):
+        rows = bench.best_of([
+            [{'size': 16, 'move_us': 3.0, 'ticks_per_s': 10, 'bytes': 5}],
+            [{'size': 16, 'move_us': 2.0, 'ticks_per_s': 8, 'bytes': 6}],
+        ])
+        self.assertTrue(
+            rows == [{'size': 16, 'move_us': 2.0, 'ticks_per_s': 10, 'bytes': 5}]
+        )
+
+    def test_run_suite(self):
+        suite = bench.run_suite(('logs',))
+        rows = suite['results']['logs']
+        self.assertTrue(rows and all('logs_ms' in row for row in rows))
+        self.assertTrue(suite['calibration_us']['logs'] > 0)
+        # результаты сохраняются в JSON как есть
+        self.assertTrue(json.loads(json.dumps(suite)) == suite)
+        with self.assertRaises(ValueError):
+            bench.run_suite(('nope',))
+
+
+class InstrumentTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # змейка едет вправо и через 6 тиков врезается в стену
+        snake = Snake(start_points=[(5, 5), (5, 4)])
+        field = Field(snake=snake)
+        field.field.set(5, 11, Cell.let)
+        field.apples = 100
+        self.game = GameManager(
+            snake=snake, field=field, delay=0.002, direction='RIGHT'
+        )
+        self.game.logs_dir = tempfile.mkdtemp()
+        self.renderer = TerminalRenderer(stream=io.StringIO(), indent='')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.game.logs_dir)
+
+    def play(self, **kwargs) -> None:
+        self.game.play(
+            renderer=self.renderer,
+            controller=tournament.keep_direction,
+            **kwargs,
+        )
+
+    def test_hooks(self):
+        """Хуки вызываются по порядку на каждом тике"""
+        events = []
+        for event in EVENTS:
+            self.game.hooks.add(
+                event, lambda game, name=event: events.append(name)
+            )
+        self.play(save_logs=False)
+        order = ['before_tick', 'before_move', 'after_move',
+                 'before_render', 'after_render', 'after_tick']
+        self.assertTrue(events == order * 6)
+        # ходы сессии свёрнуты в серии
+        self.assertTrue(self.game.session['iter_key'] == [['RIGHT', 6]])
+
+        with self.assertRaises(ValueError):
+            self.game.hooks.add('tick', print)
+        self.assertFalse(Hooks())
+
+    def test_counters(self):
+        ticks = []
+        self.game.hooks.add(
+            'after_tick', lambda game: ticks.append(game.counters.ticks)
+        )
+        self.play(save_logs=False)
+        # в хуке после тика счётчик ещё не увеличен
+        self.assertTrue(ticks == [0, 1, 2, 3, 4, 5])
+        summary = self.game.counters.summary()
+        self.assertTrue(summary['ticks'] == 6 and summary['frames'] == 6)
+        self.assertTrue(
+            summary['render_bytes'] == self.renderer.bytes_written
+        )
+        self.assertTrue(summary['ticks_per_second'] > 0)
+        self.assertTrue(
+            all(summary[phase]['seconds'] >= 0 for phase in ('move', 'render'))
+        )
+        # после сессии время стоит, а игру можно скопировать
+        self.assertTrue(self.game.counters.elapsed() == summary['elapsed'])
+        copy = deepcopy(self.game)
+        self.assertTrue(copy.counters.render_bytes == summary['render_bytes'])
+
+    def test_save_stats(self):
+        """Статистика и профиль лежат в JSON рядом с логом"""
+        self.play(save_logs=True, profile=True)
+        names = sorted(os.listdir(self.game.logs_dir))
+        self.assertTrue(len(names) == 2)
+        stem = os.path.splitext(names[1])[0]
+        self.assertTrue(names == [stem + '.json', stem + '.rpl'])
+
+        with open(os.path.join(self.game.logs_dir, names[0])) as file:
+            stats = json.load(file)
+        self.assertTrue(stats['counters']['ticks'] == 6)
+        self.assertTrue(stats['ticks']['ticks'] == 6)
+        self.assertTrue(isinstance(stats['profile'], list))
+
+    def test_profiler(self):
+        def busy():
+            started = perf_counter()
+            while perf_counter() - started < 0.05:
+                pass
+
+        with SamplingProfiler(interval=0.001) as profiler:
+            busy()
+        self.assertTrue(profiler.samples > 0)
+        functions = {row['function'].split()[0]: row for row in profiler.summary()}
+        self.assertTrue(functions['busy']['total'] > 0.5)
+
+        # выборки из отдельного потока, если старт не из профилируемого
+        profiler = SamplingProfiler(interval=0.001)
+        main = threading.get_ident()
+        starter = threading.Thread(target=profiler.start, args=(main,))
+        starter.start()
+        starter.join()
+        self.assertTrue(profiler.thread is not None)
+        busy()
+        profiler.stop()
+        self.assertTrue(profiler.samples > 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,128 @@
+"""
+Планировщик тиков игрового цикла и статистика по времени тиков.
+"""
+from array import array
+from time import perf_counter, sleep
+from typing import Callable
+
+
+def percentile(values, q: float) -> float:
+    """
+    Перцентиль q (от 0 до 100) по списку значений
+    с линейной интерполяцией между соседними точками.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    fraction = position - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+class TickScheduler:
+    """
+    Планировщик тиков с фиксированным шагом.
+
+    Моменты тиков считаются от старта по монотонным часам:
+    start + period, start + 2 * period и т.д., поэтому время
+    на ход и отрисовку не накапливается в периоде тика.
+    Если цикл отстал больше чем на период, то расписание
+    сдвигается, а не догоняется пачкой тиков подряд.
+    """
+
+    def __init__(
+            self,
+            period: float,
+            clock: Callable[[], float] = perf_counter,
+            sleep: Callable[[float], None] = sleep,
+    ):
+        # длительность тика в секундах
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        # момент, когда должен начаться следующий тик
+        self.next_tick = None
+        # сколько раз расписание сдвигалось из-за отставания
+        self.skipped = 0
+
+    def start(self) -> None:
+        self.next_tick = self.clock() + self.period
+
+    def wait(self) -> float:
+        """
+        Спит до начала следующего тика.
+        Возвращает, на сколько секунд проснулись позже
+        запланированного момента.
+        """
+        delay = self.__delay()
+        if delay > 0:
+            self.sleep(delay)
+        return self.__advance()
+
+    async def wait_async(self) -> float:
+        """
+        То же, что wait, но не блокирует цикл событий asyncio:
+        пока этот тик спит, идут другие корутины
+        """
+        import asyncio
+
+        delay = self.__delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.__advance()
+
+    def __delay(self) -> float:
+        """Сколько осталось до следующего тика"""
+        if self.next_tick is None:
+            self.start()
+        return self.next_tick - self.clock()
+
+    def __advance(self) -> float:
+        """Переводит расписание на следующий тик после пробуждения"""
+        woke = self.clock()
+        overshoot = woke - self.next_tick
+        if overshoot > self.period:
+            self.skipped += 1
+            self.next_tick = woke + self.period
+        else:
+            self.next_tick += self.period
+        return overshoot
+
+
+class TickStats:
+    """
+    Время фаз каждого тика: ход змейки, отрисовка
+    и опоздание пробуждения после сна.
+    """
+    PHASES = ('simulate', 'render', 'overshoot')
+
+    def __init__(self):
+        self.simulate = array('d')
+        self.render = array('d')
+        self.overshoot = array('d')
+
+    def __len__(self) -> int:
+        return len(self.simulate)
+
+    def add(self, simulate: float, render: float, overshoot: float) -> None:
+        self.simulate.append(simulate)
+        self.render.append(render)
+        self.overshoot.append(overshoot)
+
+    def summary(self) -> dict:
+        """
+        Сводка по фазам в миллисекундах:
+        p50, p95, p99 и максимум.
+        """
+        result = {'ticks': len(self)}
+        for phase in self.PHASES:
+            values = getattr(self, phase)
+            result[phase] = {
+                'p50': percentile(values, 50) * 1000,
+                'p95': percentile(values, 95) * 1000,
+                'p99': percentile(values, 99) * 1000,
+                'max': max(values, default=0.0) * 1000,
+            }
+        return result
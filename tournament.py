@@ -0,0 +1,141 @@
+"""
+Турнир контроллеров на уровнях кампании.
+
+Контроллер - это функция controller(field, direction) -> direction,
+которая выбирает направление змейки на каждом тике. Игры идут
+без экрана и задержек в пуле процессов. Задачи режутся пачками
+по одному уровню, поэтому процесс читает уровень один раз и
+дальше собирает по нему новое поле на каждую игру уже после
+random.seed(seed): итог пары (уровень, сид) не зависит от того,
+в каком процессе и после каких игр она сыграна.
+
+Запуск: python tournament.py --seeds 100 --workers 4
+"""
+import argparse
+import random
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Callable, Iterable, Optional
+
+from levels import Level, level_path, read_level
+from objects import Field, GameManager
+
+
+# уровни, уже загруженные в этом процессе
+_levels = {}
+
+
+def keep_direction(field: Field, direction: str) -> str:
+    """Контроллер, который никогда не поворачивает"""
+    return direction
+
+
+def get_level(lvl: int) -> Level:
+    """
+    Читает уровень один раз на процесс. Кэшируется сам
+    уровень, а не игра: у игры уже стоит первое яблоко
+    """
+    if lvl not in _levels:
+        _levels[lvl] = read_level(level_path(lvl))
+    return _levels[lvl]
+
+
+def play_chunk(
+        controller: Callable,
+        lvl: int,
+        seeds: list,
+        max_ticks: int,
+) -> list:
+    """Играет по одной игре на каждый сид из seeds на уровне lvl"""
+    level = get_level(lvl)
+    results = []
+    for seed in seeds:
+        random.seed(seed)
+        # первое яблоко и направление - уже от сида
+        game = level.build_game()
+        result = game.run_headless(controller, max_ticks=max_ticks)
+        result.update(level=lvl, seed=seed)
+        results.append(result)
+    return results
+
+
+def run_tournament(
+        controller: Callable = keep_direction,
+        levels: Iterable = GameManager.ALL_LEVELS,
+        seeds: Iterable = range(10),
+        workers: Optional[int] = None,
+        chunksize: int = 16,
+        max_ticks: int = 10000,
+) -> list:
+    """
+    Разыгрывает игры (уровень, сид) в пуле процессов.
+    controller должен быть функцией уровня модуля,
+    чтобы его можно было передать в другой процесс.
+    Возвращает результаты игр в порядке уровней и сидов.
+    """
+    seeds = list(seeds)
+    chunks = [
+        (lvl, seeds[start:start + chunksize])
+        for lvl in levels
+        for start in range(0, len(seeds), chunksize)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(play_chunk, controller, lvl, chunk, max_ticks)
+            for lvl, chunk in chunks
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def summarize(results: list) -> list:
+    """Сводная таблица результатов по уровням"""
+    table = []
+    for lvl in sorted({result['level'] for result in results}):
+        games = [result for result in results if result['level'] == lvl]
+        table.append({
+            'level': lvl,
+            'games': len(games),
+            'wins': sum(game['outcome'] == 'win' for game in games),
+            'gameovers': sum(game['outcome'] == 'gameover' for game in games),
+            'timeouts': sum(game['outcome'] == 'timeout' for game in games),
+            'apples': round(
+                sum(game['apples'] for game in games) / len(games), 2
+            ),
+            'ticks': round(
+                sum(game['ticks'] for game in games) / len(games), 1
+            ),
+        })
+    return table
+
+
+def print_table(table: list) -> None:
+    if not table:
+        return None
+    keys = list(table[0])
+    print(' | '.join(f'{key:>9}' for key in keys))
+    for row in table:
+        print(' | '.join(f'{str(row[key]):>9}' for key in keys))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seeds', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--max-ticks', type=int, default=10000)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    results = run_tournament(
+        seeds=range(args.seeds),
+        workers=args.workers,
+        chunksize=args.chunksize,
+        max_ticks=args.max_ticks,
+    )
+    elapsed = perf_counter() - start
+    print_table(summarize(results))
+    print(f'{len(results)} игр за {elapsed:.2f} с, '
+          f'{len(results) / elapsed:.1f} игр/с')
@@ -0,0 +1,144 @@
+"""
+Пакетная проверка логов сессий без вывода на экран.
+
+Каждый лог из папки заново проигрывается через
+Field.move_snake(gen_apple=False) без отрисовки и задержек.
+Полученное состояние сверяется с ключевыми кадрами и итогом
+сессии, записанными в логе. Расхождение значит, что лог
+записан другой версией move_snake или повреждён.
+
+Запуск: python verify.py [папка] --workers 4
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Iterator, Optional
+
+from replay import EXTENSION, pack_cells, read_replay
+
+
+def verify_file(path: str) -> dict:
+    """
+    Проигрывает один лог и возвращает итог:
+    статус, кол-во тиков и первое расхождение, если есть.
+    """
+    result = {
+        'path': path,
+        'status': None,
+        'ticks': 0,
+        'truncated': False,
+        'divergence': None,
+    }
+    try:
+        replay = read_replay(path)
+    except Exception as error:
+        result['divergence'] = f'не читается: {error}'
+        return result
+
+    result['truncated'] = replay.truncated
+    field = replay.build_field()
+    keyframes = iter(replay.keyframes)
+    keyframe = next(keyframes, None)
+
+    ticks = 0
+    for direction in replay.iter_directions():
+        if field.game_status() != 'game':
+            result['divergence'] = (
+                f'игра кончилась на тике {ticks}, '
+                f'а в логе есть ходы дальше'
+            )
+            break
+        field.move_snake(direction, gen_apple=False)
+        ticks += 1
+
+        while keyframe is not None and keyframe.tick <= ticks:
+            if keyframe.tick == ticks and (
+                    pack_cells(field.field.cells) != keyframe.packed
+                    or list(field.snake) != keyframe.snake
+            ):
+                result['divergence'] = (
+                    f'поле не совпало с ключевым кадром на тике {ticks}'
+                )
+            keyframe = next(keyframes, None)
+        if result['divergence']:
+            break
+
+    result['status'] = field.game_status()
+    result['ticks'] = ticks
+    if result['divergence']:
+        return result
+
+    footer = replay.footer
+    if footer is not None:
+        expected = {
+            'ticks': footer['ticks'],
+            'status': footer['status'],
+            'length': footer['length'],
+            'head': footer['head'],
+        }
+        actual = {
+            'ticks': ticks,
+            'status': field.game_status(),
+            'length': len(field.snake),
+            'head': (field.row_head, field.col_head),
+        }
+        for key in expected:
+            if expected[key] != actual[key]:
+                result['divergence'] = (
+                    f'{key}: в логе {expected[key]}, '
+                    f'при проверке {actual[key]}'
+                )
+                break
+    elif not replay.truncated and field.game_status() == 'game':
+        # старые логи писались только после конца игры
+        result['divergence'] = 'лог кончился, а игра ещё идёт'
+    return result
+
+
+def iter_logs(directory: str) -> Iterator[str]:
+    """Пути к логам в папке, без чтения всего списка в память"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith((EXTENSION, '.pkl')):
+                yield entry.path
+
+
+def verify_dir(
+        directory: str = 'logs',
+        workers: Optional[int] = None,
+        window: int = 64,
+) -> Iterator[dict]:
+    """
+    Проверяет все логи папки в пуле процессов.
+    В работе одновременно не больше window логов,
+    результаты отдаются по мере готовности в порядке файлов.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for path in iter_logs(directory):
+            pending.append(executor.submit(verify_file, path))
+            if len(pending) >= window:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('directory', nargs='?', default='logs')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    total = diverged = 0
+    for result in verify_dir(args.directory, workers=args.workers):
+        total += 1
+        if result['divergence']:
+            diverged += 1
+            print(f"{result['path']}: {result['divergence']}")
+    elapsed = perf_counter() - start
+
+    print(f'Проверено {total} логов, расхождений: {diverged}')
+    if elapsed:
+        print(f'{total / elapsed:.1f} сессий/с')